@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import itertools
+import json
+
+from PyQt6.QtWebEngineCore import QWebEngineScript
+
+from .config import get_config
+
+# World in which the adapter helpers live: isolated from the site's own scripts,
+# but sharing the DOM, so dispatched events still reach the site's listeners.
+ADAPTER_WORLD = QWebEngineScript.ScriptWorldId.ApplicationWorld
+ADAPTER_SCRIPT_NAME = "ai_dock_adapters"
+# Python-side bridge event sent to listeners when the page starts loading a new document
+LOAD_STARTED_EVENT = "load-started"
+
+# One entry per site: where the prompt box is, how to fill it and how to submit it.
+#   input:  "paragraph" (Quill/ProseMirror <p>), "value" (textarea), "html", or "auto"
+#   submit: "none" (leave it to the user), "enter", or "click:<css selector>"
+#   response: selectors of assistant messages (the last match is the newest one)
+#   busy: selector present only while the answer is still streaming
+#   batch_submit: submit strategy used by unattended batch runs (see batch.py)
+DEFAULT_SITE_ADAPTERS = {
+    "Gemini": {
+        "match": ["gemini.google.com"],
+        "selectors": ['div.ql-editor[contenteditable="true"]'],
+        "input": "paragraph",
+        "submit": "none",
+        "response": ["message-content .markdown", "message-content"],
+        "busy": 'button[aria-label*="Stop"]',
+        "batch_submit": "click:button.send-button",
+    },
+    "ChatGPT": {
+        "match": ["chatgpt.com", "chat.openai.com"],
+        "selectors": ["#prompt-textarea", "textarea"],
+        "input": "auto",
+        "submit": "none",
+        "response": ['[data-message-author-role="assistant"] .markdown', '[data-message-author-role="assistant"]'],
+        "busy": 'button[data-testid="stop-button"]',
+        "batch_submit": 'click:button[data-testid="send-button"]',
+    },
+    "Claude": {
+        "match": ["claude.ai"],
+        "selectors": ['div.ProseMirror[contenteditable="true"]', 'div[aria-label="Scrivi il tuo prompt per Claude"]', "textarea"],
+        "input": "paragraph",
+        "submit": "none",
+        "response": [".font-claude-response", ".font-claude-message"],
+        "busy": '[data-is-streaming="true"]',
+        "batch_submit": 'click:button[aria-label="Send message"]',
+    },
+    "Perplexity": {
+        "match": ["perplexity.ai"],
+        "selectors": ["textarea", 'div[contenteditable="true"]'],
+        "input": "auto",
+        "submit": "none",
+        "response": [".prose"],
+        "busy": 'button[aria-label*="Stop"]',
+        "batch_submit": 'click:button[aria-label="Submit"]',
+    },
+    "default": {
+        "match": [],
+        "selectors": ['div[aria-label="Scrivi il tuo prompt per Claude"]', "#prompt-textarea", "textarea"],
+        "input": "auto",
+        "submit": "none",
+        "response": [".markdown", ".prose"],
+        "busy": "",
+    },
+}
+
+ADAPTER_RUNTIME_JS = """
+(function() {
+    const ADAPTERS = __ADAPTERS__;
+    const VERSION = "__VERSION__";
+    if (window.__aiDock && window.__aiDock.version === VERSION) return;
+
+    function findInput(adapter) {
+        for (const selector of adapter.selectors || []) {
+            const el = document.querySelector(selector);
+            if (el) return el;
+        }
+        return null;
+    }
+    function dispatch(el, types) {
+        types.forEach(type => el.dispatchEvent(new Event(type, {bubbles: true, cancelable: true})));
+    }
+    const INPUT = {
+        paragraph(el, prompt) {
+            el.focus();
+            let p = el.querySelector('p');
+            if (!p) { el.innerHTML = '<p></p>'; p = el.querySelector('p'); }
+            p.textContent = prompt;
+            dispatch(el, ['keydown', 'input', 'keyup', 'change']);
+        },
+        value(el, prompt) {
+            el.value = prompt;
+            dispatch(el, ['input', 'change']);
+            el.focus();
+        },
+        html(el, prompt) {
+            el.innerHTML = prompt;
+            dispatch(el, ['input', 'change']);
+            el.focus();
+        },
+        auto(el, prompt) {
+            const isField = el.tagName === 'TEXTAREA' || el.tagName === 'INPUT';
+            (isField ? INPUT.value : INPUT.html)(el, prompt);
+        },
+    };
+    function submit(adapter, el, override) {
+        const strategy = override || adapter.submit || 'none';
+        if (strategy === 'enter') {
+            ['keydown', 'keypress', 'keyup'].forEach(type => el.dispatchEvent(new KeyboardEvent(type,
+                {key: 'Enter', code: 'Enter', keyCode: 13, which: 13, bubbles: true, cancelable: true})));
+        } else if (strategy.startsWith('click:')) {
+            setTimeout(() => {
+                const button = document.querySelector(strategy.slice(6));
+                if (button && !button.disabled) button.click();
+            }, adapter.submit_delay_ms || 300);
+        }
+    }
+
+    const dock = window.__aiDock = Object.assign(window.__aiDock || {}, {
+        version: VERSION,
+        adapters: ADAPTERS,
+        inject(name, prompt, submitOverride) {
+            const adapter = ADAPTERS[name] || ADAPTERS['default'];
+            const el = adapter && findInput(adapter);
+            if (!el) return false;
+            (INPUT[adapter.input] || INPUT.auto)(el, prompt);
+            submit(adapter, el, submitOverride);
+            return true;
+        },
+    });
+    dock.commands = dock.commands || {};
+    function lastResponse(adapter) {
+        for (const selector of adapter.response || []) {
+            const matches = document.querySelectorAll(selector);
+            if (matches.length) return matches[matches.length - 1];
+        }
+        return null;
+    }
+    // Reports the newest assistant message once it exists, no "busy" marker is
+    // shown and the DOM has been quiet for quiet_ms (streaming has stopped).
+    dock.commands.watchResponse = function(args) {
+        const adapter = ADAPTERS[args.adapter] || ADAPTERS['default'];
+        const previous = lastResponse(adapter);
+        const previousText = previous ? previous.innerText : '';
+        const quietMs = args.quiet_ms || 1500;
+        const started = Date.now();
+        let lastMutation = started;
+        const observer = new MutationObserver(() => { lastMutation = Date.now(); });
+        observer.observe(document.body, {childList: true, subtree: true, characterData: true});
+        const timer = setInterval(() => {
+            const current = lastResponse(adapter);
+            const isNew = current && (current !== previous || current.innerText !== previousText) && current.innerText.trim();
+            const busy = adapter.busy && document.querySelector(adapter.busy);
+            if (isNew && !busy && Date.now() - lastMutation >= quietMs) {
+                finish({html: current.innerHTML, text: current.innerText});
+            } else if (Date.now() - started > (args.timeout_ms || 180000)) {
+                finish({html: '', text: '', error: 'timeout'});
+            }
+        }, 250);
+        function finish(result) {
+            clearInterval(timer);
+            observer.disconnect();
+            result.token = args.token;
+            dock.push('response-complete', result);
+        }
+    };
+    dock.commands.inject = function(args) {
+        const ok = dock.inject(args.adapter, args.prompt, args.submit);
+        if (dock.push) dock.push('injected', {ok: ok, token: args.token});
+    };
+
+    // Tell Python once the prompt box of this site exists
+    const host = location.host;
+    const own = Object.keys(ADAPTERS).find(n => (ADAPTERS[n].match || []).some(h => host.includes(h))) || 'default';
+    function announceInput() {
+        if (!findInput(ADAPTERS[own])) return false;
+        if (dock.push) dock.push('input-ready', {adapter: own, version: VERSION});
+        return true;
+    }
+    if (!announceInput()) {
+        const observer = new MutationObserver(() => { if (announceInput()) observer.disconnect(); });
+        observer.observe(document.documentElement, {childList: true, subtree: true});
+        setTimeout(() => observer.disconnect(), 60000);
+    }
+})();
+"""
+
+_runtime = {}
+_inject_tokens = itertools.count(1)
+
+
+def get_site_adapters():
+    """
+    Built-in adapters with config["site_adapters"] merged over them key by key, so an
+    override such as {"ChatGPT": {"selectors": [...]}} keeps the rest of the built-in entry.
+    """
+    adapters = {name: dict(adapter) for name, adapter in DEFAULT_SITE_ADAPTERS.items()}
+    for name, overrides in get_config().get("site_adapters", {}).items():
+        if isinstance(overrides, dict):
+            adapters.setdefault(name, {}).update(overrides)
+    return adapters
+
+
+def get_runtime():
+    """Returns (version, source) of the adapter runtime, built once per adapter configuration."""
+    if not _runtime:
+        adapters_json = json.dumps(get_site_adapters(), sort_keys=True)
+        version = hashlib.sha1(adapters_json.encode("utf-8")).hexdigest()[:12]
+        _runtime["version"] = version
+        _runtime["source"] = ADAPTER_RUNTIME_JS.replace("__ADAPTERS__", adapters_json).replace("__VERSION__", version)
+    return _runtime["version"], _runtime["source"]
+
+
+def resolve_adapter_name(site_name, url=""):
+    """Picks the adapter for a dock: by site name first, then by host, then 'default'."""
+    adapters = get_site_adapters()
+    if site_name in adapters:
+        return site_name
+    for name, adapter in adapters.items():
+        if any(host in url for host in adapter.get("match", [])):
+            return name
+    return "default"
+
+
+def install_adapter_scripts(profile):
+    """(Re)installs the adapter runtime as a profile-wide QWebEngineScript."""
+    _runtime.clear()
+    _version, source = get_runtime()
+    scripts = profile.scripts()
+    for old_script in scripts.find(ADAPTER_SCRIPT_NAME):
+        scripts.remove(old_script)
+    script = QWebEngineScript()
+    script.setName(ADAPTER_SCRIPT_NAME)
+    script.setSourceCode(source)
+    script.setInjectionPoint(QWebEngineScript.InjectionPoint.DocumentReady)
+    script.setWorldId(ADAPTER_WORLD)
+    script.setRunsOnSubFrames(False)
+    scripts.insert(script)
+
+
+def call_adapter(page, expression, callback=None):
+    """
+    Runs a short call against window.__aiDock. Pages loaded before the runtime was
+    (re)installed get the runtime once, then the call is retried.
+    """
+    version, source = get_runtime()
+    guarded = f'(window.__aiDock && window.__aiDock.version === "{version}") ? ({expression}) : null'
+
+    def on_result(result):
+        if result is None:
+            page.runJavaScript(source + ";" + expression, ADAPTER_WORLD, callback or (lambda _r: None))
+        elif callback:
+            callback(result)
+
+    page.runJavaScript(guarded, ADAPTER_WORLD, on_result)
+
+
+def _await_reply(bridge, event, token, on_reply, on_reload):
+    """
+    Calls on_reply(payload) for the `event` carrying token, or on_reload() if the page
+    starts loading another document first. Either way both listeners are removed.
+    """
+    def finish():
+        bridge.off(event, on_event)
+        bridge.off(LOAD_STARTED_EVENT, on_load_started)
+
+    def on_event(payload):
+        payload = payload or {}
+        if payload.get("token") != token:
+            return
+        finish()
+        on_reply(payload)
+
+    def on_load_started(_payload):
+        finish()
+        on_reload()
+
+    bridge.on(event, on_event)
+    bridge.on(LOAD_STARTED_EVENT, on_load_started)
+
+
+def inject_prompt(page, site_name, prompt, callback=None, submit=None):
+    """
+    Fills the site's prompt box with a single small call into the installed adapter:
+    over the page's QWebChannel bridge when it is connected, else via runJavaScript.
+    submit overrides the adapter's submit strategy (e.g. "enter").
+    """
+    adapter_name = resolve_adapter_name(site_name, page.url().toString())
+    bridge = getattr(page, "_ai_dock_bridge", None)
+    version, _source = get_runtime()
+    input_ready = bridge.last_event("input-ready") if bridge is not None else None
+    if bridge is not None and bridge.ready and (input_ready or {}).get("version") == version:
+        token = next(_inject_tokens)
+        _await_reply(bridge, "injected", token,
+                     lambda payload: callback and callback(bool(payload.get("ok"))),
+                     lambda: callback and callback(False))
+        bridge.call("inject", adapter=adapter_name, prompt=prompt, token=token, submit=submit)
+        return
+    call_adapter(page, f"window.__aiDock.inject({json.dumps(adapter_name)}, {json.dumps(prompt)}, {json.dumps(submit)})",
+                 callback)
+
+
+def batch_submit_strategy(site_name, url=""):
+    """Submit strategy for unattended runs: the adapter's batch_submit, else its submit, else Enter."""
+    adapter = get_site_adapters().get(resolve_adapter_name(site_name, url), {})
+    if adapter.get("batch_submit"):
+        return adapter["batch_submit"]
+    return adapter["submit"] if adapter.get("submit", "none") != "none" else "enter"
+
+
+def watch_response(page, site_name, callback, timeout_ms=180000, quiet_ms=1500):
+    """
+    Asks the page to report the next completed assistant message. callback receives
+    {"html", "text", "error"}; the page is kept Active (not frozen) while waiting.
+    """
+    bridge = getattr(page, "_ai_dock_bridge", None)
+    if bridge is None:
+        callback({"html": "", "text": "", "error": "no bridge"})
+        return
+    adapter_name = resolve_adapter_name(site_name, page.url().toString())
+    token = next(_inject_tokens)
+
+    def on_complete(payload):
+        page._ai_dock_busy = False
+        callback(payload)
+
+    def on_reload():
+        page._ai_dock_busy = False
+        callback({"html": "", "text": "", "error": "the page was reloaded"})
+
+    page._ai_dock_busy = True
+    _await_reply(bridge, "response-complete", token, on_complete, on_reload)
+    bridge.call("watchResponse", adapter=adapter_name, token=token, timeout_ms=timeout_ms, quiet_ms=quiet_ms)
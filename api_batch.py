@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import hashlib
+import http.client
+import json
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from aqt import mw
+
+from .config import get_config, get_config_section
+from .direct_api import ApiError, api_site_settings, completions_url, is_api_site, markdown_to_html, stream_chat
+from .registry import dock_registry
+
+def api_batch_settings():
+    return get_config_section("api_batch")
+
+
+class TokenBucket:
+    """Token bucket rate limiter; only used from the engine's event loop, so it needs no lock."""
+
+    def __init__(self, per_minute, burst):
+        self.rate = max(per_minute, 1) / 60.0
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def _dedupe_key(site, prompt):
+    settings = api_site_settings(site)
+    identity = [completions_url(site), settings["model"], settings["system_prompt"], settings["temperature"], prompt]
+    return hashlib.sha1(json.dumps(identity).encode("utf-8")).hexdigest()
+
+
+class ApiBatchEngine:
+    """
+    Batch engine for Direct API sites. An asyncio loop on its own thread (outside
+    the Qt loop) runs the requests with bounded concurrency, a token bucket per
+    endpoint, exponential backoff on 429/5xx and deduplication of identical
+    requests; results are handed back to the main thread in batches.
+
+    The blocking http.client requests of direct_api run on a thread pool sized to
+    the concurrency limit, so they keep using the pooled keep-alive connections.
+    """
+
+    def __init__(self, deliver=None):
+        self._deliver = deliver
+        self._loop = None
+        self._thread = None
+        self._executor = None
+        self._semaphore = None
+        self._buckets = {}
+        self._inflight = {}
+        self._results = []
+        self._lock = threading.Lock()
+        self._completions = deque(maxlen=500)
+        self._turn = 0
+        # Bumped by shutdown(): results of an earlier loop are no longer delivered
+        self._generation = 0
+        self.runners = []
+        self.outstanding = 0
+        self.stats = {"submitted": 0, "completed": 0, "failed": 0, "retried": 0,
+                      "rate_limited": 0, "deduplicated": 0}
+
+    # --- Main thread ---
+
+    def submit_job(self, site_name, site, prompt, callback):
+        """Queues one request to a Direct API site; callback(text, error) is called on the main thread."""
+        self._ensure_loop()
+        self.stats["submitted"] += 1
+        asyncio.run_coroutine_threadsafe(self._run_job(site_name, site, prompt, callback), self._loop)
+
+    def submit(self, runner):
+        """Runs a batch (see batch.BatchRunner) through the engine."""
+        self.runners.append(runner)
+        self.dispatch()
+
+    def dispatch(self):
+        """Feeds jobs of the running batches, round-robin, keeping about two per request slot queued."""
+        self.runners = [r for r in self.runners if not r.finished]
+        limit = api_batch_settings()["concurrency"] * 2
+        runnable = [r for r in self.runners if r.runnable()]
+        while self.outstanding < limit and runnable:
+            self._turn = (self._turn + 1) % len(runnable)
+            runner = runnable[self._turn]
+            job = runner.next_job()
+            if job is None:
+                runnable.remove(runner)
+                continue
+            nid, prompt = job
+            site_name = runner.spec["site_name"]
+            site = get_config().get("ai_sites", {}).get(site_name)
+            if not is_api_site(site):
+                runner.job_failed(nid, "the service is no longer a Direct API site", in_flight=True)
+                continue
+            self.outstanding += 1
+            self.submit_job(site_name, site, prompt, lambda text, error, r=runner, n=nid: self._job_done(r, n, text, error))
+        dock_registry.show_status(self.describe_metrics(), active=bool(self.runners))
+
+    def shutdown(self):
+        for runner in self.runners:
+            runner.paused = True
+        self.runners = []
+        # The jobs still in flight are abandoned: nothing of them may reach the next profile
+        self._generation += 1
+        self.outstanding = 0
+        with self._lock:
+            self._results = []
+        self._inflight = {}
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._executor.shutdown(wait=False)
+            self._loop = self._thread = self._executor = None
+
+    def describe_metrics(self):
+        now = time.monotonic()
+        stats = self.stats
+        # The engine thread appends completions while this runs on the main thread
+        with self._lock:
+            completions = list(self._completions)
+        latencies = sorted(elapsed for _at, elapsed in completions)
+        per_minute = sum(1 for at, _elapsed in completions if now - at <= 60)
+        latency = (f"p50 {latencies[int(0.50 * (len(latencies) - 1))]:.1f} s, "
+                   f"p95 {latencies[int(0.95 * (len(latencies) - 1))]:.1f} s, ") if latencies else ""
+        return (f"api: {per_minute} req/min, {latency}{stats['completed']} ok, {stats['failed']} failed, "
+                f"{stats['retried']} retried ({stats['rate_limited']} rate limited), "
+                f"{stats['deduplicated']} deduplicated, {self.outstanding} queued")
+
+    def _job_done(self, runner, nid, text, error):
+        self.outstanding -= 1
+        if error:
+            runner.job_failed(nid, error, in_flight=True)
+        else:
+            runner.job_succeeded(nid, markdown_to_html(text))
+
+    def _on_results(self, results, generation):
+        if generation != self._generation:
+            return
+        for callback, text, error in results:
+            try:
+                callback(text, error)
+            except Exception as e:
+                print(f"DEBUG: AI Dock API batch callback failed: {e}")
+        self.dispatch()
+
+    def _ensure_loop(self):
+        if self._loop is not None:
+            return
+        settings = api_batch_settings()
+        self._executor = ThreadPoolExecutor(max_workers=settings["concurrency"], thread_name_prefix="ai_dock_api_batch")
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, args=(self._loop, settings, self._generation), daemon=True,
+                                        name="ai_dock_api_batch_loop")
+        self._thread.start()
+
+    # --- Engine thread ---
+
+    def _run_loop(self, loop, settings, generation):
+        asyncio.set_event_loop(loop)
+        self._semaphore = asyncio.Semaphore(settings["concurrency"])
+        loop.create_task(self._deliver_periodically(settings["deliver_every_s"], generation))
+        loop.run_forever()
+        # Stopped by shutdown(): cancel what is still pending before closing the loop
+        pending = asyncio.all_tasks(loop)
+        for task in pending:
+            task.cancel()
+        loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        loop.close()
+
+    def _bucket(self, site_name, site):
+        key = completions_url(site)
+        if key not in self._buckets:
+            settings = api_batch_settings()
+            limits = settings["rate_limits"].get(site_name, {})
+            self._buckets[key] = TokenBucket(limits.get("requests_per_minute", settings["requests_per_minute"]),
+                                             limits.get("burst", settings["burst"]))
+        return self._buckets[key]
+
+    async def _run_job(self, site_name, site, prompt, callback):
+        key = _dedupe_key(site, prompt)
+        # The table of this loop: shutdown() replaces self._inflight for the next one
+        inflight = self._inflight
+        pending = inflight.get(key)
+        if pending is not None:
+            # Same request already on its way: share its answer
+            self.stats["deduplicated"] += 1
+            text, error = await pending
+        else:
+            pending = inflight[key] = asyncio.get_running_loop().create_future()
+            try:
+                text, error = await self._request_with_retries(site_name, site, prompt)
+            except Exception as e:
+                text, error = "", str(e)
+            finally:
+                inflight.pop(key, None)
+            pending.set_result((text, error))
+        with self._lock:
+            self._results.append((callback, text, error))
+
+    async def _request_with_retries(self, site_name, site, prompt):
+        settings = api_batch_settings()
+        bucket = self._bucket(site_name, site)
+        loop = asyncio.get_running_loop()
+        error = None
+        for attempt in range(settings["max_retries"] + 1):
+            await bucket.acquire()
+            retry_after = None
+            async with self._semaphore:
+                started = time.monotonic()
+                try:
+                    text = await loop.run_in_executor(self._executor, stream_chat, site, prompt, lambda _delta: None,
+                                                      None, False)
+                    with self._lock:
+                        self._completions.append((time.monotonic(), time.monotonic() - started))
+                    self.stats["completed"] += 1
+                    return text, None
+                except ApiError as e:
+                    error = e
+                    retryable = e.status == 429 or (e.status or 0) >= 500
+                    retry_after = e.retry_after
+                    if e.status == 429:
+                        self.stats["rate_limited"] += 1
+                except (OSError, http.client.HTTPException) as e:
+                    error, retryable = e, True
+                except (ValueError, KeyError, IndexError) as e:
+                    error, retryable = f"bad response: {e}", False
+            if not retryable or attempt == settings["max_retries"]:
+                break
+            self.stats["retried"] += 1
+            backoff = min(settings["backoff_max_s"], settings["backoff_base_s"] * 2 ** attempt)
+            # A server-sent Retry-After is honoured up to backoff_max_s, not for as long as it asks
+            await asyncio.sleep(min(retry_after, settings["backoff_max_s"]) if retry_after
+                                else backoff * random.uniform(0.5, 1.0))
+        self.stats["failed"] += 1
+        return "", str(error)
+
+    async def _deliver_periodically(self, interval, generation):
+        while True:
+            await asyncio.sleep(interval)
+            with self._lock:
+                results, self._results = self._results, []
+            if results:
+                deliver = self._deliver or mw.taskman.run_on_main
+                deliver(lambda r=results: self._on_results(r, generation))
+
+
+# Istanza globale del motore
+api_batch_engine = ApiBatchEngine()
@@ -0,0 +1,687 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import time
+from collections import deque
+
+from anki.errors import NotFoundError
+from anki.utils import ids2str, strip_html
+from aqt import mw
+from aqt.operations import CollectionOp
+from aqt.qt import (
+    QComboBox,
+    QDialog,
+    QDialogButtonBox,
+    QFormLayout,
+    QHBoxLayout,
+    QLabel,
+    QProgressBar,
+    QPushButton,
+    QTimer,
+    QUrl,
+    QVBoxLayout,
+)
+from aqt.utils import askUser, showWarning, tooltip
+from PyQt6.QtWebEngineCore import QWebEnginePage
+
+from .adapters import batch_submit_strategy, inject_prompt, watch_response
+from .api_batch import api_batch_engine
+from .config import get_config, get_config_section
+from .direct_api import is_api_site, site_url
+from .fields import field_cache
+from .dock import get_persistent_ai_dock_profile
+from .registry import dock_registry
+from .sanitizer import sanitize_html, sanitizer_settings
+from .templates import NoteContext, TemplateError, compile_template
+from .webpool import page_pool
+
+JOURNAL_DIR = "ai_dock_batches"
+# Failures worth another attempt on a fresh page (the others would fail the same way)
+RENDERER_GONE = "the page's renderer stopped"
+RETRYABLE_ERRORS = ("timeout", "empty response", "the AI site did not become ready", RENDERER_GONE)
+
+
+def batch_settings():
+    return get_config_section("batch")
+
+
+def journal_dir():
+    path = os.path.join(mw.pm.profileFolder(), JOURNAL_DIR)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def new_journal():
+    return BatchJournal(os.path.join(journal_dir(), f"{int(time.time() * 1000)}.jsonl"))
+
+
+def unfinished_journals():
+    """(journal, state) of every batch that was interrupted before finishing."""
+    found = []
+    for name in sorted(os.listdir(journal_dir())):
+        if name.endswith(".jsonl"):
+            journal = BatchJournal(os.path.join(journal_dir(), name))
+            state = journal.load()
+            if state is not None:
+                found.append((journal, state))
+    return found
+
+
+class BatchJournal:
+    """
+    Append-only JSON Lines journal of a batch run, so an interrupted run (crash,
+    Anki closed) can be resumed: the first line describes the batch, the
+    following ones record each answer, failure and write-back.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def start(self, spec, note_ids):
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"type": "batch", "spec": spec, "note_ids": note_ids, "started": time.time()}) + "\n")
+
+    def record_result(self, nid, html):
+        self._append({"type": "result", "nid": nid, "html": html})
+
+    def record_error(self, nid, error):
+        self._append({"type": "error", "nid": nid, "error": error})
+
+    def record_applied(self, nids):
+        self._append({"type": "applied", "nids": list(nids)})
+
+    def record_finished(self):
+        self._append({"type": "finished"})
+
+    def _append(self, record):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def load(self):
+        """Returns the state of the journalled batch, or None if there is no unfinished one."""
+        if not os.path.exists(self.path):
+            return None
+        state = None
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # riga troncata da un'interruzione
+                kind = record.get("type")
+                if kind == "batch":
+                    state = {"spec": record["spec"], "note_ids": record["note_ids"],
+                             "results": {}, "errors": {}, "applied": set(), "finished": False}
+                elif state is None:
+                    continue
+                elif kind == "result":
+                    state["results"][record["nid"]] = record["html"]
+                    state["errors"].pop(record["nid"], None)
+                elif kind == "error":
+                    state["errors"][record["nid"]] = record["error"]
+                elif kind == "applied":
+                    state["applied"].update(record["nids"])
+                elif kind == "finished":
+                    state["finished"] = True
+        if state is None or state["finished"]:
+            return None
+        return state
+
+
+class BatchRunner:
+    """
+    State of one batch: the notes still to process, the answers waiting to be
+    written back and the progress counters. The notes themselves are processed
+    by the workers of batch_scheduler (web sites) or by api_batch_engine (Direct
+    API sites); answers are written back in batches of
+    col.update_notes that are merged into a single undo entry. Only consecutive
+    write-backs are merged: after any other change to the collection (e.g. the
+    user editing a note meanwhile) the batch continues in a new undo entry, so
+    undoing the batch never undoes the user's own edits.
+    """
+
+    def __init__(self, spec, note_ids, journal, unapplied=None, total=None):
+        self.spec = spec
+        self.journal = journal
+        self.settings = batch_settings()
+        self.total = total or len(note_ids)
+        self.queue = deque(note_ids)
+        self.pending = dict(unapplied or {})
+        self.done = self.total - len(self.queue)
+        self.failed = 0
+        self.attempts = {}
+        self.in_flight = 0
+        self.paused = False
+        self.cancelled = False
+        self.finished = False
+        self.listeners = []
+        self._undo_entry = None
+        self._started = time.monotonic()
+        site = get_config().get("ai_sites", {}).get(spec["site_name"])
+        self.scheduler = api_batch_engine if is_api_site(site) else batch_scheduler
+
+    @property
+    def site_url(self):
+        return self.spec["site_url"]
+
+    def runnable(self):
+        return bool(self.queue) and not (self.paused or self.cancelled or self.finished)
+
+    def pause(self):
+        self.paused = True
+        self._notify()
+
+    def resume(self):
+        if not self.paused:
+            return
+        self.paused = False
+        self._notify()
+        self.scheduler.dispatch()
+
+    def cancel(self):
+        self.cancelled = True
+        self.queue.clear()
+        self._finish_if_done()
+
+    def describe_progress(self):
+        elapsed = time.monotonic() - self._started
+        state = "paused" if self.paused else ("finished" if self.finished else "running")
+        return (f"{self.done}/{self.total} notes, {self.failed} failed, {self.in_flight} in flight, "
+                f"{len(self.pending)} waiting to be saved ({state}, {elapsed:.0f} s)")
+
+    def next_job(self):
+        """Pops the next note and builds its prompt; returns (nid, prompt) or None if nothing is left."""
+        template = compile_template(self.spec["template"])
+        while self.runnable():
+            nid = self.queue.popleft()
+            try:
+                note = mw.col.get_note(nid)
+            except NotFoundError:
+                self.job_failed(nid, "note deleted")
+                continue
+            source_field = self.spec["source_field"]
+            text = strip_html(note[source_field]).strip() if source_field in note else ""
+            if template.uses_selection and not text:
+                self.job_failed(nid, f"empty field '{source_field}'")
+                continue
+            prompt = template.render(NoteContext(note, text))
+            if not prompt.strip():
+                self.job_failed(nid, "empty prompt")
+                continue
+            self.in_flight += 1
+            self.attempts[nid] = self.attempts.get(nid, 0) + 1
+            return nid, prompt
+        return None
+
+    def job_succeeded(self, nid, html):
+        self.in_flight -= 1
+        self.journal.record_result(nid, html)
+        self.pending[nid] = html
+        self.done += 1
+        if len(self.pending) >= self.settings["apply_every"]:
+            self._apply()
+        self._notify()
+        self._finish_if_done()
+
+    def job_failed(self, nid, error, in_flight=False):
+        """Records a failed job; returns True if the note was queued again for another attempt."""
+        if in_flight:
+            self.in_flight -= 1
+        if in_flight and error in RETRYABLE_ERRORS and not self.cancelled and self.attempts[nid] <= self.settings["retries"]:
+            # Torna in fondo alla coda, così un sito lento non blocca le altre note
+            print(f"DEBUG: AI Dock batch note {nid} will be retried: {error}")
+            self.queue.append(nid)
+            return True
+        print(f"DEBUG: AI Dock batch note {nid} failed: {error}")
+        self.journal.record_error(nid, error)
+        self.failed += 1
+        self.done += 1
+        self._notify()
+        self._finish_if_done()
+        return False
+
+    def _notify(self):
+        for listener in list(self.listeners):
+            listener(self)
+
+    def _apply(self, on_done=None):
+        """Writes the buffered answers back to the collection in one CollectionOp."""
+        if not self.pending:
+            if on_done:
+                on_done()
+            return
+        answers, self.pending = self.pending, {}
+        target_field = self.spec["target_field"]
+        undo_name = f"AI Dock: {self.spec['prompt_name']}"
+        sanitizer = sanitizer_settings()
+
+        def op(col):
+            notes = []
+            for nid, html in answers.items():
+                if sanitizer["enabled"]:
+                    html = sanitize_html(html, sanitizer)
+                try:
+                    note = col.get_note(nid)
+                except NotFoundError:
+                    continue
+                if target_field not in note:
+                    continue
+                current = note[target_field]
+                note[target_field] = current + "<br>" + html if current and not current.isspace() else html
+                notes.append(note)
+            if self._undo_entry is not None and col.undo_status().last_step != self._undo_entry:
+                # L'utente ha modificato la collezione nel frattempo: fondere ora porterebbe
+                # le sue modifiche dentro la voce del batch, quindi se ne apre una nuova
+                print("DEBUG: AI Dock batch starts a new undo entry after other changes")
+                self._undo_entry = None
+            if self._undo_entry is None:
+                self._undo_entry = col.add_custom_undo_entry(undo_name)
+            changes = col.update_notes(notes)
+            try:
+                # Tutte le scritture del batch confluiscono in un'unica voce di annullamento
+                return col.merge_undo_entries(self._undo_entry)
+            except Exception as e:
+                print(f"DEBUG: AI Dock batch could not merge undo entries: {e}")
+                self._undo_entry = None
+                return changes
+
+        def on_success(_changes):
+            self.journal.record_applied(answers.keys())
+            self._notify()
+            if on_done:
+                on_done()
+
+        CollectionOp(parent=mw, op=op).success(on_success).run_in_background()
+
+    def _finish_if_done(self):
+        if self.finished or self.in_flight or (self.queue and not self.cancelled):
+            return
+        self.finished = True
+
+        def on_applied():
+            if not self.cancelled:
+                self.journal.record_finished()
+            tooltip(f"AI Dock batch {'cancelled' if self.cancelled else 'finished'}: {self.describe_progress()}")
+            self._notify()
+
+        self._apply(on_applied)
+        QTimer.singleShot(0, self.scheduler.dispatch)
+
+
+class BatchWorker:
+    """
+    One off-screen page of the shared profile that processes one job at a time.
+    on_finished(worker, runner, nid, html, error, elapsed) is called after each job.
+    """
+
+    def __init__(self, site_url, on_finished):
+        self.site_url = site_url
+        self.on_finished = on_finished
+        self.page = page_pool.checkout(get_persistent_ai_dock_profile(), site_url, prewarm=False)
+        # Pooled pages may have been frozen by the lifecycle manager while idle
+        self.page.setLifecycleState(QWebEnginePage.LifecycleState.Active)
+        self.page.loadFinished.connect(self._on_load_finished)
+        self.page.renderProcessTerminated.connect(self._on_render_process_terminated)
+        self.runner = None
+        self.nid = None
+        self._step = 0
+        self._after_load = None
+        self._started = None
+        self._needs_reload = False
+        # Python-side deadline of the current job: the page may reload, navigate or crash
+        # after injection, and then its own JS timeout never reports back
+        self._watchdog = QTimer()
+        self._watchdog.setSingleShot(True)
+        self._watchdog.timeout.connect(self._on_watchdog)
+        self._watchdog_error = None
+
+    @property
+    def busy(self):
+        return self.runner is not None
+
+    def run(self, runner, nid, prompt):
+        self.runner, self.nid = runner, nid
+        self._step += 1
+        self._started = time.monotonic()
+        step = self._step
+        self._arm_watchdog(runner.settings["ready_timeout_s"], "the AI site did not become ready")
+        if runner.settings["new_chat_per_job"] or self._needs_reload:
+            # Ricarica il sito per iniziare una nuova conversazione per ogni nota
+            self._needs_reload = False
+            self._after_load = lambda: self._try_inject(step, prompt, time.monotonic())
+            self.page.load(QUrl(self.site_url))
+        else:
+            self._try_inject(step, prompt, time.monotonic())
+
+    def release(self):
+        """Returns the page to the pool."""
+        self._step += 1
+        self._watchdog.stop()
+        self.page.loadFinished.disconnect(self._on_load_finished)
+        self.page.renderProcessTerminated.disconnect(self._on_render_process_terminated)
+        self.page._ai_dock_busy = False
+        page_pool.checkin(self.page, self.site_url)
+        self.page = None
+
+    def _on_load_finished(self, _ok):
+        continuation, self._after_load = self._after_load, None
+        if continuation:
+            continuation()
+
+    def _on_render_process_terminated(self, _status, _exit_code):
+        self._needs_reload = True
+        if self.busy:
+            self._complete(self._step, error=RENDERER_GONE)
+
+    def _arm_watchdog(self, seconds, error):
+        self._watchdog_error = error
+        self._watchdog.start(int(seconds * 1000))
+
+    def _on_watchdog(self):
+        if self.busy:
+            # The page is in an unknown state: start the next job from a fresh load
+            self._needs_reload = True
+            self._complete(self._step, error=self._watchdog_error)
+
+    def _try_inject(self, step, prompt, since):
+        """Injects the prompt once the bridge and the prompt box are up, retrying until ready_timeout_s."""
+        if step != self._step:
+            return
+        runner = self.runner
+        site_name = runner.spec["site_name"]
+        bridge = getattr(self.page, "_ai_dock_bridge", None)
+
+        def retry_or_fail():
+            if time.monotonic() - since > runner.settings["ready_timeout_s"]:
+                self._complete(step, error="the AI site did not become ready")
+            else:
+                QTimer.singleShot(1000, lambda: self._try_inject(step, prompt, since))
+
+        if bridge is None or not bridge.ready:
+            retry_or_fail()
+            return
+
+        def on_injected(success):
+            if step != self._step:
+                return
+            if not success:
+                retry_or_fail()
+                return
+            self._arm_watchdog(runner.settings["job_timeout_s"], "timeout")
+            watch_response(self.page, site_name, lambda result: self._on_response(step, result),
+                           timeout_ms=runner.settings["job_timeout_s"] * 1000)
+
+        inject_prompt(self.page, site_name, prompt, on_injected, submit=batch_submit_strategy(site_name, self.site_url))
+
+    def _on_response(self, step, result):
+        if result.get("error") or not result.get("html"):
+            self._complete(step, error=result.get("error") or "empty response")
+        else:
+            self._complete(step, html=result["html"])
+
+    def _complete(self, step, html=None, error=None):
+        if step != self._step:
+            return
+        # Later callbacks of this job (watchdog, a late response) are ignored from now on
+        self._step += 1
+        self._watchdog.stop()
+        runner, nid = self.runner, self.nid
+        self.runner = self.nid = None
+        self.on_finished(self, runner, nid, html, error, time.monotonic() - self._started)
+
+
+class BatchScheduler:
+    """
+    Fans the jobs of every running batch out over a pool of off-screen pages:
+    at most batch.workers pages overall and batch.max_pages_per_site per site,
+    with batches served round-robin so a large batch cannot starve a small one.
+    Keeps throughput and latency metrics of completed jobs.
+    """
+
+    def __init__(self):
+        self.runners = []
+        self.workers = []
+        self._turn = 0
+        self._completions = deque(maxlen=500)
+        self.stats = {"completed": 0, "failed": 0, "retried": 0}
+
+    def submit(self, runner):
+        self.runners.append(runner)
+        self.dispatch()
+
+    def dispatch(self):
+        """Starts jobs while there are free worker slots, then releases pages nobody needs."""
+        settings = batch_settings()
+        self.runners = [r for r in self.runners if not r.finished]
+        while True:
+            worker, runner = self._pick(settings)
+            if worker is None:
+                break
+            job = runner.next_job()
+            if job is None:
+                continue
+            worker.run(runner, *job)
+        for worker in [w for w in self.workers if not w.busy and not self._wanted(w.site_url)]:
+            worker.release()
+            self.workers.remove(worker)
+        dock_registry.show_status(self.describe_metrics(), active=bool(self.runners or self.workers))
+
+    def job_finished(self, worker, runner, nid, html, error, elapsed):
+        if error is None:
+            self._completions.append((time.monotonic(), elapsed))
+            self.stats["completed"] += 1
+            runner.job_succeeded(nid, html)
+        else:
+            retried = runner.job_failed(nid, error, in_flight=True)
+            self.stats["retried" if retried else "failed"] += 1
+        QTimer.singleShot(0, self.dispatch)
+
+    def shutdown(self):
+        """Pauses every batch and returns the worker pages (the journals allow resuming later)."""
+        for runner in self.runners:
+            runner.paused = True
+        for worker in self.workers:
+            worker.release()
+        self.runners, self.workers = [], []
+
+    def describe_metrics(self):
+        now = time.monotonic()
+        latencies = sorted(elapsed for _at, elapsed in self._completions)
+        per_minute = sum(1 for at, _elapsed in self._completions if now - at <= 60)
+        if not latencies:
+            return f"batch: {len(self.workers)} pages, no completed jobs yet"
+        p50 = latencies[int(0.50 * (len(latencies) - 1))]
+        p95 = latencies[int(0.95 * (len(latencies) - 1))]
+        return (f"batch: {per_minute} jobs/min, p50 {p50:.1f} s, p95 {p95:.1f} s, "
+                f"{len(self.workers)} pages, {self.stats['failed']} failed, {self.stats['retried']} retried")
+
+    def _pick(self, settings):
+        """Next (worker, runner) pair in round-robin order, or (None, None) when no slot or job is free."""
+        runnable = [r for r in self.runners if r.runnable()]
+        for offset in range(len(runnable)):
+            runner = runnable[(self._turn + offset) % len(runnable)]
+            worker = self._worker_for(runner, settings)
+            if worker is not None:
+                self._turn = (self._turn + offset + 1) % len(runnable)
+                return worker, runner
+        return None, None
+
+    def _worker_for(self, runner, settings):
+        site_url = runner.site_url
+        site_workers = [w for w in self.workers if w.site_url == site_url]
+        idle = next((w for w in site_workers if not w.busy), None)
+        if idle is not None:
+            return idle
+        limit = settings["max_pages_per_site"].get(runner.spec["site_name"], settings["pages_per_site"])
+        if len(site_workers) >= limit:
+            return None
+        if len(self.workers) >= settings["workers"]:
+            # Cede una pagina inattiva di un altro sito, se ce n'è una
+            spare = next((w for w in self.workers if not w.busy), None)
+            if spare is None:
+                return None
+            spare.release()
+            self.workers.remove(spare)
+        worker = BatchWorker(site_url, self.job_finished)
+        self.workers.append(worker)
+        return worker
+
+    def _wanted(self, site_url):
+        return any(r.runnable() and r.site_url == site_url for r in self.runners)
+
+
+# Istanza globale dello scheduler
+batch_scheduler = BatchScheduler()
+
+
+class BatchSetupDialog(QDialog):
+    """Asks which prompt, source/target fields and AI site a batch should use."""
+
+    def __init__(self, parent, field_names):
+        super().__init__(parent)
+        self.setWindowTitle("Run Prompt over Selected Notes")
+        config = get_config()
+        self.prompts = config.get("prompts", [])
+        self.sites = config.get("ai_sites", {})
+        layout = QFormLayout(self)
+        self.prompt_combo = QComboBox()
+        self.prompt_combo.addItems([p["name"] for p in self.prompts])
+        layout.addRow("Prompt:", self.prompt_combo)
+        self.source_combo = QComboBox()
+        self.source_combo.addItems(field_names)
+        layout.addRow("Source field ({text}):", self.source_combo)
+        self.target_combo = QComboBox()
+        self.target_combo.addItems(field_names)
+        if config.get("target_field") in field_names:
+            self.target_combo.setCurrentText(config["target_field"])
+        layout.addRow("Target field:", self.target_combo)
+        self.site_combo = QComboBox()
+        self.site_combo.addItems(list(self.sites.keys()))
+        if config.get("last_choice") in self.sites:
+            self.site_combo.setCurrentText(config["last_choice"])
+        layout.addRow("AI service:", self.site_combo)
+        self.button_box = QDialogButtonBox(QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel)
+        self.button_box.accepted.connect(self.on_accept)
+        self.button_box.rejected.connect(self.reject)
+        layout.addRow(self.button_box)
+
+    def on_accept(self):
+        if not self.prompts or not self.sites:
+            showWarning("Configure at least one prompt and one AI service first.", parent=self); return
+        if self.source_combo.currentText() == self.target_combo.currentText():
+            showWarning("Source and target field must be different.", parent=self); return
+        try:
+            compile_template(self.prompts[self.prompt_combo.currentIndex()]["template"])
+        except TemplateError as e:
+            showWarning(f"Invalid prompt template: {e}", parent=self); return
+        self.accept()
+
+    def get_spec(self):
+        prompt = self.prompts[self.prompt_combo.currentIndex()]
+        site_name = self.site_combo.currentText()
+        return {"prompt_name": prompt["name"], "template": prompt["template"],
+                "source_field": self.source_combo.currentText(), "target_field": self.target_combo.currentText(),
+                "site_name": site_name, "site_url": site_url(self.sites[site_name])}
+
+
+class BatchProgressDialog(QDialog):
+    """Non-modal progress window with pause/resume and cancel."""
+
+    def __init__(self, parent, runner):
+        super().__init__(parent)
+        self.runner = runner
+        self.setWindowTitle(f"AI Dock batch: {runner.spec['prompt_name']}")
+        self.setMinimumWidth(420)
+        layout = QVBoxLayout(self)
+        self.status_label = QLabel()
+        layout.addWidget(self.status_label)
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setMaximum(max(1, runner.total))
+        layout.addWidget(self.progress_bar)
+        buttons = QHBoxLayout()
+        self.pause_button = QPushButton("Pause")
+        self.pause_button.clicked.connect(self.on_pause_clicked)
+        buttons.addWidget(self.pause_button)
+        self.cancel_button = QPushButton("Stop")
+        self.cancel_button.clicked.connect(self.on_cancel_clicked)
+        buttons.addWidget(self.cancel_button)
+        layout.addLayout(buttons)
+        runner.listeners.append(self.on_progress)
+        self.destroyed.connect(lambda *_args, r=runner, listener=self.on_progress:
+                               listener in r.listeners and r.listeners.remove(listener))
+        self.on_progress(runner)
+
+    def on_progress(self, runner):
+        self.progress_bar.setValue(runner.done)
+        self.status_label.setText(f"{runner.describe_progress()}\n{runner.scheduler.describe_metrics()}")
+        self.pause_button.setText("Resume" if runner.paused else "Pause")
+        if runner.finished:
+            self.pause_button.setEnabled(False)
+            self.cancel_button.setText("Close")
+
+    def on_pause_clicked(self):
+        if self.runner.paused:
+            self.runner.resume()
+        else:
+            self.runner.pause()
+
+    def on_cancel_clicked(self):
+        if not self.runner.finished:
+            self.runner.cancel()
+        self.close()
+
+
+def _field_names_for_notes(note_ids):
+    """Field names of every note type among note_ids, in note type order."""
+    field_names = []
+    for mid in mw.col.db.list(f"select distinct mid from notes where id in {ids2str(note_ids)}"):
+        for name in field_cache.for_notetype(mw.col.models.get(mid)).names:
+            if name not in field_names:
+                field_names.append(name)
+    return field_names
+
+
+def resumed_runner(journal, state):
+    """BatchRunner continuing a journalled batch: answered notes are not asked again, unsaved answers are saved."""
+    remaining = [nid for nid in state["note_ids"] if nid not in state["results"] and nid not in state["applied"]]
+    unapplied = {nid: html for nid, html in state["results"].items() if nid not in state["applied"]}
+    return BatchRunner(state["spec"], remaining, journal, unapplied, total=len(state["note_ids"]))
+
+
+def _start_runner(browser, runner):
+    dialog = BatchProgressDialog(browser, runner)
+    dialog.show()
+    runner.scheduler.submit(runner)
+
+
+def run_batch_from_browser(browser):
+    """Browser menu action: runs a prompt over the selected notes, offering first to resume interrupted batches."""
+    for journal, state in unfinished_journals():
+        if any(r.journal.path == journal.path for r in batch_scheduler.runners + api_batch_engine.runners):
+            continue
+        runner = resumed_runner(journal, state)
+        if askUser(f"An AI Dock batch ('{state['spec']['prompt_name']}') was interrupted with "
+                   f"{len(runner.queue)} notes left. Resume it?", parent=browser):
+            _start_runner(browser, runner)
+            return
+        # Declined: close the journal so the question is not asked again
+        journal.record_finished()
+
+    note_ids = list(browser.selected_notes())
+    if not note_ids:
+        tooltip("Select the notes to process first.")
+        return
+    dialog = BatchSetupDialog(browser, _field_names_for_notes(note_ids))
+    if not dialog.exec():
+        return
+    spec = dialog.get_spec()
+    journal = new_journal()
+    journal.start(spec, note_ids)
+    _start_runner(browser, BatchRunner(spec, note_ids, journal))
+
+
+def on_browser_menus_did_init(browser):
+    """Adds the batch action to the Browser's Notes menu."""
+    action = browser.form.menu_Notes.addAction("AI Dock: Run Prompt over Selected Notes...")
+    action.triggered.connect(lambda checked=False, b=browser: run_batch_from_browser(b))
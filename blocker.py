@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+import fnmatch
+import re
+import threading
+
+from PyQt6.QtWebEngineCore import QWebEngineUrlRequestInterceptor
+
+from .config import get_config_section
+
+
+def _host_suffixes(host):
+    """'a.b.example.com' -> 'a.b.example.com', 'b.example.com', 'example.com', 'com'."""
+    labels = host.split(".")
+    return (".".join(labels[i:]) for i in range(len(labels)))
+
+
+def _is_regex(entry):
+    return len(entry) > 2 and entry.startswith("/") and entry.endswith("/")
+
+
+def _entry_pattern(entry):
+    """(regex source, None) for a glob or /regex/ entry, or (None, error message) if it does not compile."""
+    pattern = entry[1:-1] if _is_regex(entry) else fnmatch.translate(entry)
+    try:
+        re.compile(pattern)
+    except re.error as e:
+        return None, str(e)
+    return pattern, None
+
+
+def invalid_entries(entries):
+    """(entry, error) for every glob or /regex/ entry that does not compile."""
+    invalid = []
+    for entry in entries:
+        entry = entry.strip()
+        if entry and not entry.startswith("#") and ("*" in entry or _is_regex(entry)):
+            _pattern, error = _entry_pattern(entry)
+            if error:
+                invalid.append((entry, error))
+    return invalid
+
+
+class Blocklist:
+    """
+    Compiled blocklist. Each entry is either a host (matching the host and all of
+    its subdomains), a glob containing '*' matched against the whole URL, or a
+    regular expression between slashes, e.g. /\\/collect\\?/.
+    Allow rules map a first-party site host to entries it may still load.
+    """
+
+    def __init__(self, entries, allow=None):
+        self.invalid = []
+        self.hosts, self.patterns = self._compile(entries)
+        self.allow = {site.lower(): self._compile(site_entries) for site, site_entries in (allow or {}).items()}
+
+    def _compile(self, entries):
+        hosts = set()
+        patterns = []
+        for entry in entries:
+            entry = entry.strip()
+            if not entry or entry.startswith("#"):
+                continue
+            if "*" in entry or _is_regex(entry):
+                pattern, error = _entry_pattern(entry)
+                if error:
+                    # A broken user entry must not take down the rest of the rules
+                    print(f"DEBUG: AI Dock blocklist entry {entry!r} ignored: {error}")
+                    self.invalid.append((entry, error))
+                else:
+                    patterns.append(pattern)
+            else:
+                hosts.add(entry.lower().lstrip("."))
+        if not patterns:
+            return hosts, ()
+        try:
+            # One alternation is much faster than trying each pattern in turn
+            return hosts, (re.compile("|".join(f"(?:{p})" for p in patterns)),)
+        except re.error:
+            # Patterns that are valid alone but not together (e.g. inline flags)
+            return hosts, tuple(re.compile(p) for p in patterns)
+
+    @staticmethod
+    def _matches(compiled, host, url):
+        hosts, patterns = compiled
+        if hosts and any(suffix in hosts for suffix in _host_suffixes(host)):
+            return True
+        return any(pattern.search(url) for pattern in patterns)
+
+    def should_block(self, host, url, first_party_host=""):
+        host = host.lower()
+        if not self._matches((self.hosts, self.patterns), host, url):
+            return False
+        first_party_host = first_party_host.lower()
+        for suffix in _host_suffixes(first_party_host) if first_party_host else ():
+            allowed = self.allow.get(suffix)
+            if allowed and self._matches(allowed, host, url):
+                return False
+        return True
+
+
+class RequestBlocker(QWebEngineUrlRequestInterceptor):
+    """
+    Request interceptor for the shared AI Dock profile. Runs on Chromium's IO
+    thread, so the rules are swapped atomically and the counters are locked.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._lock = threading.Lock()
+        self._enabled = True
+        self._blocklist = Blocklist([])
+        self.stats = {"seen": 0, "blocked": 0}
+        self.blocked_by_host = {}
+        self.reload_rules()
+
+    def reload_rules(self, change=None):
+        blocker_settings = get_config_section("request_blocker")
+        self._blocklist = Blocklist(blocker_settings["blocklist"], blocker_settings["allow"])
+        self._enabled = bool(blocker_settings["enabled"])
+
+    def interceptRequest(self, info):
+        if not self._enabled:
+            return
+        url = info.requestUrl()
+        blocked = self._blocklist.should_block(url.host(), url.toString(), info.firstPartyUrl().host())
+        with self._lock:
+            self.stats["seen"] += 1
+            if blocked:
+                self.stats["blocked"] += 1
+                self.blocked_by_host[url.host()] = self.blocked_by_host.get(url.host(), 0) + 1
+        if blocked:
+            info.block(True)
+
+    def describe_stats(self, top=5):
+        with self._lock:
+            seen, blocked = self.stats["seen"], self.stats["blocked"]
+            hosts = sorted(self.blocked_by_host.items(), key=lambda item: item[1], reverse=True)[:top]
+        lines = [f"Blocked {blocked} of {seen} requests"]
+        lines.extend(f"  {host}: {count}" for host, count in hosts)
+        lines.extend(f"Ignored invalid entry {entry}: {error}" for entry, error in self._blocklist.invalid)
+        return "\n".join(lines)
+
+
+def parse_allow_rules(text):
+    """Parses 'site.host: allowed.host other.host' lines into the allow mapping."""
+    allow = {}
+    for line in text.splitlines():
+        if ":" not in line:
+            continue
+        site, entries = line.split(":", 1)
+        if site.strip() and entries.split():
+            allow.setdefault(site.strip().lower(), []).extend(entries.split())
+    return allow
+
+
+def format_allow_rules(allow):
+    return "\n".join(f"{site}: {' '.join(entries)}" for site, entries in allow.items())
+
+
+_request_blocker = None
+
+
+def get_request_blocker():
+    """Creates and returns the single interceptor installed on the shared AI Dock profile."""
+    global _request_blocker
+    if _request_blocker is None:
+        _request_blocker = RequestBlocker()
+    return _request_blocker
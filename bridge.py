@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+
+import json
+import time
+
+from aqt.editor import Editor
+from aqt.reviewer import Reviewer
+from PyQt6.QtCore import QFile, QIODevice, QObject, pyqtSignal, pyqtSlot
+from PyQt6.QtWebChannel import QWebChannel
+from PyQt6.QtWebEngineCore import QWebEngineScript
+
+from .adapters import ADAPTER_WORLD, LOAD_STARTED_EVENT
+
+BRIDGE_OBJECT_NAME = "aiDockBridge"
+BRIDGE_SCRIPT_NAME = "ai_dock_webchannel"
+EDITOR_MESSAGE_PREFIX = "aidock:"
+
+# Runs in every dock page (same isolated world as the adapters). Connects to the
+# Python bridge, dispatches Python commands to window.__aiDock.commands and
+# pushes page events back, queueing them until the channel is up.
+DOCK_BRIDGE_JS = """
+(function() {
+    const dock = window.__aiDock = window.__aiDock || {};
+    dock.commands = dock.commands || {};
+    const queue = [];
+    dock.push = function(name, payload) {
+        const data = JSON.stringify(payload === undefined ? null : payload);
+        if (dock.bridge) dock.bridge.push(name, data); else queue.push([name, data]);
+    };
+    if (typeof QWebChannel === 'undefined' || !window.qt || !qt.webChannelTransport) return;
+    new QWebChannel(qt.webChannelTransport, function(channel) {
+        const bridge = channel.objects.__BRIDGE__;
+        if (!bridge) return;
+        bridge.command.connect(function(name, args) {
+            const fn = dock.commands[name];
+            if (typeof fn !== 'function') return;
+            try { fn(JSON.parse(args)); }
+            catch (e) { dock.push('error', {command: name, message: String(e)}); }
+        });
+        dock.bridge = bridge;
+        queue.splice(0).forEach(item => bridge.push(item[0], item[1]));
+        dock.push('bridge-ready', {url: location.href});
+    });
+
+    let selectionTimer = null;
+    document.addEventListener('selectionchange', function() {
+        clearTimeout(selectionTimer);
+        selectionTimer = setTimeout(function() {
+            const selection = window.getSelection();
+            let html = '';
+            if (selection.rangeCount > 0) {
+                const div = document.createElement('div');
+                div.appendChild(selection.getRangeAt(0).cloneContents());
+                html = div.innerHTML;
+            }
+            dock.push('selection', {text: selection.toString(), html: html});
+        }, 120);
+    });
+})();
+"""
+
+# Runs in the editor and reviewer pages. Anki already owns the QWebChannel of
+# those pages, so events travel through its pycmd() bridge instead.
+EDITOR_BRIDGE_JS = """
+(function() {
+    if (window.__aiDockBridge) return;
+    window.__aiDockBridge = {
+        commands: {},
+        push(name, payload) {
+            pycmd('__PREFIX__' + name + ':' + JSON.stringify(payload === undefined ? null : payload));
+        },
+        call(name, args) {
+            const fn = this.commands[name];
+            return typeof fn === 'function' ? fn(args) : null;
+        },
+    };
+})();
+"""
+
+
+class DockBridge(QObject):
+    """
+    Python side of the QWebChannel bridge of a dock page. Python calls small named
+    JS commands through the `command` signal; the page pushes events (selection,
+    input-ready, ...) through push(), which are dispatched to registered listeners.
+    """
+
+    command = pyqtSignal(str, str)
+
+    def __init__(self, page):
+        super().__init__(page)
+        self.ready = False
+        self.last_events = {}
+        self._listeners = {}
+        page.loadStarted.connect(self._on_load_started)
+
+    @pyqtSlot(str, str)
+    def push(self, name, payload_json):
+        try:
+            payload = json.loads(payload_json) if payload_json else None
+        except ValueError:
+            payload = None
+        if name == "bridge-ready":
+            self.ready = True
+        self.last_events[name] = (time.monotonic(), payload)
+        self._dispatch(name, payload)
+
+    def _dispatch(self, name, payload):
+        for handler, once in list(self._listeners.get(name, [])):
+            if once:
+                self.off(name, handler)
+            handler(payload)
+
+    def call(self, name, **args):
+        """Invokes window.__aiDock.commands[name](args) in the page."""
+        self.command.emit(name, json.dumps(args))
+
+    def on(self, name, handler, once=False):
+        self._listeners.setdefault(name, []).append((handler, once))
+        return handler
+
+    def off(self, name, handler):
+        self._listeners[name] = [(h, o) for h, o in self._listeners.get(name, []) if h is not handler]
+
+    def last_event(self, name):
+        """Returns the payload of the latest `name` event, or None."""
+        event = self.last_events.get(name)
+        return event[1] if event else None
+
+    def _on_load_started(self):
+        self.ready = False
+        self.last_events.clear()
+        # The new document will never answer requests made to the old one: let their
+        # waiters give up (and drop their listeners) instead of waiting forever
+        self._dispatch(LOAD_STARTED_EVENT, None)
+
+
+def install_bridge_scripts(profile):
+    """Installs qwebchannel.js and the dock bridge bootstrap into the shared profile."""
+    scripts = profile.scripts()
+    for old_script in scripts.find(BRIDGE_SCRIPT_NAME):
+        scripts.remove(old_script)
+
+    channel_js = QFile(":/qtwebchannel/qwebchannel.js")
+    if not channel_js.open(QIODevice.OpenModeFlag.ReadOnly):
+        print("DEBUG: qwebchannel.js not available, AI Dock bridge disabled")
+        return
+    source = bytes(channel_js.readAll()).decode("utf-8")
+    channel_js.close()
+
+    script = QWebEngineScript()
+    script.setName(BRIDGE_SCRIPT_NAME)
+    script.setSourceCode(source + "\n" + DOCK_BRIDGE_JS.replace("__BRIDGE__", BRIDGE_OBJECT_NAME))
+    script.setInjectionPoint(QWebEngineScript.InjectionPoint.DocumentCreation)
+    script.setWorldId(ADAPTER_WORLD)
+    script.setRunsOnSubFrames(False)
+    scripts.insert(script)
+
+
+def attach_dock_bridge(page):
+    """Publishes a DockBridge to page over a QWebChannel and returns it."""
+    bridge = DockBridge(page)
+    channel = QWebChannel(page)
+    channel.registerObject(BRIDGE_OBJECT_NAME, bridge)
+    page.setWebChannel(channel, ADAPTER_WORLD)
+    page._ai_dock_bridge = bridge
+    return bridge
+
+
+def get_dock_bridge(page):
+    return getattr(page, "_ai_dock_bridge", None)
+
+
+# --- Editor / reviewer side ---
+
+_editor_listeners = {}
+_editor_page_scripts = []
+
+
+def on_editor_event(name, handler):
+    """Registers handler(context, payload) for events pushed by editor/reviewer pages."""
+    _editor_listeners.setdefault(name, []).append(handler)
+
+
+def call_editor_page(web, name, args=None):
+    """Invokes window.__aiDockBridge.commands[name](args) in an editor/reviewer webview."""
+    web.eval(f"window.__aiDockBridge && window.__aiDockBridge.call({json.dumps(name)}, {json.dumps(args)});")
+
+
+def on_webview_will_set_content(web_content, context):
+    """Adds the bridge helper (and any registered page scripts) to editor and reviewer pages."""
+    if isinstance(context, (Editor, Reviewer)):
+        web_content.head += f"<script>{EDITOR_BRIDGE_JS.replace('__PREFIX__', EDITOR_MESSAGE_PREFIX)}</script>"
+        for source in _editor_page_scripts:
+            web_content.head += f"<script>{source}</script>"
+
+
+def on_webview_did_receive_js_message(handled, message, context):
+    """Routes 'aidock:<event>:<json>' messages from editor/reviewer pages to listeners."""
+    if not message.startswith(EDITOR_MESSAGE_PREFIX):
+        return handled
+    name, _, payload_json = message[len(EDITOR_MESSAGE_PREFIX):].partition(":")
+    try:
+        payload = json.loads(payload_json) if payload_json else None
+    except ValueError:
+        payload = None
+    for handler in _editor_listeners.get(name, []):
+        try:
+            handler(context, payload)
+        except Exception as e:
+            print(f"DEBUG: AI Dock editor event '{name}' handler failed: {e}")
+    return (True, None)
+
+
+def add_editor_page_script(source):
+    """Registers JS to be loaded into every editor and reviewer page after the bridge helper."""
+    _editor_page_scripts.append(source)
@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 
 # Import the new custom configuration system
-from .config_manager import get_config, write_config, config_manager
+from .config_manager import ConfigChange, config_manager, get_config, get_config_section, write_config
 
 RATIO_OPTIONS = ['4:1', '3:1', '2:1', '1:1', '1:2', '1:3', '1:4']
\ No newline at end of file
@@ -1,12 +1,95 @@
 # -*- coding: utf-8 -*-
 
+import copy
+import gzip
+import hashlib
 import json
 import os
+import tempfile
+import threading
 import time
 from datetime import datetime
 from aqt import mw
+from aqt.qt import QTimer
 from aqt.utils import showWarning, tooltip
 
+# Periodo di quiete (ms) prima che le modifiche accumulate vengano scritte su disco.
+DEFAULT_WRITE_DELAY_MS = 800
+# Numero di generazioni di backup compresse mantenute a rotazione.
+DEFAULT_BACKUP_GENERATIONS = 5
+
+SHORTCUT_KEYS = ("paste_direct_shortcut", "toggle_dock_shortcut")
+
+# Telemetry, ads and session-recording hosts commonly pulled in by the AI sites (see blocker.py).
+DEFAULT_BLOCKLIST = [
+    "google-analytics.com",
+    "googletagmanager.com",
+    "doubleclick.net",
+    "googlesyndication.com",
+    "googleadservices.com",
+    "connect.facebook.net",
+    "bat.bing.com",
+    "clarity.ms",
+    "hotjar.com",
+    "fullstory.com",
+    "mixpanel.com",
+    "api.amplitude.com",
+    "cdn.segment.com",
+    "api.segment.io",
+    "browser-intake-datadoghq.com",
+    "sentry.io",
+    "ingest.sentry.io",
+]
+
+
+def _prompt_shortcuts(prompts):
+    return [(p.get("shortcut"), p.get("template"), p.get("auto_paste", False)) for p in (prompts or []) if p.get("shortcut")]
+
+
+class ConfigChange:
+    """
+    Differenza tra due versioni delle impostazioni, per chiave di primo livello.
+    Oltre alle chiavi grezze espone alcuni argomenti (topics) a cui sottoscriversi.
+    """
+
+    SITES = "ai_sites"
+    PROMPTS = "prompts"
+    SHORTCUTS = "shortcuts"
+
+    def __init__(self, old, new):
+        self.old = old
+        self.new = new
+        self.keys = frozenset(k for k in set(old) | set(new) if old.get(k) != new.get(k))
+
+        topics = set(self.keys)
+        if any(k in self.keys for k in SHORTCUT_KEYS):
+            topics.add(self.SHORTCUTS)
+        elif self.PROMPTS in self.keys and _prompt_shortcuts(old.get(self.PROMPTS)) != _prompt_shortcuts(new.get(self.PROMPTS)):
+            topics.add(self.SHORTCUTS)
+        self.topics = frozenset(topics)
+
+    def __contains__(self, topic):
+        return topic in self.topics
+
+    def __bool__(self):
+        return bool(self.keys)
+
+    def __repr__(self):
+        return f"ConfigChange({sorted(self.topics)})"
+
+    @property
+    def sites_changed(self):
+        return self.SITES in self.topics
+
+    @property
+    def prompts_changed(self):
+        return self.PROMPTS in self.topics
+
+    @property
+    def shortcuts_changed(self):
+        return self.SHORTCUTS in self.topics
+
+
 class ConfigManager:
     """
     Sistema di configurazione completamente personalizzato per AI Dock.
@@ -17,6 +100,22 @@ class ConfigManager:
         self._config = None
         self._config_file = None
         self._backup_file = None
+
+        # Stato del write-behind
+        self._dirty = False
+        self._save_timer = None
+        self._write_lock = threading.Lock()
+        self._writer_thread = None
+        self._write_seq = 0
+        self._last_written_seq = 0
+        self._last_hash = None
+        self._last_payload = None
+        self.write_stats = {"requested": 0, "written": 0, "coalesced": 0,
+                            "skipped_unchanged": 0, "bytes_written": 0}
+
+        # Notifica delle modifiche
+        self._subscribers = []
+        self._published_settings = None
         
     @property
     def config_file(self):
@@ -26,21 +125,24 @@ class ConfigManager:
                 self._config_file = os.path.join(mw.pm.profileFolder(), "ai_dock_settings.json")
             else:
                 # Fallback se il profilo non è ancora disponibile
-                import tempfile
                 self._config_file = os.path.join(tempfile.gettempdir(), "ai_dock_settings_fallback.json")
         return self._config_file
         
     @property  
     def backup_file(self):
-        """Lazy initialization of backup file path."""
+        """Lazy initialization of the legacy (uncompressed) backup file path."""
         if self._backup_file is None:
             if mw and mw.pm:
                 self._backup_file = os.path.join(mw.pm.profileFolder(), "ai_dock_settings_backup.json")
             else:
                 # Fallback se il profilo non è ancora disponibile
-                import tempfile
                 self._backup_file = os.path.join(tempfile.gettempdir(), "ai_dock_settings_backup_fallback.json")
         return self._backup_file
+
+    def backup_generation_file(self, generation):
+        """Percorso della generazione di backup compressa (1 = la più recente)."""
+        base, _ = os.path.splitext(self.backup_file)
+        return f"{base}.{generation}.json.gz"
         
     def get_defaults(self):
         """Restituisce la configurazione di default."""
@@ -78,6 +180,74 @@ class ConfigManager:
                 },
                 "paste_direct_shortcut": "",
                 "toggle_dock_shortcut": "Ctrl+Shift+X",
+                "extract_inline_images": True,
+                "sanitizer": {
+                    "enabled": True,
+                    "convert_math": True,
+                    # Aggiunte all'allowlist di base, es. ["span"] o {"span": ["style"]}
+                    "extra_tags": [],
+                    "extra_attributes": {}
+                },
+                "write_behind_delay_ms": DEFAULT_WRITE_DELAY_MS,
+                "config_backup_generations": DEFAULT_BACKUP_GENERATIONS,
+                "page_pool": {
+                    "size": 2,
+                    "idle_timeout_s": 900,
+                    "prewarm": True
+                },
+                "page_lifecycle": {
+                    "enabled": True,
+                    "freeze_after_s": 60,
+                    "discard_after_s": 1800
+                },
+                "site_adapters": {},
+                "response_cache": {
+                    "enabled": True,
+                    "max_entries": 5000,
+                    "max_mb": 50,
+                    "ttl_days": 30
+                },
+                "batch": {
+                    "new_chat_per_job": True,
+                    "apply_every": 20,
+                    "job_timeout_s": 180,
+                    "ready_timeout_s": 60,
+                    "retries": 1,
+                    "workers": 3,
+                    "pages_per_site": 2,
+                    "max_pages_per_site": {}
+                },
+                "api_batch": {
+                    "concurrency": 8,
+                    "requests_per_minute": 60,
+                    "burst": 10,
+                    "max_retries": 5,
+                    "backoff_base_s": 1.0,
+                    "backoff_max_s": 60.0,
+                    "deliver_every_s": 0.5,
+                    # Per-site overrides of requests_per_minute / burst, keyed by site name
+                    "rate_limits": {}
+                },
+                "prefetch": {
+                    "enabled": False,
+                    "prompt": "",
+                    "field": "Front",
+                    "lookahead": 3
+                },
+                "request_blocker": {
+                    "enabled": True,
+                    "blocklist": list(DEFAULT_BLOCKLIST),
+                    "allow": {}
+                },
+                "resource_budget": {
+                    "max_live_pages": 0,
+                    "http_cache_mb": 0,
+                    "lite_mode": False,
+                    "gpu_acceleration": True,
+                    "renderer_process_limit": 0,
+                    "disable_jit": False,
+                    "disable_gpu_rasterization": False
+                },
                 "editor_settings": {
                     "zoom_factor": 1.0, 
                     "splitRatio": "2:1", 
@@ -100,12 +270,16 @@ class ConfigManager:
             
         try:
             if os.path.exists(self.config_file):
-                with open(self.config_file, 'r', encoding='utf-8') as f:
-                    self._config = json.load(f)
-                    
-                # Validazione e migrazione se necessario
-                if not self._validate_config(self._config):
-                    self._config = self._migrate_config(self._config)
+                try:
+                    with open(self.config_file, 'r', encoding='utf-8') as f:
+                        self._config = json.load(f)
+                    self._last_hash = self._content_hash(self._config)
+                except (OSError, ValueError) as e:
+                    # File troncato o corrotto: recupera dal backup valido più recente
+                    self._config = self._recover_from_backups(e)
+
+                # Migrazione: formato vecchio, e chiavi aggiunte dopo l'ultimo salvataggio
+                self._config = self._migrate_config(self._config)
             else:
                 # Primo avvio - crea file di default
                 self._config = self.get_defaults()
@@ -114,34 +288,253 @@ class ConfigManager:
         except Exception as e:
             showWarning(f"Errore nel caricamento della configurazione AI Dock: {e}\nVerrà utilizzata la configurazione di default.")
             self._config = self.get_defaults()
-            
+
+        self._published_settings = copy.deepcopy(self._config.get("settings", {}))
         return self._config
+
+    def _recover_from_backups(self, error):
+        """
+        Cerca tra le generazioni di backup (dalla più recente) la prima leggibile
+        e la riscrive come file principale. Solleva l'errore originale se nessuna è valida.
+        """
+        candidates = [self.backup_generation_file(i) for i in range(1, self._backup_generations() + 1)]
+        candidates.append(self.backup_file)
+        for path in candidates:
+            if not os.path.exists(path):
+                continue
+            try:
+                opener = gzip.open if path.endswith(".gz") else open
+                with opener(path, 'rt', encoding='utf-8') as f:
+                    recovered = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if not self._validate_config(recovered):
+                continue
+            print(f"DEBUG: AI Dock config recovered from {path} ({error})")
+            self._config = recovered
+            self._last_hash = None
+            self.save_config()
+            tooltip("AI Dock settings were damaged and have been restored from a backup.")
+            return recovered
+        raise error
     
     def save_config(self):
-        """Salva la configurazione nel file JSON personalizzato."""
+        """Salva la configurazione nel file JSON personalizzato (sincrono)."""
         if self._config is None:
             return False
-            
+
+        self._stop_save_timer()
+        self._dirty = False
+        snapshot = self._serialize()
+        if snapshot is None:
+            return True
         try:
-            # Crea backup del file esistente
-            if os.path.exists(self.config_file):
-                with open(self.config_file, 'r', encoding='utf-8') as f:
-                    backup_data = f.read()
-                with open(self.backup_file, 'w', encoding='utf-8') as f:
-                    f.write(backup_data)
-            
-            # Aggiorna timestamp
-            self._config["last_saved"] = datetime.now().isoformat()
-            
-            # Salva la nuova configurazione
-            with open(self.config_file, 'w', encoding='utf-8') as f:
-                json.dump(self._config, f, indent=2, ensure_ascii=False)
-                
+            self._write_payload(*snapshot)
             return True
-            
         except Exception as e:
+            self._last_hash = None
             showWarning(f"Errore nel salvataggio della configurazione AI Dock: {e}")
             return False
+
+    def mark_dirty(self):
+        """
+        Segna la configurazione come modificata e pianifica un salvataggio.
+        Le richieste che arrivano durante il periodo di quiete vengono unite
+        in un'unica scrittura eseguita su un thread separato.
+        """
+        if self._config is None:
+            return False
+
+        self.write_stats["requested"] += 1
+        delay = self._write_delay_ms()
+        if delay <= 0:
+            return self.save_config()
+
+        if self._dirty:
+            self.write_stats["coalesced"] += 1
+        self._dirty = True
+
+        if self._save_timer is None:
+            self._save_timer = QTimer()
+            self._save_timer.setSingleShot(True)
+            self._save_timer.timeout.connect(self._flush_async)
+        self._save_timer.start(delay)
+        return True
+
+    def flush(self):
+        """Scrive subito le modifiche pendenti e attende eventuali scritture in corso."""
+        self._stop_save_timer()
+        writer = self._writer_thread
+        if writer is not None and writer.is_alive():
+            writer.join()
+        if self._dirty:
+            return self.save_config()
+        return True
+
+    def subscribe(self, callback, *topics):
+        """
+        Registra callback(change) per gli argomenti indicati (costanti di ConfigChange
+        o chiavi delle impostazioni). Restituisce il callback, utile per unsubscribe.
+        """
+        self._subscribers.append((frozenset(topics), callback))
+        return callback
+
+    def unsubscribe(self, callback):
+        self._subscribers = [(t, cb) for t, cb in self._subscribers if cb is not callback]
+
+    def publish_changes(self):
+        """
+        Confronta le impostazioni correnti con quelle dell'ultima notifica e avvisa
+        solo i sottoscrittori interessati alle chiavi modificate.
+        """
+        settings = self.get_all_settings()
+        change = ConfigChange(self._published_settings or {}, settings)
+        self._published_settings = copy.deepcopy(settings)
+        if not change:
+            return change
+        print(f"DEBUG: AI Dock config changed: {change}")
+        for topics, callback in list(self._subscribers):
+            if topics & change.topics:
+                try:
+                    callback(change)
+                except Exception as e:
+                    print(f"DEBUG: AI Dock config subscriber {callback} failed: {e}")
+        return change
+
+    def describe_write_stats(self):
+        """Riepilogo leggibile del contatore di scritture risparmiate."""
+        stats = self.write_stats
+        return (f"{stats['requested']} save requests, {stats['written']} disk writes "
+                f"({stats['bytes_written']} bytes), {stats['coalesced']} writes saved by coalescing, "
+                f"{stats['skipped_unchanged']} skipped as unchanged")
+
+    def _write_delay_ms(self):
+        try:
+            return int(self._config.get("settings", {}).get("write_behind_delay_ms", DEFAULT_WRITE_DELAY_MS))
+        except (TypeError, ValueError):
+            return DEFAULT_WRITE_DELAY_MS
+
+    def _backup_generations(self):
+        try:
+            settings = (self._config or {}).get("settings", {})
+            return max(0, int(settings.get("config_backup_generations", DEFAULT_BACKUP_GENERATIONS)))
+        except (TypeError, ValueError):
+            return DEFAULT_BACKUP_GENERATIONS
+
+    def _stop_save_timer(self):
+        if self._save_timer is not None:
+            self._save_timer.stop()
+
+    @staticmethod
+    def _content_hash(config):
+        """Hash del contenuto, escluso il timestamp di salvataggio."""
+        body = {k: v for k, v in config.items() if k != "last_saved"}
+        encoded = json.dumps(body, sort_keys=True, ensure_ascii=False).encode('utf-8')
+        return hashlib.sha256(encoded).hexdigest()
+
+    def _serialize(self):
+        """
+        Crea uno snapshot della configurazione sul thread GUI.
+        Restituisce None se il contenuto è identico all'ultimo salvato.
+        """
+        content_hash = self._content_hash(self._config)
+        if content_hash == self._last_hash and os.path.exists(self.config_file):
+            self.write_stats["skipped_unchanged"] += 1
+            return None
+        self._last_hash = content_hash
+        self._config["last_saved"] = datetime.now().isoformat()
+        self._write_seq += 1
+        return self._write_seq, json.dumps(self._config, indent=2, ensure_ascii=False)
+
+    def _flush_async(self):
+        """Chiamato alla fine del periodo di quiete: scrive su un thread di lavoro."""
+        if not self._dirty or self._config is None:
+            return
+        self._dirty = False
+        snapshot = self._serialize()
+        if snapshot is None:
+            return
+
+        def worker():
+            try:
+                self._write_payload(*snapshot)
+            except Exception as e:
+                message = f"Errore nel salvataggio della configurazione AI Dock: {e}"
+                self._last_hash = None
+                mw.taskman.run_on_main(lambda: showWarning(message))
+
+        self._writer_thread = threading.Thread(target=worker, name="ai-dock-config-writer", daemon=True)
+        self._writer_thread.start()
+
+    def _write_payload(self, seq, payload):
+        """Scrive lo snapshot su disco; gli snapshot più vecchi di quello già scritto vengono ignorati."""
+        with self._write_lock:
+            if seq <= self._last_written_seq:
+                return
+            data = payload.encode('utf-8')
+
+            # Ruota i backup compressi con il contenuto precedente
+            previous = self._last_payload
+            if previous is None and os.path.exists(self.config_file):
+                with open(self.config_file, 'rb') as f:
+                    previous = f.read()
+                try:
+                    json.loads(previous)
+                except ValueError:
+                    # File principale corrotto (es. durante il recupero da un backup):
+                    # ruotarlo sposterebbe l'ultimo backup valido al posto del file rotto
+                    print("DEBUG: AI Dock config file is damaged, not kept as a backup")
+                    previous = None
+            if previous:
+                self._rotate_backups(previous)
+
+            # Salva la nuova configurazione in modo atomico
+            self._atomic_write(self.config_file, data)
+
+            self._last_payload = data
+            self._last_written_seq = seq
+            self.write_stats["written"] += 1
+            self.write_stats["bytes_written"] += len(data)
+
+    def _rotate_backups(self, previous):
+        """Sposta ogni generazione di un posto e scrive la precedente versione compressa come .1."""
+        generations = self._backup_generations()
+        if generations <= 0:
+            return
+        for i in range(generations - 1, 0, -1):
+            src = self.backup_generation_file(i)
+            if os.path.exists(src):
+                os.replace(src, self.backup_generation_file(i + 1))
+        compressed = gzip.compress(previous)
+        self._atomic_write(self.backup_generation_file(1), compressed)
+        self.write_stats["bytes_written"] += len(compressed)
+
+    @staticmethod
+    def _atomic_write(path, data):
+        """Scrive su un file temporaneo, esegue fsync e lo rinomina sul file di destinazione."""
+        directory = os.path.dirname(path) or "."
+        fd, tmp_path = tempfile.mkstemp(prefix=".ai_dock_", suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        if hasattr(os, "O_DIRECTORY"):
+            try:
+                dir_fd = os.open(directory, os.O_DIRECTORY)
+                try:
+                    os.fsync(dir_fd)
+                finally:
+                    os.close(dir_fd)
+            except OSError:
+                pass
     
     def get_setting(self, key, default=None):
         """Ottiene un'impostazione specifica."""
@@ -158,6 +551,19 @@ class ConfigManager:
         """Ottiene tutte le impostazioni."""
         config = self.load_config()
         return config.get("settings", {})
+
+    def default_section(self, key):
+        """Valori di default della sezione `key` delle impostazioni (una copia nuova a ogni chiamata)."""
+        return self.get_defaults()["settings"].get(key, {})
+
+    def section(self, key):
+        """
+        Sezione `key` delle impostazioni (es. "batch") con i valori mancanti presi dai
+        default: le chiavi aggiunte in una nuova versione valgono anche per chi aggiorna.
+        """
+        merged = self.default_section(key)
+        merged.update(self.get_all_settings().get(key) or {})
+        return merged
     
     def update_settings(self, new_settings):
         """Aggiorna multiple impostazioni e salva."""
@@ -169,6 +575,7 @@ class ConfigManager:
         """Resetta la configurazione ai valori di default."""
         self._config = self.get_defaults()
         success = self.save_config()
+        self.publish_changes()
         if success:
             tooltip("Configurazione AI Dock resettata ai valori di default.")
         return success
@@ -209,10 +616,15 @@ def get_config():
     """Funzione di compatibilità - restituisce le impostazioni."""
     return config_manager.get_all_settings()
 
+def get_config_section(key):
+    """Una sezione delle impostazioni completata con i default, vedi ConfigManager.section."""
+    return config_manager.section(key)
+
 def write_config(new_config=None):
-    """Funzione di compatibilità - salva le nuove impostazioni."""
+    """
+    Funzione di compatibilità - registra le nuove impostazioni.
+    Il salvataggio su disco è differito (write-behind), vedi ConfigManager.mark_dirty.
+    """
     if new_config is not None:
-        return config_manager.update_settings(new_config)
-    else:
-        # Se non viene passato new_config, salva la configurazione corrente
-        return config_manager.save_config()
\ No newline at end of file
+        config_manager.get_all_settings().update(new_config)
+    return config_manager.mark_dirty()
\ No newline at end of file
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def process_stats(pid):
+    """
+    Returns {"rss": bytes, "cpu": seconds} for the given process, or None when it
+    cannot be read. Uses psutil when available and /proc otherwise.
+    """
+    if not pid:
+        return None
+    if psutil is not None:
+        try:
+            process = psutil.Process(pid)
+            cpu = process.cpu_times()
+            return {"rss": process.memory_info().rss, "cpu": cpu.user + cpu.system}
+        except psutil.Error:
+            return None
+    try:
+        with open(f"/proc/{pid}/statm", encoding="ascii") as f:
+            resident_pages = int(f.read().split()[1])
+        with open(f"/proc/{pid}/stat", encoding="ascii") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        ticks = os.sysconf("SC_CLK_TCK")
+        return {
+            "rss": resident_pages * os.sysconf("SC_PAGE_SIZE"),
+            "cpu": (int(fields[11]) + int(fields[12])) / ticks,
+        }
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def page_stats(page):
+    """Stats of the renderer process behind a QWebEnginePage."""
+    try:
+        return process_stats(page.renderProcessPid())
+    except RuntimeError:
+        return None
+
+
+def format_stats(stats):
+    if not stats:
+        return "n/a"
+    return f"{stats['rss'] / (1024 * 1024):.0f} MB, CPU {stats['cpu']:.1f} s"
@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+
+import html
+import http.client
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from aqt import mw
+from aqt.editor import Editor
+from aqt.qt import QAction, QLabel, QTextBrowser, QTextCursor, QTextDocument, Qt, QVBoxLayout, QWidget
+
+from .fields import field_cache
+from .sanitizer import sanitize_html, sanitizer_settings
+
+API_SITE_TYPE = "api"
+# Valori di un sito "Direct API" in config["ai_sites"] (i siti web restano semplici URL)
+API_SITE_DEFAULTS = {"type": API_SITE_TYPE, "url": "", "model": "", "api_key": "", "system_prompt": "",
+                     "temperature": None, "timeout_s": 120}
+# How often streamed tokens are handed over to the main thread
+DELTA_FLUSH_INTERVAL_S = 0.05
+
+
+def is_api_site(site):
+    return isinstance(site, dict) and site.get("type") == API_SITE_TYPE
+
+
+def site_url(site):
+    """URL of an ai_sites entry: the entry itself for web sites, its endpoint for Direct API sites."""
+    return site.get("url", "") if isinstance(site, dict) else site
+
+
+def redact_api_keys(config):
+    """Copy of config that is safe to log: the api_key of every Direct API site is masked."""
+    if not config.get("ai_sites"):
+        return config
+    sites = {name: dict(site, api_key="***") if isinstance(site, dict) and site.get("api_key") else site
+             for name, site in config["ai_sites"].items()}
+    return dict(config, ai_sites=sites)
+
+
+def api_site_settings(site):
+    settings = dict(API_SITE_DEFAULTS)
+    settings.update(site)
+    return settings
+
+
+def completions_url(site):
+    """Accepts a base URL (https://host, https://host/v1) or the full /chat/completions endpoint."""
+    base = site_url(site).rstrip("/")
+    if base.endswith("/chat/completions"):
+        return base
+    if base.endswith("/v1"):
+        return base + "/chat/completions"
+    return base + "/v1/chat/completions"
+
+
+def build_request_body(site, prompt, stream=True):
+    """Renders a formatted prompt into an OpenAI-compatible chat completion request."""
+    settings = api_site_settings(site)
+    messages = []
+    if settings["system_prompt"]:
+        messages.append({"role": "system", "content": settings["system_prompt"]})
+    messages.append({"role": "user", "content": prompt})
+    body = {"model": settings["model"], "messages": messages, "stream": stream}
+    if settings["temperature"] is not None:
+        body["temperature"] = settings["temperature"]
+    body.update(settings.get("extra_body", {}))
+    return body
+
+
+def text_to_html(text):
+    return html.escape(text).replace("\n", "<br>")
+
+
+def rich_text_html(qt_html):
+    """Qt rich text (QTextDocument / QTextDocumentFragment.toHtml()) reduced to note field markup."""
+    return sanitize_html(qt_html, sanitizer_settings())
+
+
+def markdown_to_html(markdown):
+    """
+    An answer of a Direct API site (markdown) as HTML for note fields and the response
+    cache: rendered by Qt exactly as ApiPanel shows it. Main thread only.
+    """
+    if not markdown:
+        return ""
+    document = QTextDocument()
+    document.setMarkdown(markdown)
+    return rich_text_html(document.toHtml())
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class ConnectionPool:
+    """Keep-alive http.client connections, reused per (scheme, host, port) across requests."""
+
+    def __init__(self, max_idle_per_host=4):
+        self.max_idle_per_host = max_idle_per_host
+        self._idle = {}
+        self._lock = threading.Lock()
+        self.stats = {"opened": 0, "reused": 0}
+
+    def acquire(self, key, timeout):
+        """Returns (connection, reused)."""
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                self.stats["reused"] += 1
+                return idle.pop(), True
+            self.stats["opened"] += 1
+        scheme, host, port = key
+        connection_class = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        return connection_class(host, port, timeout=timeout), False
+
+    def release(self, key, connection):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def clear(self):
+        with self._lock:
+            connections = [c for idle in self._idle.values() for c in idle]
+            self._idle = {}
+        for connection in connections:
+            connection.close()
+
+
+def _read_stream(response, on_delta, cancelled):
+    """Reads an SSE chat completion stream, calling on_delta for every content token."""
+    parts = []
+    for raw_line in iter(response.readline, b""):
+        if cancelled is not None and cancelled.is_set():
+            raise ApiError("cancelled")
+        line = raw_line.decode("utf-8", errors="replace").strip()
+        if not line.startswith("data:"):
+            continue
+        data = line[5:].strip()
+        if data == "[DONE]":
+            break
+        try:
+            chunk = json.loads(data)
+        except ValueError:
+            continue
+        if chunk.get("error"):
+            raise ApiError(str(chunk["error"].get("message", chunk["error"])))
+        choices = chunk.get("choices") or [{}]
+        delta = (choices[0].get("delta") or {}).get("content")
+        if delta:
+            parts.append(delta)
+            on_delta(delta)
+    return "".join(parts)
+
+
+def stream_chat(site, prompt, on_delta, cancelled=None, stream=True):
+    """
+    Sends prompt to the site's /chat/completions endpoint (blocking, call it from a
+    worker thread) and returns the whole answer; on_delta receives the streamed tokens.
+    """
+    settings = api_site_settings(site)
+    parts = urlsplit(completions_url(site))
+    key = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == "https" else 80))
+    path = parts.path + (f"?{parts.query}" if parts.query else "")
+    body = json.dumps(build_request_body(site, prompt, stream=stream)).encode("utf-8")
+    headers = {"Content-Type": "application/json", "Accept": "text/event-stream" if stream else "application/json"}
+    if settings["api_key"]:
+        headers["Authorization"] = f"Bearer {settings['api_key']}"
+
+    for attempt in range(2):
+        connection, reused = connection_pool.acquire(key, settings["timeout_s"])
+        try:
+            connection.request("POST", path, body, headers)
+            response = connection.getresponse()
+            break
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            # The server closed an idle keep-alive connection: retry once on a fresh one
+            connection.close()
+            if not reused or attempt:
+                raise
+        except BaseException:
+            # Timeout, connection refused, ...: not retried, but the socket must not leak
+            connection.close()
+            raise
+
+    reusable = False
+    try:
+        if response.status != 200:
+            detail = response.read().decode("utf-8", errors="replace")[:1000]
+            reusable = not response.will_close
+            retry_after = response.getheader("Retry-After")
+            raise ApiError(f"HTTP {response.status}: {detail}", response.status,
+                           float(retry_after) if retry_after and retry_after.isdigit() else None)
+        if "text/event-stream" in (response.getheader("Content-Type") or ""):
+            text = _read_stream(response, on_delta, cancelled)
+        else:
+            # Server without streaming support: a single JSON answer
+            data = json.loads(response.read())
+            text = data["choices"][0]["message"]["content"] or ""
+            on_delta(text)
+        response.read()
+        reusable = not response.will_close
+        return text
+    finally:
+        if reusable:
+            connection_pool.release(key, connection)
+        else:
+            connection.close()
+
+
+class ApiRequest:
+    """
+    One streamed request run on the API worker threads. Tokens are handed to the
+    main thread in small batches (at most every DELTA_FLUSH_INTERVAL_S) rather than
+    one main-thread task per token.
+    """
+
+    def __init__(self, site, prompt, on_delta, on_done):
+        self.site = site
+        self.prompt = prompt
+        self.on_delta = on_delta
+        self.on_done = on_done
+        self.cancelled = threading.Event()
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._last_flush = 0.0
+
+    def start(self):
+        _executor.submit(self._run)
+        return self
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def _run(self):
+        started = time.monotonic()
+        try:
+            text, error = stream_chat(self.site, self.prompt, self._queue_delta, self.cancelled), None
+        except Exception as e:
+            # Anche risposte malformate (es. "choices": []) devono chiudere la richiesta
+            if not isinstance(e, (ApiError, OSError, http.client.HTTPException)):
+                print(f"DEBUG: AI Dock API request failed: {e!r}")
+            text, error = "", str(e) or type(e).__name__
+        self._flush()
+        elapsed = time.monotonic() - started
+        mw.taskman.run_on_main(lambda: self.on_done(text, error, elapsed))
+
+    def _queue_delta(self, delta):
+        with self._lock:
+            self._buffer.append(delta)
+            due = time.monotonic() - self._last_flush >= DELTA_FLUSH_INTERVAL_S
+        if due:
+            self._flush()
+
+    def _flush(self):
+        with self._lock:
+            chunk, self._buffer = "".join(self._buffer), []
+            self._last_flush = time.monotonic()
+        if chunk:
+            mw.taskman.run_on_main(lambda: self.on_delta(chunk))
+
+
+class ApiPanel(QWidget):
+    """Native answer panel of a dock showing a Direct API site, in place of the web view."""
+
+    def __init__(self, target_object, on_paste, parent=None):
+        super().__init__(parent)
+        self.target_object = target_object
+        self.on_paste = on_paste
+        self.answer = ""
+        # The answer as rendered, for pasting and caching (see markdown_to_html)
+        self.answer_html = ""
+        self._request = None
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.browser = QTextBrowser(self)
+        self.browser.setOpenExternalLinks(True)
+        self.browser.setPlaceholderText("Answers from the API will appear here.")
+        self.browser.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
+        self.browser.customContextMenuRequested.connect(self._show_context_menu)
+        layout.addWidget(self.browser, 1)
+        self.status_label = QLabel(self)
+        layout.addWidget(self.status_label)
+
+    def ask(self, site, prompt, callback=None):
+        """Streams the answer to prompt into the panel; callback(answer_html, error) runs when done."""
+        if self._request is not None:
+            self._request.cancel()
+        self.answer = ""
+        self.answer_html = ""
+        self.browser.clear()
+        self.status_label.setText(f"Asking {api_site_settings(site)['model'] or 'the API'}…")
+
+        def on_delta(chunk):
+            if request is not self._request:
+                return
+            self.answer += chunk
+            self.browser.moveCursor(QTextCursor.MoveOperation.End)
+            self.browser.insertPlainText(chunk)
+
+        def on_done(text, error, elapsed):
+            if request is not self._request:
+                return
+            self._request = None
+            if error:
+                self.status_label.setText(f"Error: {error}")
+            else:
+                self.answer = text
+                self.browser.setMarkdown(text)
+                self.answer_html = rich_text_html(self.browser.document().toHtml()) if text else ""
+                self.status_label.setText(f"Done in {elapsed:.1f} s ({len(text)} characters)")
+            if callback:
+                callback(self.answer_html if not error else "", error)
+
+        request = self._request = ApiRequest(site, prompt, on_delta, on_done)
+        request.start()
+
+    def selected_html(self):
+        """The selected part of the answer, or the whole answer when nothing is selected, as shown."""
+        cursor = self.browser.textCursor()
+        if cursor.hasSelection():
+            return rich_text_html(cursor.selection().toHtml())
+        # While the answer is still streaming it is shown as plain text
+        return self.answer_html or text_to_html(self.answer)
+
+    def _show_context_menu(self, pos):
+        menu = self.browser.createStandardContextMenu()
+        target_object = self.target_object
+        if isinstance(target_object, Editor) and target_object.note and self.answer:
+            menu.addSeparator()
+            paste_menu = menu.addMenu("Paste to Field")
+            for field_name in field_cache.for_note(target_object.note).names:
+                action = QAction(field_name, paste_menu)
+                action.triggered.connect(
+                    lambda checked=False, fn=field_name: self.on_paste(target_object, self.selected_html(), fn))
+                paste_menu.addAction(action)
+        menu.exec(self.browser.mapToGlobal(pos))
+
+
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="ai_dock_api")
+# Istanza globale del pool di connessioni
+connection_pool = ConnectionPool()
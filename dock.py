@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import os
+import time
 
 from aqt import mw
 from aqt.editor import Editor
@@ -11,21 +12,32 @@ from aqt.qt import (
     QFileDialog,
     QHBoxLayout,
     QIcon,
+    QLabel,
     QPushButton,
     QSizePolicy,
     QSplitter,
+    QTextBrowser,
     QVBoxLayout,
     QWidget,
 )
 from aqt.utils import showWarning, tooltip
-from PyQt6.QtCore import Qt, QTimer, QUrl
-from PyQt6.QtWebEngineCore import QWebEnginePage, QWebEngineProfile, QWebEngineSettings
+from PyQt6.QtCore import QEvent, QObject, Qt, QTimer, QUrl
+from PyQt6.QtWebEngineCore import QWebEngineProfile, QWebEngineSettings
 from PyQt6.QtWebEngineWidgets import QWebEngineView
 
 # MODIFICA: Aggiunto 'write_config' per il salvataggio immediato
-from .config import RATIO_OPTIONS, get_config, write_config
-from .logic import GET_SELECTION_HTML_JS, on_text_pasted_from_ai
-from .ui import PromptManagerDialog
+from .adapters import install_adapter_scripts
+from .blocker import get_request_blocker
+from .bridge import install_bridge_scripts
+from .config import RATIO_OPTIONS, ConfigChange, config_manager, get_config, write_config
+from .direct_api import ApiPanel, is_api_site, site_url
+from .fields import field_cache
+from .logic import get_dock_selection_html, on_text_pasted_from_ai, refresh_dock_sites
+from .lifecycle import lifecycle_manager
+from .registry import dock_registry
+from .resources import apply_profile_budget
+from .webpool import page_pool
+from .ui import HistoryDialog, PromptManagerDialog
 
 _persistent_ai_dock_profile = None
 
@@ -45,6 +57,18 @@ def get_persistent_ai_dock_profile():
         settings.setAttribute(QWebEngineSettings.WebAttribute.LocalStorageEnabled, True)
         settings.setAttribute(QWebEngineSettings.WebAttribute.PluginsEnabled, True)
 
+        apply_profile_budget(_persistent_ai_dock_profile)
+        config_manager.subscribe(lambda change: apply_profile_budget(_persistent_ai_dock_profile), "resource_budget")
+
+        blocker = get_request_blocker()
+        _persistent_ai_dock_profile.setUrlRequestInterceptor(blocker)
+        config_manager.subscribe(blocker.reload_rules, "request_blocker")
+
+        install_bridge_scripts(_persistent_ai_dock_profile)
+        install_adapter_scripts(_persistent_ai_dock_profile)
+        config_manager.subscribe(
+            lambda change: install_adapter_scripts(_persistent_ai_dock_profile), "site_adapters")
+
     return _persistent_ai_dock_profile
 
 class CustomWebView(QWebEngineView):
@@ -64,7 +88,7 @@ class CustomWebView(QWebEngineView):
             paste_icon = QIcon.fromTheme("edit-paste", QIcon(os.path.join(os.path.dirname(__file__), "icons", "paste.png")))
             paste_menu = menu.addMenu(paste_icon, "Paste to Field")
             try:
-                field_names = [f['name'] for f in self.target_object.note.model()['flds']]
+                field_names = field_cache.for_note(self.target_object.note).names
             except Exception:
                 field_names = []
 
@@ -93,7 +117,7 @@ class CustomWebView(QWebEngineView):
                 return
             on_text_pasted_from_ai(self.target_object, html, field_name)
 
-        self.page().runJavaScript(GET_SELECTION_HTML_JS, paste_handler)
+        get_dock_selection_html(self.page(), paste_handler)
 
     def save_page_html(self):
         """Gets the current page's HTML and prompts the user to save it."""
@@ -115,6 +139,38 @@ class CustomWebView(QWebEngineView):
             except Exception as e:
                 showWarning(f"Failed to save HTML: {e}")
 
+class _FirstRevealWatcher(QObject):
+    """Calls callback once, the first time the watched widget becomes visible with a non-empty size."""
+    def __init__(self, widget, callback):
+        super().__init__(widget)
+        self._callback = callback
+        widget.installEventFilter(self)
+
+    def eventFilter(self, obj, event):
+        if event.type() in (QEvent.Type.Show, QEvent.Type.Resize) and obj.isVisible() and obj.width() > 0 and obj.height() > 0:
+            obj.removeEventFilter(self)
+            QTimer.singleShot(0, self._callback)
+        return False
+
+def _report_time_to_ready(target_object, page, started):
+    """Measures the time from the first reveal of the dock until its page has loaded."""
+    def report():
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        target_object.ai_dock_time_to_ready_ms = elapsed_ms
+        print(f"DEBUG: AI Dock ready in {elapsed_ms:.0f} ms")
+
+    def on_load_finished(_ok):
+        try:
+            page.loadFinished.disconnect(on_load_finished)
+        except TypeError:
+            pass
+        report()
+
+    if getattr(page, "_ai_dock_ready", False):
+        report()
+    else:
+        page.loadFinished.connect(on_load_finished)
+
 def inject_ai_dock(target_object):
     if not target_object or hasattr(target_object, "_ai_dock_injected_flag"): return
     target_object._ai_dock_injected_flag = True
@@ -161,27 +217,103 @@ def inject_ai_dock(target_object):
     if is_editor: controls_layout.addWidget(field_name_combobox)
     else: field_name_combobox.setVisible(False)
 
+    status_label = QLabel(controls_widget)
+    status_label.setToolTip("Renderer state of this dock")
+    controls_layout.addWidget(status_label)
+
+    history_button = QPushButton("🕘", controls_widget)
+    history_button.setToolTip("Search past prompts and answers")
+    history_button.clicked.connect(lambda: HistoryDialog(parent_window, target_object, on_text_pasted_from_ai).show())
+    controls_layout.addWidget(history_button)
+
     settings_button = QPushButton("⚙️", controls_widget)
     settings_button.setToolTip("Open AI Dock Settings")
     settings_button.clicked.connect(lambda: PromptManagerDialog(parent_window).exec())
     controls_layout.addWidget(settings_button)
     ai_layout.addWidget(controls_widget)
 
-    profile = get_persistent_ai_dock_profile()
-    ai_page = QWebEnginePage(profile, ai_panel)
-
-    ai_dock_webview = CustomWebView(target_object=target_object, parent=ai_panel)
-    ai_dock_webview.setPage(ai_page)
-    ai_dock_webview.setZoomFactor(zoom_spinbox.value())
-    ai_layout.addWidget(ai_dock_webview, 1)
-
-    initial_url = config.get("ai_sites", {}).get(site_combo_box.currentText())
-    if initial_url: ai_dock_webview.load(QUrl(initial_url))
+    if not is_editor:
+        # Prefetched answer for the current card (see prefetch.py), shown above the site
+        prefetch_view = QTextBrowser(ai_panel)
+        prefetch_view.setOpenExternalLinks(True)
+        prefetch_view.setMaximumHeight(200)
+        prefetch_view.setVisible(False)
+        ai_layout.addWidget(prefetch_view)
+        target_object.ai_dock_prefetch_view = prefetch_view
+
+    # A lightweight placeholder stands in for the web view until the panel is first shown
+    placeholder = QWidget(ai_panel)
+    ai_layout.addWidget(placeholder, 1)
+    ai_dock_webview = None
+
+    def ensure_webview():
+        """Builds the dock web view on first use and loads the selected AI site."""
+        nonlocal ai_dock_webview, placeholder
+        if ai_dock_webview is not None:
+            return ai_dock_webview
+        started = time.perf_counter()
+
+        # Reuse a warm page from the pool; it is returned there when the window closes
+        url = site_url(get_config().get("ai_sites", {}).get(site_combo_box.currentText()))
+        ai_page = page_pool.checkout(get_persistent_ai_dock_profile(), url)
+
+        ai_dock_webview = CustomWebView(target_object=target_object, parent=ai_panel)
+        ai_dock_webview.setPage(ai_page)
+        ai_dock_webview.setZoomFactor(zoom_spinbox.value())
+        ai_layout.replaceWidget(placeholder, ai_dock_webview)
+        placeholder.deleteLater()
+        placeholder = None
+
+        target_object.ai_dock_webview = ai_dock_webview
+        dock_registry.add_cleanup(target_object, lambda: page_pool.checkin(ai_page))
+        _report_time_to_ready(target_object, ai_page, started)
+        return ai_dock_webview
+
+    api_panel = None
+
+    def show_site(ai_name):
+        """Shows ai_name: in the native answer panel for Direct API sites, else in the web view."""
+        nonlocal api_panel
+        site = get_config().get("ai_sites", {}).get(ai_name)
+        if is_api_site(site):
+            if api_panel is None:
+                api_panel = ApiPanel(target_object, on_text_pasted_from_ai, ai_panel)
+                ai_layout.addWidget(api_panel, 1)
+                target_object.ai_dock_api_panel = api_panel
+            api_panel.setVisible(True)
+            for web_widget in (ai_dock_webview, placeholder):
+                if web_widget is not None:
+                    web_widget.setVisible(False)
+            return
+        if api_panel is not None:
+            api_panel.setVisible(False)
+        created = ai_dock_webview is None
+        webview = ensure_webview()
+        webview.setVisible(True)
+        url = site_url(site)
+        # Showing the site the page already has (e.g. on first reveal) keeps the conversation
+        if url and not created and getattr(webview.page(), "_ai_dock_site_url", None) != url:
+            webview.load(QUrl(url))
+            page_pool.retag(webview.page(), url)
+
+    target_object.ai_dock_ensure_webview = ensure_webview
+    target_object.ai_dock_show_site = show_site
+    if context_settings.get("visible", True):
+        show_site(site_combo_box.currentText())
+    else:
+        _FirstRevealWatcher(ai_panel, lambda: show_site(site_combo_box.currentText()))
 
-    target_object.ai_dock_webview = ai_dock_webview
     if is_editor: target_object.ai_dock_field_combobox = field_name_combobox
     target_object.ai_dock_site_combobox = site_combo_box
     target_object.ai_dock_panel = ai_panel
+    target_object.ai_dock_status_label = status_label
+    dock_registry.register(parent_window, target_object)
+    lifecycle_manager.start()
+
+    # Only site changes concern the dock itself; shortcuts and prompts are handled elsewhere.
+    on_sites_changed = config_manager.subscribe(
+        lambda change: refresh_dock_sites(target_object, change), ConfigChange.SITES)
+    dock_registry.add_cleanup(target_object, lambda: config_manager.unsubscribe(on_sites_changed))
 
     container_of_anki_webview = anki_webview.parentWidget()
     if not container_of_anki_webview: return
@@ -236,13 +368,14 @@ def inject_ai_dock(target_object):
             splitter.setSizes([1, 1])
 
     def on_ai_site_changed_handler(ai_name):
-        url = get_config().get("ai_sites", {}).get(ai_name)
-        if url: ai_dock_webview.load(QUrl(url))
+        if ai_dock_webview is not None or api_panel is not None:
+            show_site(ai_name)
         get_config()['last_choice'] = ai_name
         write_config() # MODIFICA: Salvataggio immediato
 
     def update_zoom_factor_handler(value):
-        ai_dock_webview.setZoomFactor(value)
+        if ai_dock_webview is not None:
+            ai_dock_webview.setZoomFactor(value)
         get_config()[settings_key]['zoom_factor'] = value
         write_config() # MODIFICA: Salvataggio immediato
 
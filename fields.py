@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+
+class FieldInfo:
+    """Field names of one version of a note type, with a name -> index map."""
+
+    __slots__ = ("key", "names", "index")
+
+    def __init__(self, key, names):
+        self.key = key
+        self.names = names
+        self.index = {name: i for i, name in enumerate(names)}
+
+
+class FieldCache:
+    """
+    Field metadata per note type, keyed by (id, mod): editing the note type bumps
+    its mod, so renamed or reordered fields are picked up without any hook.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self.stats = {"hits": 0, "misses": 0}
+
+    def for_notetype(self, notetype):
+        key = (notetype["id"], notetype["mod"])
+        info = self._entries.get(notetype["id"])
+        if info is not None and info.key == key:
+            self.stats["hits"] += 1
+            return info
+        self.stats["misses"] += 1
+        info = self._entries[notetype["id"]] = FieldInfo(key, tuple(f["name"] for f in notetype["flds"]))
+        return info
+
+    def for_note(self, note):
+        return self.for_notetype(note.model())
+
+    def clear(self):
+        self._entries = {}
+
+    def describe_stats(self):
+        return f"{self.stats['hits']} hits, {self.stats['misses']} misses, {len(self._entries)} note types"
+
+
+# Istanza globale della cache dei campi
+field_cache = FieldCache()
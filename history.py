@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import sqlite3
+import time
+
+from aqt import mw
+from aqt.qt import QTimer
+
+DB_NAME = "ai_dock_history.db"
+# Records are buffered and committed together, at most this often...
+COMMIT_INTERVAL_MS = 2000
+# ...or as soon as this many are waiting
+COMMIT_BATCH_SIZE = 50
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    kind TEXT NOT NULL,
+    site TEXT NOT NULL DEFAULT '',
+    note_id INTEGER NOT NULL DEFAULT 0,
+    field TEXT NOT NULL DEFAULT '',
+    content TEXT NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(content, content='history', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS history_ai AFTER INSERT ON history BEGIN
+    INSERT INTO history_fts (rowid, content) VALUES (new.id, new.content);
+END;
+"""
+
+# Kinds of record
+PROMPT = "prompt"
+CAPTURED = "captured"
+PASTED = "pasted"
+
+
+def fts_query(text):
+    """Turns free text into an FTS5 query: every word must match, as a prefix."""
+    words = re.findall(r"\w+", text, flags=re.UNICODE)
+    return " ".join(f'"{word}"*' for word in words)
+
+
+class HistoryStore:
+    """
+    Append-only history of every prompt sent and every answer captured or pasted,
+    in an SQLite database with an FTS5 index over the text. Records are buffered
+    and committed in batches so logging never costs a transaction per exchange.
+    """
+
+    def __init__(self):
+        self._db = None
+        self._buffer = []
+        self._timer = None
+        self.stats = {"recorded": 0, "commits": 0, "searches": 0, "last_search_ms": 0.0}
+
+    @property
+    def db_path(self):
+        return os.path.join(mw.pm.profileFolder(), DB_NAME)
+
+    def record(self, kind, content, site="", note_id=0, field=""):
+        if not content:
+            return
+        self._buffer.append((time.time(), kind, site or "", note_id or 0, field or "", content))
+        self.stats["recorded"] += 1
+        if len(self._buffer) >= COMMIT_BATCH_SIZE:
+            self.flush()
+        else:
+            self._schedule_flush()
+
+    def flush(self):
+        """Commits the buffered records in one transaction."""
+        if self._timer is not None:
+            self._timer.stop()
+        if not self._buffer:
+            return
+        records, self._buffer = self._buffer, []
+        db = self._connection()
+        with db:
+            db.executemany("INSERT INTO history (ts, kind, site, note_id, field, content) VALUES (?, ?, ?, ?, ?, ?)",
+                           records)
+        self.stats["commits"] += 1
+
+    def search(self, text, limit=200):
+        """
+        Returns the newest matching records as dicts (all records for an empty query),
+        together with the time the query took in milliseconds.
+        """
+        self.flush()
+        started = time.perf_counter()
+        db = self._connection()
+        query = fts_query(text)
+        columns = "h.id, h.ts, h.kind, h.site, h.note_id, h.field, h.content"
+        if query:
+            # Let FTS5 walk its rowids newest first and stop at limit, then join
+            rows = db.execute(f"SELECT {columns} FROM (SELECT rowid FROM history_fts WHERE history_fts MATCH ? "
+                              "ORDER BY rowid DESC LIMIT ?) m JOIN history h ON h.id = m.rowid ORDER BY h.id DESC",
+                              (query, limit)).fetchall()
+        else:
+            rows = db.execute(f"SELECT {columns} FROM history h ORDER BY h.id DESC LIMIT ?", (limit,)).fetchall()
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.stats["searches"] += 1
+        self.stats["last_search_ms"] = elapsed_ms
+        keys = ("id", "ts", "kind", "site", "note_id", "field", "content")
+        return [dict(zip(keys, row)) for row in rows], elapsed_ms
+
+    def count(self):
+        self.flush()
+        return self._connection().execute("SELECT COUNT(*) FROM history").fetchone()[0]
+
+    def close(self):
+        self.flush()
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def describe_stats(self):
+        stats = self.stats
+        return (f"{stats['recorded']} recorded in {stats['commits']} commits, {stats['searches']} searches "
+                f"(last {stats['last_search_ms']:.1f} ms)")
+
+    def _schedule_flush(self):
+        if self._timer is None:
+            self._timer = QTimer(mw)
+            self._timer.setSingleShot(True)
+            self._timer.timeout.connect(self.flush)
+        if not self._timer.isActive():
+            self._timer.start(COMMIT_INTERVAL_MS)
+
+    def _connection(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.db_path)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript(SCHEMA)
+        return self._db
+
+
+# Istanza globale dello storico
+history_store = HistoryStore()
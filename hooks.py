@@ -10,10 +10,38 @@ from aqt.editcurrent import EditCurrent
 from aqt.qt import QAction, QIcon
 from PyQt6.QtCore import QTimer
 
-from .config import get_config, write_config
+from .api_batch import api_batch_engine
+from .batch import batch_scheduler, on_browser_menus_did_init
+from .bridge import on_webview_did_receive_js_message, on_webview_will_set_content
+from .config import ConfigChange, config_manager, get_config
+from .direct_api import connection_pool
 from .dock import inject_ai_dock
-from .logic import _on_copy_text_received
-from .shortcuts import setup_shortcuts
+from .fields import field_cache
+from .history import history_store
+from .logic import _on_copy_text_received, describe_paste_stats
+from .media import describe_media_stats
+from .prefetch import review_prefetcher
+from .response_cache import response_cache
+from .selection import register_selection_cache
+from .shortcuts import on_shortcuts_changed, setup_shortcuts
+from .webpool import page_pool
+
+# Icon and prompt list used by the context menus, rebuilt only when prompts change.
+_prompt_menu_cache = {}
+
+
+def _get_prompt_menu_entries():
+    """Returns the cached (icon, prompts) pair for the 'AI Dock Prompts' submenu."""
+    if not _prompt_menu_cache:
+        _prompt_menu_cache["icon"] = QIcon(os.path.join(os.path.dirname(__file__), "icons", "ai_icon.png"))
+        _prompt_menu_cache["prompts"] = [(p["name"], p["template"], p.get("auto_paste", False))
+                                         for p in get_config().get("prompts", [])]
+    return _prompt_menu_cache["icon"], _prompt_menu_cache["prompts"]
+
+
+def on_prompts_changed(change):
+    """Drops the cached context-menu entries so the next menu picks up the new prompts."""
+    _prompt_menu_cache.clear()
 
 
 def on_editor_context_menu(editor_webview, menu):
@@ -22,22 +50,18 @@ def on_editor_context_menu(editor_webview, menu):
     if not selected_text_in_editor:
         return
 
-    prompts = get_config().get("prompts", [])
+    ai_icon, prompts = _get_prompt_menu_entries()
     if not prompts:
         return
 
-    ai_icon = QIcon(os.path.join(os.path.dirname(__file__), "icons", "ai_icon.png"))
     ai_submenu = menu.addMenu(ai_icon, "AI Dock Prompts")
 
-    for p_val in prompts:
-        action_text = p_val["name"]
+    for action_text, template, auto_paste in prompts:
         prompt_action = QAction(action_text, ai_submenu)
-<<<<<<< HEAD
         prompt_action.triggered.connect(
-            lambda checked=False, tmpl=p_val['template'], txt=selected_text_in_editor, editor_obj=editor_webview.editor:
-            _on_copy_text_received(editor_obj, txt, tmpl)
+            lambda checked=False, tmpl=template, txt=selected_text_in_editor, editor_obj=editor_webview.editor, auto=auto_paste:
+            _on_copy_text_received(editor_obj, txt, tmpl, auto)
         )
->>>>>>> refactor-init
         ai_submenu.addAction(prompt_action)
 
 def on_reviewer_context_menu(reviewer_webview, menu):
@@ -46,18 +70,16 @@ def on_reviewer_context_menu(reviewer_webview, menu):
     if not selected_text_in_reviewer:
         return
 
-    prompts = get_config().get("prompts", [])
+    ai_icon, prompts = _get_prompt_menu_entries()
     if not prompts:
         return
 
-    ai_icon = QIcon(os.path.join(os.path.dirname(__file__), "icons", "ai_icon.png"))
     ai_submenu = menu.addMenu(ai_icon, "AI Dock Prompts")
 
-    for p_val in prompts:
-        action_text = p_val["name"]
+    for action_text, template, _auto_paste in prompts:
         prompt_action = QAction(action_text, ai_submenu)
         prompt_action.triggered.connect(
-            lambda checked=False, tmpl=p_val['template'], txt=selected_text_in_reviewer, reviewer_obj=mw.reviewer:
+            lambda checked=False, tmpl=template, txt=selected_text_in_reviewer, reviewer_obj=mw.reviewer:
             _on_copy_text_received(reviewer_obj, txt, tmpl)
         )
         ai_submenu.addAction(prompt_action)
@@ -85,11 +107,16 @@ def on_editor_note_loaded(editor):
         return
 
     combobox = editor.ai_dock_field_combobox
+    fields = field_cache.for_note(editor.note)
+    # Notes of the same note type (e.g. scrolling in the Browser) keep the list as it is
+    if getattr(combobox, "_ai_dock_fields_key", None) == fields.key:
+        return
+    combobox._ai_dock_fields_key = fields.key
     last_field_name = get_config().get("target_field")
 
     combobox.blockSignals(True)
     combobox.clear()
-    field_names = [f['name'] for f in editor.note.model()['flds']]
+    field_names = fields.names
     combobox.addItems(field_names)
 
     if last_field_name in field_names:
@@ -110,8 +137,25 @@ def on_reviewer_did_show(card: Card):
         QTimer.singleShot(150, lambda: inject_ai_dock(mw.reviewer))
 
 def on_profile_will_close():
-    """Saves the final configuration state when Anki is about to close."""
-    write_config()
+    """Flushes any pending configuration changes when the profile is about to close."""
+    # Prima di tutto il resto: un errore in uno shutdown non deve far perdere le modifiche
+    config_manager.flush()
+    print(f"DEBUG: AI Dock config writes: {config_manager.describe_write_stats()}")
+    batch_scheduler.shutdown()
+    api_batch_engine.shutdown()
+    print(f"DEBUG: AI Dock review prefetch: {review_prefetcher.describe_stats()}")
+    review_prefetcher.shutdown()
+    print(f"DEBUG: AI Dock page pool: {page_pool.describe_stats()}")
+    page_pool.clear()
+    connection_pool.clear()
+    print(f"DEBUG: AI Dock response cache: {response_cache.describe_stats()}")
+    response_cache.close()
+    print(f"DEBUG: AI Dock history: {history_store.describe_stats()}")
+    print(f"DEBUG: AI Dock pastes: {describe_paste_stats()}")
+    print(f"DEBUG: AI Dock media: {describe_media_stats()}")
+    print(f"DEBUG: AI Dock field cache: {field_cache.describe_stats()}")
+    field_cache.clear()
+    history_store.close()
 
 def register_hooks():
     """Registers all necessary hooks for the add-on."""
@@ -125,6 +169,9 @@ def register_hooks():
     
     gui_hooks.reviewer_did_show_question.append(on_reviewer_did_show)
     print("DEBUG: reviewer_did_show_question hook registered")
+
+    gui_hooks.reviewer_did_show_question.append(review_prefetcher.on_show_question)
+    print("DEBUG: review prefetch hook registered")
     
     gui_hooks.editor_will_show_context_menu.append(on_editor_context_menu)
     print("DEBUG: editor_will_show_context_menu hook registered")
@@ -141,6 +188,18 @@ def register_hooks():
     
     gui_hooks.profile_will_close.append(on_profile_will_close)
     print("DEBUG: profile_will_close hook registered")
+
+    gui_hooks.browser_menus_did_init.append(on_browser_menus_did_init)
+    print("DEBUG: browser_menus_did_init hook registered")
+
+    # Page <-> Python bridge for the editor and reviewer webviews
+    gui_hooks.webview_will_set_content.append(on_webview_will_set_content)
+    gui_hooks.webview_did_receive_js_message.append(on_webview_did_receive_js_message)
+    register_selection_cache()
+
+    # React only to the settings each component actually uses
+    config_manager.subscribe(on_shortcuts_changed, ConfigChange.SHORTCUTS)
+    config_manager.subscribe(on_prompts_changed, ConfigChange.PROMPTS)
     
     # Setup shortcuts after Anki has started up.
     print("DEBUG: Setting up shortcuts in 1000ms...")
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+from aqt import mw
+from aqt.qt import QApplication, QTimer
+from PyQt6.QtWebEngineCore import QWebEnginePage
+
+from .config import get_config_section
+from .diagnostics import format_stats, page_stats
+from .registry import dock_registry
+from .webpool import page_pool
+
+LifecycleState = QWebEnginePage.LifecycleState
+STATE_LABELS = {
+    LifecycleState.Active: "active",
+    LifecycleState.Frozen: "frozen",
+    LifecycleState.Discarded: "discarded",
+}
+
+
+class PageLifecycleManager:
+    """
+    Drives the QWebEnginePage lifecycle of every dock page. Pages of docks that are
+    hidden or whose window is in the background are frozen, then discarded after a
+    longer idle time, and brought back to Active as soon as their window gets focus.
+    Pooled standby pages are only frozen, never discarded.
+    """
+
+    TICK_MS = 5000
+
+    def __init__(self):
+        self._timer = None
+        self.rss_released = 0
+
+    def settings(self):
+        return get_config_section("page_lifecycle")
+
+    def start(self):
+        if self._timer is not None:
+            return
+        self._timer = QTimer(mw)
+        self._timer.timeout.connect(self._tick)
+        self._timer.start(self.TICK_MS)
+        mw.app.focusChanged.connect(self._on_focus_changed)
+
+    def _tick(self):
+        settings = self.settings()
+        if not settings["enabled"]:
+            return
+        now = time.monotonic()
+        active_window = QApplication.activeWindow()
+
+        for target_object in dock_registry.all_docks():
+            webview = getattr(target_object, "ai_dock_webview", None)
+            if webview is None:
+                continue
+            page = webview.page()
+            in_use = (target_object.ai_dock_panel.isVisible()
+                      and getattr(target_object, "_ai_dock_window", None) is active_window)
+            if in_use or getattr(page, "_ai_dock_busy", False):
+                self.activate(target_object, page)
+                continue
+            idle_for = now - self._inactive_since(page, now)
+            if idle_for >= settings["discard_after_s"]:
+                self._transition(target_object, page, LifecycleState.Discarded)
+            elif idle_for >= settings["freeze_after_s"]:
+                self._transition(target_object, page, LifecycleState.Frozen)
+
+        for page in page_pool.idle_pages():
+            if now - self._inactive_since(page, now) >= settings["freeze_after_s"]:
+                self._transition(None, page, LifecycleState.Frozen)
+
+        self._enforce_live_page_limit(now)
+
+    def _enforce_live_page_limit(self, now):
+        """
+        Discards the longest-idle background pages while more dock pages than
+        resource_budget.max_live_pages still hold a renderer.
+        """
+        limit = int(get_config_section("resource_budget")["max_live_pages"] or 0)
+        if limit <= 0:
+            return
+        candidates = []
+        live = 0
+        for target_object in dock_registry.all_docks():
+            webview = getattr(target_object, "ai_dock_webview", None)
+            if webview is not None and webview.page().lifecycleState() != LifecycleState.Discarded:
+                live += 1
+                page = webview.page()
+                if getattr(page, "_ai_dock_inactive_since", None) is not None and not getattr(page, "_ai_dock_busy", False):
+                    candidates.append((page._ai_dock_inactive_since, target_object, page))
+        for page in page_pool.idle_pages():
+            if page.lifecycleState() != LifecycleState.Discarded:
+                live += 1
+                candidates.append((self._inactive_since(page, now), None, page))
+        candidates.sort(key=lambda entry: entry[0])
+        for _since, target_object, page in candidates[:max(0, live - limit)]:
+            self._transition(target_object, page, LifecycleState.Discarded)
+
+    def activate(self, target_object, page):
+        """Brings a page back to Active (a discarded page reloads itself)."""
+        page._ai_dock_inactive_since = None
+        if page.lifecycleState() == LifecycleState.Active:
+            return
+        self._transition(target_object, page, LifecycleState.Active)
+        page.setVisible(target_object is None or target_object.ai_dock_panel.isVisible())
+
+    def _on_focus_changed(self, _old, now):
+        if now is None or not self.settings()["enabled"]:
+            return
+        target_object = dock_registry.dock_for_window(now.window())
+        webview = getattr(target_object, "ai_dock_webview", None)
+        if webview is not None:
+            self.activate(target_object, webview.page())
+
+    @staticmethod
+    def _inactive_since(page, now):
+        since = getattr(page, "_ai_dock_inactive_since", None)
+        if since is None:
+            since = page._ai_dock_inactive_since = now
+        return since
+
+    def _transition(self, target_object, page, state):
+        if page.lifecycleState() == state:
+            return
+        # Qt only freezes or discards pages that are not visible.
+        if state != LifecycleState.Active and page.isVisible():
+            page.setVisible(False)
+        before = page_stats(page)
+        page.setLifecycleState(state)
+        print(f"DEBUG: AI Dock page -> {STATE_LABELS[state]} (renderer before: {format_stats(before)})")
+        QTimer.singleShot(3000, lambda: self._report(target_object, page, state, before))
+
+    def _report(self, target_object, page, state, before):
+        """Shows renderer memory/CPU before and after a transition in the dock's status label."""
+        label = getattr(target_object, "ai_dock_status_label", None)
+        try:
+            after = page_stats(page)
+            if before and state != LifecycleState.Active:
+                self.rss_released += max(0, before["rss"] - (after["rss"] if after else 0))
+            summary = f"{STATE_LABELS[state]}: {format_stats(before)} → {format_stats(after)}"
+            print(f"DEBUG: AI Dock renderer {summary}")
+            if label is not None:
+                label.setText(STATE_LABELS[state])
+                label.setToolTip(f"Renderer {summary}")
+        except RuntimeError:
+            # The page or the dock went away in the meantime
+            pass
+
+
+# Istanza globale
+lifecycle_manager = PageLifecycleManager()
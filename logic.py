@@ -1,16 +1,29 @@
 # -*- coding: utf-8 -*-
 
 import json
-from aqt import mw, QApplication
+import time
+
+from aqt import mw
 from aqt.editor import Editor
-from aqt.reviewer import Reviewer
+from aqt.operations import CollectionOp
 from aqt.utils import showWarning, tooltip
-from aqt.addcards import AddCards
-from aqt.browser import Browser
-from aqt.editcurrent import EditCurrent
-from aqt.qt import QUrl
 
+from .adapters import inject_prompt, watch_response
+from .bridge import get_dock_bridge
 from .config import get_config, write_config
+from .direct_api import is_api_site
+from .fields import field_cache
+from .history import CAPTURED, PASTED, PROMPT, history_store
+from .media import extract_inline_images
+from .registry import dock_registry
+from .response_cache import response_cache
+from .sanitizer import sanitize_html, sanitizer_settings
+from .selection import get_cached_selection, record_cache_hit, record_round_trip
+from .templates import NoteContext, TemplateError, compile_template
+from .ui import CachedAnswerDialog
+
+# How long auto-paste waits for an answer (well below the batch job_timeout_s)
+DOCK_RESPONSE_TIMEOUT_MS = 90000
 
 # --- JS Snippet for getting selection as HTML ---
 GET_SELECTION_HTML_JS = """
@@ -25,128 +38,190 @@ GET_SELECTION_HTML_JS = """
 })()
 """
 
-def update_open_docks_config():
+# Replaces the editor's field contents in place: the editor only re-renders the
+# fields whose content changed, so a paste does not reload the whole note.
+PATCH_FIELDS_JS = """
+(function() {
+    if (typeof setFields !== 'function') return false;
+    setFields(__FIELDS__);
+    return true;
+})()
+"""
+
+# Paste latency (click to field shown) of in-place patches and of full note reloads
+paste_stats = {"patched": 0, "avg_patch_ms": 0.0, "reloaded": 0, "avg_reload_ms": 0.0}
+
+
+def _record_paste_latency(mode, started):
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    paste_stats[mode] += 1
+    average_key = "avg_patch_ms" if mode == "patched" else "avg_reload_ms"
+    paste_stats[average_key] += (elapsed_ms - paste_stats[average_key]) / paste_stats[mode]
+    print(f"DEBUG: AI Dock paste {mode} in {elapsed_ms:.1f} ms")
+
+
+def describe_paste_stats():
+    return (f"{paste_stats['patched']} patched in place (avg {paste_stats['avg_patch_ms']:.1f} ms), "
+            f"{paste_stats['reloaded']} with a note reload (avg {paste_stats['avg_reload_ms']:.1f} ms)")
+
+
+def get_dock_selection_html(page, callback):
     """
-    Aggiorna la configurazione e l'interfaccia di tutti i dock AI aperti.
+    Passes the HTML selected in a dock page to callback. Uses the selection the page
+    pushed over its bridge when available, otherwise asks the page for it.
+    """
+    bridge = get_dock_bridge(page)
+    selection = bridge.last_event("selection") if bridge is not None and bridge.ready else None
+    if selection is not None:
+        record_cache_hit()
+        callback(selection.get("html", ""))
+        return
+
+    started = time.perf_counter()
+
+    def on_selection(html):
+        record_round_trip(started)
+        callback(html)
+
+    page.runJavaScript(GET_SELECTION_HTML_JS, on_selection)
+
+
+def refresh_dock_sites(target_instance, change):
+    """
+    Aggiorna il combobox dei siti di un dock dopo una modifica di "ai_sites".
+    La pagina viene ricaricata solo se l'URL del sito selezionato è cambiato
+    o se il sito è stato rimosso.
     """
     config = get_config()
     ai_sites = config.get("ai_sites", {})
+    old_sites = change.old.get("ai_sites", {})
     last_choice = config.get("last_choice")
 
     if not last_choice or last_choice not in ai_sites:
-        last_choice = list(ai_sites.keys())[0] if ai_sites else None
+        last_choice = next(iter(ai_sites), None)
         if last_choice:
             config["last_choice"] = last_choice
-            write_config(config)
-
-    open_dock_instances = []
-    for win in mw.app.topLevelWidgets():
-        if hasattr(win, 'editor') and win.editor and hasattr(win.editor, 'ai_dock_site_combobox'):
-            open_dock_instances.append(win.editor)
+            write_config()
 
-    if mw.state == 'review' and hasattr(mw.reviewer, 'ai_dock_site_combobox'):
-        open_dock_instances.append(mw.reviewer)
-
-    for target_instance in open_dock_instances:
-        combobox = target_instance.ai_dock_site_combobox
-        current_text = combobox.currentText()
+    combobox = target_instance.ai_dock_site_combobox
+    previous_site = combobox.currentText()
+    site_names = list(ai_sites.keys())
+    if [combobox.itemText(i) for i in range(combobox.count())] != site_names:
         combobox.blockSignals(True)
         combobox.clear()
-        if ai_sites:
-            combobox.addItems(list(ai_sites.keys()))
-            if current_text in ai_sites:
-                combobox.setCurrentText(current_text)
-            elif last_choice in ai_sites:
-                combobox.setCurrentText(last_choice)
-            elif ai_sites:
-                combobox.setCurrentIndex(0)
+        combobox.addItems(site_names)
+        if previous_site in ai_sites:
+            combobox.setCurrentText(previous_site)
+        elif last_choice:
+            combobox.setCurrentText(last_choice)
         combobox.blockSignals(False)
 
-        current_selected_site_name = combobox.currentText()
-        if current_selected_site_name and hasattr(target_instance, 'ai_dock_webview'):
-            new_url = ai_sites.get(current_selected_site_name)
-            current_webview_url = target_instance.ai_dock_webview.url().toString()
-            if new_url and new_url != current_webview_url:
-                target_instance.ai_dock_webview.load(QUrl(new_url))
-            elif not new_url and ai_sites:
-                if last_choice and ai_sites.get(last_choice):
-                    target_instance.ai_dock_webview.load(QUrl(ai_sites.get(last_choice)))
+    selected_site = combobox.currentText()
+    new_site = ai_sites.get(selected_site)
+    if selected_site == previous_site and old_sites.get(selected_site) == new_site:
+        return
+    if new_site and (hasattr(target_instance, 'ai_dock_webview') or hasattr(target_instance, 'ai_dock_api_panel')):
+        target_instance.ai_dock_show_site(selected_site)
 
 
-def inject_prompt_into_ai_webview(target_object, prompt_text: str):
+def inject_prompt_into_ai_webview(target_object, prompt_text: str, auto_paste: bool = False, cache_entry=None):
     """
-    Inietta il testo del prompt nel webview del servizio AI.
-    Contiene la logica specifica e aggiornata per Gemini.
+    Inietta il testo del prompt nel webview del servizio AI, tramite l'adattatore
+    del sito già installato nella pagina (vedi adapters.py).
+    Con auto_paste la risposta completata viene incollata nel campo di destinazione.
+    I siti "Direct API" ricevono invece il prompt via HTTP nel pannello nativo.
+    cache_entry è (sito, template, input) del prompt: la risposta viene salvata con
+    questa chiave, fissata all'invio e non quando la risposta arriva.
     """
-    if not target_object or not hasattr(target_object, 'ai_dock_webview'):
+    if not target_object or not hasattr(target_object, 'ai_dock_site_combobox'):
         tooltip("Could not find an active AI Dock.")
         return
 
-    target_webview = target_object.ai_dock_webview
     current_site_name = target_object.ai_dock_site_combobox.currentText()
+    site = get_config().get("ai_sites", {}).get(current_site_name)
+    if is_api_site(site):
+        _ask_api_site(target_object, current_site_name, site, prompt_text, auto_paste, cache_entry)
+        return
+    if not hasattr(target_object, 'ai_dock_webview'):
+        if not hasattr(target_object, 'ai_dock_ensure_webview'):
+            tooltip("Could not find an active AI Dock.")
+            return
+        # Dock nascosto e mai mostrato: la pagina viene creata adesso
+        target_object.ai_dock_panel.setVisible(True)
+        target_object.ai_dock_ensure_webview()
 
-    js_script = f"""
-    (function(prompt, currentSiteName) {{
-        let success = false;
-        if (currentSiteName === "Gemini") {{
-            const targetEditor = document.querySelector('div.ql-editor[contenteditable="true"]');
-            
-            if (targetEditor) {{
-                targetEditor.focus();
-                let p = targetEditor.querySelector('p');
-                if (!p) {{
-                    targetEditor.innerHTML = '<p></p>';
-                    p = targetEditor.querySelector('p');
-                }}
-                if(p) {{
-                    p.textContent = prompt;
-                }}
-                const events = ['keydown', 'input', 'keyup', 'change'];
-                events.forEach(eventType => {{
-                    const event = new Event(eventType, {{
-                        bubbles: true,
-                        cancelable: true,
-                    }});
-                    targetEditor.dispatchEvent(event);
-                }});
-                success = true;
-            }}
-
-        }} else {{
-            const selectors = [
-                'div[aria-label="Scrivi il tuo prompt per Claude"]',
-                '#prompt-textarea',
-                'textarea',
-            ];
-            let targetElement = null;
-            for (const selector of selectors) {{
-                targetElement = document.querySelector(selector);
-                if (targetElement) break;
-            }}
-            if (targetElement) {{
-                if (targetElement.tagName === 'TEXTAREA') {{
-                    targetElement.value = prompt;
-                }} else {{
-                    targetElement.innerHTML = prompt;
-                }}
-                targetElement.dispatchEvent(new Event('input', {{ bubbles: true, cancelable: true }}));
-                targetElement.dispatchEvent(new Event('change', {{ bubbles: true, cancelable: true }}));
-                targetElement.focus();
-                success = true;
-            }}
-        }}
-        
-        return success;
-    }})({json.dumps(prompt_text)}, {json.dumps(current_site_name)});
-    """
+    target_page = target_object.ai_dock_webview.page()
 
     def on_injection_result(success):
         if success:
             tooltip("Prompt injected into AI service.")
+            # Only auto-paste waits for the answer: a watch keeps the page busy (never
+            # frozen or reused) until it ends, too high a price for filling the cache
+            if auto_paste:
+                _watch_next_response(target_object, current_site_name, auto_paste, cache_entry)
         else:
             tooltip("Failed to inject prompt. The website's input field might have changed.")
 
-    target_webview.page().runJavaScript(js_script, on_injection_result)
+    def inject():
+        inject_prompt(target_page, current_site_name, prompt_text, on_injection_result)
+
+    if getattr(target_page, "_ai_dock_ready", False):
+        inject()
+        return
+
+    # The page is still loading (just created, or navigating): the site adapter exists once it has loaded
+    def on_load_finished(_ok):
+        target_page.loadFinished.disconnect(on_load_finished)
+        inject()
+
+    target_page.loadFinished.connect(on_load_finished)
+
+def _auto_paste_field(target_object):
+    """Target field for auto-paste, or None (reviewer docks have no target field)."""
+    if not isinstance(target_object, Editor):
+        return None
+    field_name = target_object.ai_dock_field_combobox.currentText()
+    if not field_name:
+        tooltip("Auto-paste needs a target field in the top bar.")
+    return field_name or None
+
+def _ask_api_site(target_object, site_name, site, prompt_text, auto_paste, cache_entry=None):
+    """Sends the prompt to a Direct API site; the answer streams into the dock's native panel."""
+    if not hasattr(target_object, 'ai_dock_api_panel'):
+        target_object.ai_dock_panel.setVisible(True)
+        target_object.ai_dock_show_site(site_name)
+    field_name = _auto_paste_field(target_object) if auto_paste else None
+
+    def on_answer(html, error):
+        if error:
+            tooltip(f"{site_name}: {error}")
+            return
+        remember_response(target_object, html, cache_entry)
+        if field_name:
+            on_text_pasted_from_ai(target_object, html, field_name)
+
+    target_object.ai_dock_api_panel.ask(site, prompt_text, on_answer)
+    tooltip(f"Prompt sent to {site_name}.")
+
+def _watch_next_response(target_object, site_name, auto_paste, cache_entry=None):
+    """
+    Waits for the AI to finish answering, keeps the answer in the response cache
+    and, with auto_paste, pastes it into the dock's target field.
+    """
+    field_name = _auto_paste_field(target_object) if auto_paste else None
+    if auto_paste and not field_name and not response_cache.enabled():
+        return
+
+    def on_response(result):
+        if result.get("error") or not result.get("html"):
+            if field_name:
+                tooltip(f"Auto-paste skipped: {result.get('error') or 'empty response'}.")
+            return
+        remember_response(target_object, result["html"], cache_entry)
+        if field_name:
+            on_text_pasted_from_ai(target_object, result["html"], field_name)
+
+    watch_response(target_object.ai_dock_webview.page(), site_name, on_response, timeout_ms=DOCK_RESPONSE_TIMEOUT_MS)
 
 # --- FUNZIONE AGGIORNATA ---
 def on_text_pasted_from_ai(editor: Editor, selected_html: str, target_field_name: str):
@@ -163,14 +238,41 @@ def on_text_pasted_from_ai(editor: Editor, selected_html: str, target_field_name
         return
 
     note = editor.note
-    field_names = [f['name'] for f in note.model()['flds']]
-    
-    try:
-        field_index = field_names.index(target_field_name)
-    except ValueError:
-        showWarning(f"Field '{target_field_name}' not found in this note type.\nAvailable fields: {', '.join(field_names)}")
+    fields = field_cache.for_note(note)
+    field_index = fields.index.get(target_field_name)
+    if field_index is None:
+        showWarning(f"Field '{target_field_name}' not found in this note type.\nAvailable fields: {', '.join(fields.names)}")
         return
 
+    # Let the editor commit what is being typed first, so the patch does not overwrite it
+    started = time.perf_counter()
+    editor.call_after_note_saved(
+        lambda: _paste_into_field(editor, note, field_index, target_field_name, selected_html, started))
+
+def _paste_into_field(editor, note, field_index, target_field_name, selected_html, started):
+    if editor.note is not note:
+        tooltip("The note changed before the paste could be applied.")
+        return
+
+    # Strip the site's class soup, inline styles and UI chrome down to what a field needs
+    settings = sanitizer_settings()
+    if settings["enabled"]:
+        original_size = len(selected_html)
+        selected_html = sanitize_html(selected_html, settings)
+        print(f"DEBUG: AI Dock paste sanitized {original_size} -> {len(selected_html)} characters")
+        if not selected_html:
+            tooltip("Nothing left to paste after cleaning up the selection.")
+            return
+
+    # Inline base64 images go to the media folder instead of bloating the note
+    images_note = ""
+    if get_config().get("extract_inline_images", True):
+        selected_html, image_stats = extract_inline_images(selected_html, mw.col.media)
+        if image_stats["images"]:
+            images_note = f" ({image_stats['images']} images, {image_stats['bytes_saved'] / 1024:.0f} KB moved to media)"
+            print(f"DEBUG: AI Dock paste moved {image_stats['images']} inline images to media "
+                  f"({image_stats['written']} new files, {image_stats['bytes_saved']} bytes saved)")
+
     # Combine content
     current_content = note.fields[field_index]
     if current_content and not current_content.isspace():
@@ -178,173 +280,186 @@ def on_text_pasted_from_ai(editor: Editor, selected_html: str, target_field_name
     else:
         note.fields[field_index] = selected_html
 
+    site_combobox = getattr(editor, 'ai_dock_site_combobox', None)
+    history_store.record(PASTED, selected_html, site_combobox.currentText() if site_combobox is not None else "",
+                         note.id, target_field_name)
+
+    # Patch the field in the live editor; a full loadNote() is only the fallback
+    def on_patched(patched):
+        if editor.note is not note:
+            return
+        if not patched:
+            editor.loadNote(focusTo=field_index)
+        _record_paste_latency("patched" if patched else "reloaded", started)
+
+    fields_json = json.dumps(list(zip(note.keys(), note.fields)))
+    editor.web.evalWithCallback(PATCH_FIELDS_JS.replace("__FIELDS__", fields_json), on_patched)
+
     # Check if the note is new (its id will be 0).
     if not note.id:
-        # For a new note, we can't 'flush' (save). We just reload the editor's state
-        # to show the updated (but unsaved) content. The user saves by clicking "Add".
-        editor.loadNote()
-        tooltip("Pasted content. Click 'Add' to save the new card.")
-    else:
-        # For an existing note, we use a checkpoint and flush to save immediately.
-        mw.checkpoint("Paste from AI")
-        note.flush()
-        editor.loadNote(focusTo=field_index) # Reload and focus on the edited field
-        mw.progress.finish()
-        tooltip(f"Pasted content into '{target_field_name}'.")
+        # A new note is saved by the user clicking "Add"; the editor already shows the paste.
+        tooltip(f"Pasted content{images_note}. Click 'Add' to save the new card.")
+        return
+
+    # An existing note is saved in the background with its own undo entry. The editor is
+    # the initiator, so it does not reload itself when the change is applied.
+    def op(col):
+        undo_entry = col.add_custom_undo_entry("Paste from AI")
+        col.update_note(note)
+        return col.merge_undo_entries(undo_entry)
+
+    CollectionOp(parent=editor.widget, op=op).success(
+        lambda _changes: tooltip(f"Pasted content into '{target_field_name}'{images_note}.")).run_in_background(initiator=editor)
 
 # --- FUNZIONE AGGIORNATA ---
 def trigger_paste_from_ai_webview():
-<<<<<<< HEAD
-    """
-    Attiva l'incollamento del contenuto selezionato nel webview del dock AI.
-    """
-    editor = None
-    # Iterate through top-level widgets to find the active editor
-    for win in mw.app.topLevelWidgets():
-        if hasattr(win, 'editor') and win.editor and win.isActiveWindow():
-            if hasattr(win.editor, 'ai_dock_webview'):
-                editor = win.editor
-                break
-    if not editor:
-        if mw.state == 'review' and hasattr(mw.reviewer, 'ai_dock_webview'):
-            tooltip("Pasting from AI is typically for editor windows.")
-            return
-        tooltip("Shortcut can only be used when an editor with AI Dock is active."); return
-=======
     """Triggers pasting from the AI webview using the dropdown as the target."""
-    target_object = None
-    
-    # First check for active editor windows
-    for win in mw.app.topLevelWidgets():
-        if hasattr(win, 'editor') and win.editor and win.isActiveWindow():
-            if hasattr(win.editor, 'ai_dock_webview'):
-                target_object = win.editor
-                break
-    
-    # If no editor found, check if we're in review mode
-    if not target_object and mw.state == "review" and hasattr(mw, 'reviewer') and mw.reviewer:
-        if hasattr(mw.reviewer, 'ai_dock_webview'):
-            target_object = mw.reviewer
-    
-    if not target_object:
+    target_object = dock_registry.focused_dock()
+    if not target_object or not (hasattr(target_object, 'ai_dock_webview') or hasattr(target_object, 'ai_dock_api_panel')):
         tooltip("Shortcut can only be used when an editor or reviewer with AI Dock is active.")
         return
->>>>>>> refactor-init
 
     # For reviewer, we can't paste to fields, so just show the selected content from AI panel
     if target_object == mw.reviewer:
-        print(f"DEBUG: Trying to get selection from AI webview in reviewer")
-        target_object.ai_dock_webview.page().runJavaScript(GET_SELECTION_HTML_JS,
+        _get_dock_answer_html(target_object,
             lambda html: tooltip(f"AI Panel content: {html[:100]}...") if html else tooltip("No content selected in AI panel."))
         return
 
-<<<<<<< HEAD
-    # Use the AI dock's webview to get selected HTML
-    editor.ai_dock_webview.page().runJavaScript(GET_SELECTION_HTML_JS,
-        lambda html: on_text_pasted_from_ai(editor, html, field_name))
-
-def on_copy_with_prompt_from_editor(prompt_template: str):
-    """
-    Copia il testo selezionato dall'editor e lo combina con un template di prompt.
-    """
-    editor = None
-=======
     # For editor, use the field dropdown to paste content from AI panel
     field_name = target_object.ai_dock_field_combobox.currentText()
     if not field_name:
         showWarning("Please select a target field in the top bar.")
         return
 
-    target_object.ai_dock_webview.page().runJavaScript(GET_SELECTION_HTML_JS,
+    _get_dock_answer_html(target_object,
         lambda html: on_text_pasted_from_ai(target_object, html, field_name))
 
-def on_copy_with_prompt_from_editor(prompt_template: str):
+def _get_dock_answer_html(target_object, callback):
+    """Selected HTML of the dock: from the native panel of a Direct API site, else from the web page."""
+    api_panel = getattr(target_object, 'ai_dock_api_panel', None)
+    # isVisibleTo: the panel still counts as shown while the whole dock is hidden
+    if api_panel is not None and api_panel.isVisibleTo(target_object.ai_dock_panel):
+        callback(api_panel.selected_html())
+        return
+    webview = getattr(target_object, 'ai_dock_webview', None)
+    if webview is None:
+        callback("")
+        return
+    get_dock_selection_html(webview.page(), callback)
+
+def on_copy_with_prompt_from_editor(prompt_template: str, auto_paste: bool = False):
     """Copies selected text from the Anki editor or reviewer and injects it into the AI service."""
-    target_object = None
-    webview = None
-    
-    # Debug: mostra lo stato di Anki
-    print(f"DEBUG: mw.state = {mw.state}")
-    print(f"DEBUG: hasattr(mw, 'reviewer') = {hasattr(mw, 'reviewer')}")
-    if hasattr(mw, 'reviewer'):
-        print(f"DEBUG: mw.reviewer = {mw.reviewer}")
-    
-    # First check for active editor windows
->>>>>>> refactor-init
-    for win in mw.app.topLevelWidgets():
-        if hasattr(win, 'editor') and win.editor and win.isActiveWindow():
-            target_object = win.editor
-            webview = target_object.web
-            print(f"DEBUG: Found editor window: {target_object}")
-            break
-    
-    # If no editor found, check if we're in review mode
-    if not target_object and mw.state == "review" and hasattr(mw, 'reviewer') and mw.reviewer:
-        target_object = mw.reviewer
-        webview = mw.reviewer.web
-        print(f"DEBUG: Found reviewer: {target_object}")
-    
+    target_object = dock_registry.focused_dock()
     if not target_object:
-        print(f"DEBUG: No target object found")
+        print("DEBUG: No dock registered for the active window")
         tooltip("Shortcut can only be used in an editor or review window.")
         return
 
-<<<<<<< HEAD
-    editor.web.page().runJavaScript("window.getSelection().toString();",
-        lambda text: _on_copy_text_received(editor, text, prompt_template))
+    # Templates that only read the note are rendered without asking the page for a selection
+    try:
+        needs_selection = compile_template(prompt_template).uses_selection
+    except TemplateError as e:
+        showWarning(f"Invalid prompt template: {e}")
+        return
+    if not needs_selection:
+        _on_copy_text_received(target_object, "", prompt_template, auto_paste)
+        return
 
-def _on_copy_text_received(editor, text: str, prompt_template:str):
-    """
-    Funzione callback che riceve il testo e inietta il prompt completo.
-    """
-    if not text:
-        tooltip("No text selected in editor.")
-=======
+    # The page pushes its selection as it changes, so usually no round trip is needed
+    cached = get_cached_selection(target_object)
+    if cached is not None:
+        record_cache_hit()
+        _on_copy_text_received(target_object, cached["text"], prompt_template, auto_paste)
+        return
+
+    webview = getattr(target_object, 'web', None)
     if not webview:
-        print(f"DEBUG: No webview found")
+        print("DEBUG: No webview found")
         tooltip("Could not find web content to extract text from.")
         return
 
-    print(f"DEBUG: Using webview: {webview}")
-    print(f"DEBUG: About to get text selection from webview")
-    webview.page().runJavaScript("window.getSelection().toString();",
-        lambda text: _on_copy_text_received(target_object, text, prompt_template))
+    started = time.perf_counter()
+
+    def on_selection(text):
+        print(f"DEBUG: Selection round trip took {record_round_trip(started):.1f} ms")
+        _on_copy_text_received(target_object, text or "", prompt_template, auto_paste)
 
-def _on_copy_text_received(target_object, text: str, prompt_template:str):
-    """Callback that formats the prompt and injects it."""
+    webview.page().runJavaScript("window.getSelection().toString();", on_selection)
+
+def _on_copy_text_received(target_object, text: str, prompt_template:str, auto_paste: bool = False, refresh: bool = False):
+    """
+    Callback that formats the prompt and injects it. An answer already in the
+    response cache is offered first, unless refresh is set.
+    """
     print(f"DEBUG: _on_copy_text_received called with text: '{text[:50]}...' (length: {len(text)})")
-    if not text.strip():
+    try:
+        template = compile_template(prompt_template)
+    except TemplateError as e:
+        showWarning(f"Invalid prompt template: {e}")
+        return
+    if template.uses_selection and not text.strip():
         tooltip("No text selected.")
->>>>>>> refactor-init
         return
-    full_prompt = prompt_template.format(text=text)
+    full_prompt = template.render(_template_context(target_object, text))
+    if not full_prompt.strip():
+        tooltip("The prompt is empty for this note.")
+        return
+    cache_text = template.cache_input(text, full_prompt)
+    site_combobox = getattr(target_object, 'ai_dock_site_combobox', None)
+    site_name = site_combobox.currentText() if site_combobox is not None else ""
+    if not refresh:
+        cached_html = response_cache.lookup(site_name, prompt_template, cache_text)
+        if cached_html is not None:
+            print(f"DEBUG: Response cache hit ({response_cache.describe_stats()})")
+            _offer_cached_answer(target_object, site_name, cached_html,
+                lambda: _on_copy_text_received(target_object, text, prompt_template, auto_paste, refresh=True))
+            return
     print(f"DEBUG: Formatted prompt: '{full_prompt[:50]}...'")
-    inject_prompt_into_ai_webview(target_object, full_prompt)
+    history_store.record(PROMPT, full_prompt, site_name, *_history_context(target_object))
+    inject_prompt_into_ai_webview(target_object, full_prompt, auto_paste, (site_name, prompt_template, cache_text))
+
+def _template_context(target_object, text):
+    """Renders templates from the dock's note: the editor's note, or the reviewer's card."""
+    if isinstance(target_object, Editor):
+        card = getattr(target_object, 'card', None)
+        deck_chooser = getattr(target_object.parentWindow, 'deck_chooser', None)
+        deck_id = card.odid or card.did if card else getattr(deck_chooser, 'selected_deck_id', None)
+        return NoteContext(target_object.note, text, deck_id)
+    card = getattr(target_object, 'card', None)
+    if card is None:
+        return NoteContext(None, text)
+    return NoteContext(card.note(), text, card.odid or card.did)
+
+def _offer_cached_answer(target_object, site_name, html, refresh):
+    """Shows a cached answer, letting the user paste it or ask the AI again."""
+    field_name = target_object.ai_dock_field_combobox.currentText() if isinstance(target_object, Editor) else None
+    parent = getattr(target_object, '_ai_dock_window', None) or mw
+    choice = CachedAnswerDialog(parent, html, site_name, field_name).exec()
+    if choice == CachedAnswerDialog.USE:
+        on_text_pasted_from_ai(target_object, html, field_name)
+    elif choice == CachedAnswerDialog.REFRESH:
+        refresh()
+
+def remember_response(target_object, html, cache_entry):
+    """Keeps html in the history and in the response cache as the answer to the prompt of cache_entry."""
+    if cache_entry is None or not html:
+        return
+    site_name, prompt_template, text = cache_entry
+    history_store.record(CAPTURED, html, site_name, *_history_context(target_object))
+    response_cache.store(site_name, prompt_template, text, html)
+
+def _history_context(target_object):
+    """(note id, target field) recorded with history entries of a dock."""
+    if isinstance(target_object, Editor):
+        note_id = target_object.note.id if target_object.note else 0
+        return note_id, target_object.ai_dock_field_combobox.currentText()
+    card = getattr(target_object, 'card', None)
+    return (card.nid if card else 0), ""
 
 def toggle_ai_dock_visibility():
-<<<<<<< HEAD
-    """
-    Mostra o nasconde il pannello del dock AI nella finestra attiva.
-    """
-=======
     """Shows or hides the AI dock panel in the currently active window."""
->>>>>>> refactor-init
-    target = None
-    active_win = QApplication.activeWindow()
-    if hasattr(active_win, 'editor') and active_win.editor:
-        target = active_win.editor
-    elif mw.state == "review" and hasattr(mw, 'reviewer'):
-        target = mw.reviewer
-<<<<<<< HEAD
-    else:
-        for win in mw.app.topLevelWidgets():
-            if isinstance(win, (AddCards, Browser, EditCurrent)) and hasattr(win, 'editor') and win.editor:
-                target = win.editor
-                break
-
-=======
-    
->>>>>>> refactor-init
+    target = dock_registry.focused_dock()
+
     if target and hasattr(target, 'ai_dock_panel'):
         panel = target.ai_dock_panel
         is_visible = not panel.isVisible()
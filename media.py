@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+import base64
+import binascii
+import hashlib
+import re
+
+MEDIA_PREFIX = "ai-dock-"
+# Estensioni per i tipi MIME più comuni nelle risposte delle AI
+IMAGE_EXTENSIONS = {
+    "image/png": "png",
+    "image/jpeg": "jpg",
+    "image/jpg": "jpg",
+    "image/gif": "gif",
+    "image/webp": "webp",
+    "image/svg+xml": "svg",
+    "image/bmp": "bmp",
+    "image/avif": "avif",
+}
+
+# src quoted with " or ', or unquoted (the sanitizer may be off): then the payload ends
+# at whitespace or at the end of the tag
+DATA_IMAGE_RE = re.compile(
+    r"""(<img\b[^>]*?\bsrc\s*=\s*)(["'])?data:(image/[\w.+-]+)((?:;[\w-]+=[^;,"'\s>]*)*);base64,"""
+    r"""((?(2)[^"']*|[^"'\s>]*))(?(2)\2)""",
+    re.IGNORECASE,
+)
+
+# Totals since Anki started
+media_stats = {"pastes": 0, "images": 0, "written": 0, "bytes_saved": 0}
+
+
+def media_filename(data, mime):
+    """Content-addressed name: the same image always gets the same file."""
+    digest = hashlib.sha256(data).hexdigest()[:20]
+    return f"{MEDIA_PREFIX}{digest}.{IMAGE_EXTENSIONS.get(mime.lower(), 'img')}"
+
+
+def extract_inline_images(html, media):
+    """
+    Moves the base64 data: images of html into media files and points their src at
+    the files. media needs have(name) and write_data(name, data), like col.media.
+    Returns (html, stats); images that fail to decode are left untouched. An unquoted
+    src (possible with the sanitizer off) is handled too and written back quoted.
+    """
+    stats = {"images": 0, "written": 0, "bytes_saved": 0}
+    if "data:image/" not in html.lower():
+        return html, stats
+
+    def replace(match):
+        prefix, quote, mime, _params, payload = match.groups()
+        try:
+            data = base64.b64decode(re.sub(r"\s+", "", payload), validate=True)
+        except (binascii.Error, ValueError):
+            return match.group(0)
+        if not data:
+            return match.group(0)
+        filename = media_filename(data, mime)
+        if not media.have(filename):
+            # write_data may pick another name on a clash, so use the one it returns
+            filename = media.write_data(filename, data)
+            stats["written"] += 1
+        stats["images"] += 1
+        quote = quote or '"'
+        replacement = f"{prefix}{quote}{filename}{quote}"
+        stats["bytes_saved"] += len(match.group(0)) - len(replacement)
+        return replacement
+
+    html = DATA_IMAGE_RE.sub(replace, html)
+    if stats["images"]:
+        media_stats["pastes"] += 1
+        for key in ("images", "written", "bytes_saved"):
+            media_stats[key] += stats[key]
+    return html, stats
+
+
+def describe_media_stats():
+    return (f"{media_stats['images']} inline images in {media_stats['pastes']} pastes, "
+            f"{media_stats['written']} new files, {media_stats['bytes_saved'] / 1024:.0f} KB kept out of notes")
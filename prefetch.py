@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+from collections import deque
+
+from anki.errors import NotFoundError
+from anki.utils import strip_html
+from aqt import mw
+
+from .api_batch import api_batch_engine
+from .batch import BatchWorker, batch_settings
+from .config import get_config, get_config_section
+from .direct_api import is_api_site, markdown_to_html, site_url
+from .response_cache import cache_key, response_cache
+from .templates import NoteContext, TemplateError, compile_template
+
+# Prefetched answers remembered for the hit/wasted statistics (oldest are forgotten first)
+PREFETCHED_LIMIT = 500
+
+
+def prefetch_settings():
+    return get_config_section("prefetch")
+
+
+class _PrefetchJobs:
+    """What a BatchWorker needs to know about the jobs it runs (see batch.BatchRunner)."""
+
+    def __init__(self, site_name):
+        self.spec = {"site_name": site_name}
+        self.settings = batch_settings()
+
+
+class ReviewPrefetcher:
+    """
+    Opt-in look-ahead for the reviewer: while a question is shown, the chosen prompt
+    is rendered against the chosen field of the next cards in the scheduler queue and
+    answered in the background (Direct API engine, or one hidden dock page for web
+    sites). Answers land in the response cache, so the dock shows them as soon as
+    their card comes up.
+    """
+
+    def __init__(self):
+        self._queue = deque()
+        self._queued_keys = set()
+        self._callbacks = {}
+        self._worker = None
+        self._prefetched = {}
+        self.stats = {"requested": 0, "completed": 0, "failed": 0, "hits": 0, "misses": 0}
+
+    def on_show_question(self, card):
+        settings = prefetch_settings()
+        if not settings["enabled"]:
+            return
+        request = self._render(card.note(), card.odid or card.did, settings)
+        if request is not None:
+            self._show_answer(request)
+        self._look_ahead(card, settings)
+
+    def describe_stats(self):
+        stats = self.stats
+        shown = stats["hits"] + stats["misses"]
+        hit_rate = (100.0 * stats["hits"] / shown) if shown else 0.0
+        wasted = stats["failed"] + sum(1 for used in self._prefetched.values() if not used)
+        return (f"{stats['hits']} hits, {stats['misses']} misses ({hit_rate:.0f}% hit rate), "
+                f"{stats['requested']} requested, {wasted} wasted")
+
+    def shutdown(self):
+        self._queue.clear()
+        self._queued_keys.clear()
+        self._callbacks.clear()
+        self._prefetched.clear()
+        if self._worker is not None:
+            self._worker.release()
+            self._worker = None
+
+    def _render(self, note, deck_id, settings):
+        """(site_name, site, template, cache input, prompt) for note, or None if it cannot be prefetched."""
+        config = get_config()
+        prompt = next((p for p in config.get("prompts", []) if p["name"] == settings["prompt"]), None)
+        site_combobox = getattr(mw.reviewer, "ai_dock_site_combobox", None)
+        site_name = site_combobox.currentText() if site_combobox is not None else config.get("last_choice", "")
+        site = config.get("ai_sites", {}).get(site_name)
+        if prompt is None or site is None or settings["field"] not in note:
+            return None
+        try:
+            template = compile_template(prompt["template"])
+        except TemplateError:
+            return None
+        text = strip_html(note[settings["field"]]).strip()
+        if template.uses_selection and not text:
+            return None
+        rendered = template.render(NoteContext(note, text, deck_id))
+        if not rendered.strip():
+            return None
+        # Same cache input as a prompt sent from the dock (see logic._on_copy_text_received)
+        return site_name, site, prompt["template"], template.cache_input(text, rendered), rendered
+
+    def _show_answer(self, request):
+        site_name, _site, template, text, _prompt = request
+        key = cache_key(site_name, template, text)
+        if key in self._prefetched:
+            self._prefetched[key] = True
+        html = response_cache.lookup(site_name, template, text)
+        self.stats["hits" if html is not None else "misses"] += 1
+        view = getattr(mw.reviewer, "ai_dock_prefetch_view", None)
+        if view is None:
+            return
+        if html is None:
+            view.setVisible(False)
+            return
+        view.setHtml(html)
+        view.setVisible(True)
+
+    def _look_ahead(self, card, settings):
+        queued = mw.col.sched.get_queued_cards(fetch_limit=settings["lookahead"] + 1)
+        for queued_card in queued.cards:
+            if queued_card.card.id == card.id:
+                continue
+            try:
+                note = mw.col.get_note(queued_card.card.note_id)
+            except NotFoundError:
+                continue
+            queued_deck_id = queued_card.card.original_deck_id or queued_card.card.deck_id
+            request = self._render(note, queued_deck_id, settings)
+            if request is None:
+                continue
+            site_name, _site, template, text, _prompt = request
+            key = cache_key(site_name, template, text)
+            if key in self._queued_keys or key in self._prefetched or response_cache.contains(site_name, template, text):
+                continue
+            self._queued_keys.add(key)
+            self.stats["requested"] += 1
+            self._start(key, request)
+
+    def _start(self, key, request):
+        site_name, site, template, text, prompt = request
+
+        def on_answer(html, error):
+            self._queued_keys.discard(key)
+            if error or not html:
+                self.stats["failed"] += 1
+                return
+            self.stats["completed"] += 1
+            self._prefetched[key] = False
+            while len(self._prefetched) > PREFETCHED_LIMIT:
+                del self._prefetched[next(iter(self._prefetched))]
+            response_cache.store(site_name, template, text, html)
+
+        if is_api_site(site):
+            api_batch_engine.submit_job(site_name, site, prompt,
+                                        lambda answer, error: on_answer(markdown_to_html(answer), error))
+            return
+        self._callbacks[key] = on_answer
+        self._queue.append((key, site_name, site_url(site), prompt))
+        self._run_next()
+
+    def _run_next(self):
+        """Web sites are prefetched one at a time on a single hidden page."""
+        if not self._queue or (self._worker is not None and self._worker.busy):
+            return
+        key, site_name, url, prompt = self._queue.popleft()
+        if self._worker is not None and self._worker.site_url != url:
+            self._worker.release()
+            self._worker = None
+        if self._worker is None:
+            self._worker = BatchWorker(url, self._on_worker_finished)
+        self._worker.run(_PrefetchJobs(site_name), key, prompt)
+
+    def _on_worker_finished(self, _worker, _jobs, key, html, error, _elapsed):
+        on_answer = self._callbacks.pop(key, None)
+        if on_answer is not None:
+            on_answer(html, error)
+        self._run_next()
+
+
+# Istanza globale
+review_prefetcher = ReviewPrefetcher()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+from aqt import mw
+from aqt.qt import QApplication
+
+
+class DockRegistry:
+    """
+    Central registry of every injected AI Dock, keyed by its top-level window.
+    Lets shortcut handlers find the dock of the focused window with a single
+    dictionary lookup instead of scanning mw.app.topLevelWidgets().
+    """
+
+    def __init__(self):
+        self._docks = {}
+        self._active = None
+        self._focus_hooked = False
+
+    def register(self, window, target_object):
+        """Registers the dock hosted by target_object inside window."""
+        key = id(window)
+        self._docks[key] = target_object
+        target_object._ai_dock_window = window
+        self._active = target_object
+        # Capture only the key: capturing the window would keep it alive.
+        window.destroyed.connect(lambda *_args, k=key: self.unregister(k))
+        self._hook_focus_tracking()
+
+    def unregister(self, key):
+        """Removes the dock registered under key (the id of its window) and runs its cleanups."""
+        target_object = self._docks.pop(key, None)
+        if target_object is None:
+            return None
+        if target_object is self._active:
+            self._active = None
+        for cleanup in getattr(target_object, "_ai_dock_cleanups", []):
+            try:
+                cleanup()
+            except Exception as e:
+                print(f"DEBUG: AI Dock cleanup {cleanup} failed: {e}")
+        target_object._ai_dock_cleanups = []
+        return target_object
+
+    def add_cleanup(self, target_object, cleanup):
+        """Schedules cleanup() to run when the dock's window is destroyed."""
+        if not hasattr(target_object, "_ai_dock_cleanups"):
+            target_object._ai_dock_cleanups = []
+        target_object._ai_dock_cleanups.append(cleanup)
+
+    def dock_for_window(self, window):
+        """Returns the dock hosted by window, or None."""
+        if window is None:
+            return None
+        return self._docks.get(id(window))
+
+    def focused_dock(self):
+        """
+        Returns the dock of the currently focused window. The reviewer dock is
+        only returned while Anki is actually reviewing.
+        """
+        target_object = self.dock_for_window(QApplication.activeWindow())
+        if target_object is not None and target_object is getattr(mw, "reviewer", None) and mw.state != "review":
+            return None
+        return target_object
+
+    def active_dock(self):
+        """Returns the focused dock, falling back to the most recently focused one."""
+        return self.focused_dock() or self._active
+
+    def all_docks(self):
+        return list(self._docks.values())
+
+    def show_status(self, summary, active=True):
+        """Shows summary in the status label of every dock (as tooltip only when not active)."""
+        for target_object in self.all_docks():
+            label = getattr(target_object, "ai_dock_status_label", None)
+            if label is None:
+                continue
+            try:
+                label.setToolTip(summary)
+                if active:
+                    label.setText(summary)
+            except RuntimeError:
+                # The dock's widgets are already gone
+                pass
+
+    def _hook_focus_tracking(self):
+        if self._focus_hooked:
+            return
+        self._focus_hooked = True
+        mw.app.focusChanged.connect(self._on_focus_changed)
+
+    def _on_focus_changed(self, _old, now):
+        if now is None:
+            return
+        target_object = self.dock_for_window(now.window())
+        if target_object is not None:
+            self._active = target_object
+
+
+# Istanza globale del registro
+dock_registry = DockRegistry()
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+from PyQt6.QtWebEngineCore import QWebEnginePage, QWebEngineSettings
+
+from .config import get_config_section
+from .diagnostics import format_stats, page_stats
+from .lifecycle import lifecycle_manager
+from .registry import dock_registry
+from .webpool import page_pool
+
+def budget_settings():
+    return get_config_section("resource_budget")
+
+
+def apply_profile_budget(profile):
+    """
+    Applies the profile-scoped part of the resource budget to the shared AI Dock
+    profile: disk cache cap, lite mode (no images, no autoplay) and GPU canvas/WebGL.
+    """
+    budget = budget_settings()
+    cache_mb = int(budget["http_cache_mb"] or 0)
+    # 0 lets Chromium pick its own size
+    profile.setHttpCacheMaximumSize(cache_mb * 1024 * 1024)
+
+    settings = profile.settings()
+    lite_mode = bool(budget["lite_mode"])
+    settings.setAttribute(QWebEngineSettings.WebAttribute.AutoLoadImages, not lite_mode)
+    if lite_mode:
+        settings.setAttribute(QWebEngineSettings.WebAttribute.PlaybackRequiresUserGesture, True)
+    else:
+        # Back to Qt's default, which already asks for a gesture before playing media
+        settings.resetAttribute(QWebEngineSettings.WebAttribute.PlaybackRequiresUserGesture)
+
+    gpu = bool(budget["gpu_acceleration"])
+    settings.setAttribute(QWebEngineSettings.WebAttribute.WebGLEnabled, gpu)
+    settings.setAttribute(QWebEngineSettings.WebAttribute.Accelerated2dCanvasEnabled, gpu)
+
+
+def chromium_flags(budget=None):
+    """
+    Process-wide Chromium switches for the budget. Chromium reads them only once,
+    from QTWEBENGINE_CHROMIUM_FLAGS before Anki creates its first web view, so
+    they have to be set in the environment that launches Anki.
+    """
+    budget = budget or budget_settings()
+    flags = []
+    if int(budget["renderer_process_limit"] or 0) > 0:
+        flags.append(f"--renderer-process-limit={int(budget['renderer_process_limit'])}")
+    if budget["disable_jit"]:
+        flags.append("--js-flags=--jitless")
+    if budget["disable_gpu_rasterization"]:
+        flags.append("--disable-gpu-rasterization")
+    return " ".join(flags)
+
+
+def missing_chromium_flags(budget=None):
+    """Flags of the budget that are not active in the running process."""
+    active = os.environ.get("QTWEBENGINE_CHROMIUM_FLAGS", "").split()
+    return [flag for flag in chromium_flags(budget).split() if flag not in active]
+
+
+def dock_pages():
+    """Every page owned by the AI Dock: pages shown in docks plus pooled standby pages."""
+    pages = []
+    for target_object in dock_registry.all_docks():
+        webview = getattr(target_object, "ai_dock_webview", None)
+        if webview is not None:
+            pages.append(webview.page())
+    pages.extend(page_pool.idle_pages())
+    return pages
+
+
+def describe_dock_resources():
+    """Short diagnostics readout: renderer memory now and memory released by the budget."""
+    pages = dock_pages()
+    discarded = sum(1 for p in pages if p.lifecycleState() == QWebEnginePage.LifecycleState.Discarded)
+    frozen = sum(1 for p in pages if p.lifecycleState() == QWebEnginePage.LifecycleState.Frozen)
+
+    # Several pages can share one renderer process
+    by_pid = {}
+    for page in pages:
+        pid = page.renderProcessPid()
+        if pid and pid not in by_pid:
+            by_pid[pid] = page_stats(page)
+    total_rss = sum(stats["rss"] for stats in by_pid.values() if stats)
+    released_mb = lifecycle_manager.rss_released / (1024 * 1024)
+
+    lines = [
+        f"Dock pages: {len(pages)} ({frozen} frozen, {discarded} discarded), "
+        f"renderer processes: {len(by_pid)}",
+        f"Resident memory of dock renderers: {total_rss / (1024 * 1024):.0f} MB",
+        f"Resident memory released by freezing/discarding: {released_mb:.0f} MB",
+    ]
+    for pid, stats in by_pid.items():
+        lines.append(f"  pid {pid}: {format_stats(stats)}")
+    return "\n".join(lines)
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+
+from aqt import mw
+
+from .config import get_config_section
+
+DB_NAME = "ai_dock_responses.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    site TEXT NOT NULL,
+    template TEXT NOT NULL,
+    input_hash TEXT NOT NULL,
+    html TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used);
+"""
+
+
+def response_cache_settings():
+    return get_config_section("response_cache")
+
+
+def normalize_input(text):
+    """Selections differing only in whitespace share the same cache entry."""
+    return re.sub(r"\s+", " ", text or "").strip()
+
+
+def input_hash(text):
+    return hashlib.sha256(normalize_input(text).encode("utf-8")).hexdigest()
+
+
+def cache_key(site, template, text):
+    return hashlib.sha256(json.dumps([site, template.strip(), input_hash(text)]).encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    SQLite cache of AI answers in the profile folder, keyed by (site, prompt
+    template, hash of the normalized selection). Entries expire after ttl_days
+    and the least recently used ones are evicted beyond max_entries / max_mb.
+    """
+
+    def __init__(self):
+        self._db = None
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evicted": 0, "expired": 0}
+
+    @property
+    def db_path(self):
+        return os.path.join(mw.pm.profileFolder(), DB_NAME)
+
+    def enabled(self):
+        return response_cache_settings()["enabled"]
+
+    def lookup(self, site, template, text):
+        """Returns the cached answer HTML, or None."""
+        if not self.enabled():
+            return None
+        db = self._connection()
+        key = cache_key(site, template, text)
+        row = db.execute("SELECT html, created FROM responses WHERE key = ?", (key,)).fetchone()
+        now = time.time()
+        if row is not None and now - row[1] > self._ttl_s():
+            db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            db.commit()
+            self.stats["expired"] += 1
+            row = None
+        if row is None:
+            self.stats["misses"] += 1
+            return None
+        db.execute("UPDATE responses SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, key))
+        db.commit()
+        self.stats["hits"] += 1
+        return row[0]
+
+    def contains(self, site, template, text):
+        """True if a live entry exists; unlike lookup() it counts no hit or miss."""
+        if not self.enabled():
+            return False
+        row = self._connection().execute("SELECT created FROM responses WHERE key = ?",
+                                         (cache_key(site, template, text),)).fetchone()
+        return row is not None and time.time() - row[0] <= self._ttl_s()
+
+    def store(self, site, template, text, html):
+        if not self.enabled() or not html:
+            return
+        db = self._connection()
+        now = time.time()
+        db.execute("INSERT OR REPLACE INTO responses (key, site, template, input_hash, html, size, created, last_used) "
+                   "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                   (cache_key(site, template, text), site, template, input_hash(text), html,
+                    len(html.encode("utf-8")), now, now))
+        self.stats["stores"] += 1
+        self._evict(db)
+        db.commit()
+
+    def clear(self):
+        db = self._connection()
+        db.execute("DELETE FROM responses")
+        db.commit()
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def describe_stats(self):
+        stats = self.stats
+        lookups = stats["hits"] + stats["misses"]
+        hit_rate = (100.0 * stats["hits"] / lookups) if lookups else 0.0
+        return (f"{stats['hits']} hits, {stats['misses']} misses ({hit_rate:.0f}% hit rate), "
+                f"{stats['stores']} stored, {stats['evicted']} evicted, {stats['expired']} expired")
+
+    def _ttl_s(self):
+        return response_cache_settings()["ttl_days"] * 86400
+
+    def _connection(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.db_path)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(SCHEMA)
+            expired = self._db.execute("DELETE FROM responses WHERE created < ?", (time.time() - self._ttl_s(),))
+            self.stats["expired"] += expired.rowcount
+            self._db.commit()
+        return self._db
+
+    def _evict(self, db):
+        """Drops least recently used entries until both the entry and the size limits hold."""
+        settings = response_cache_settings()
+        count, total = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        max_bytes = settings["max_mb"] * 1024 * 1024
+        if count <= settings["max_entries"] and total <= max_bytes:
+            return
+        excess_rows = max(0, count - settings["max_entries"])
+        excess_bytes = total - max_bytes
+        doomed = []
+        for key, size in db.execute("SELECT key, size FROM responses ORDER BY last_used"):
+            if excess_rows <= 0 and excess_bytes <= 0:
+                break
+            doomed.append((key,))
+            excess_rows -= 1
+            excess_bytes -= size
+        db.executemany("DELETE FROM responses WHERE key = ?", doomed)
+        self.stats["evicted"] += len(doomed)
+
+
+# Istanza globale della cache
+response_cache = ResponseCache()
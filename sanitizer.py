@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+
+import html
+import re
+import time
+from html.parser import HTMLParser
+
+from .config import config_manager, get_config_section
+
+ALLOWED_TAGS = {
+    "a", "b", "blockquote", "br", "code", "div", "em", "h1", "h2", "h3", "h4", "h5", "h6", "hr", "i", "img",
+    "li", "ol", "p", "pre", "s", "strong", "sub", "sup", "table", "tbody", "td", "th", "thead", "tr", "u", "ul",
+}
+ALLOWED_ATTRIBUTES = {
+    "a": {"href"},
+    "img": {"src", "alt"},
+    "td": {"colspan", "rowspan"},
+    "th": {"colspan", "rowspan"},
+}
+# Dropped together with their content (chat UI chrome, scripts, icons)
+DROPPED_TAGS = {"button", "canvas", "form", "head", "iframe", "input", "noscript", "script", "select", "style",
+                "svg", "template", "textarea", "title"}
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+BLOCK_TAGS = {"blockquote", "div", "h1", "h2", "h3", "h4", "h5", "h6", "hr", "li", "ol", "p", "pre", "table",
+              "tbody", "td", "th", "thead", "tr", "ul", "br"}
+SAFE_URL_RE = re.compile(r"^(?:https?:|mailto:|data:image/|[^:]*$)", re.IGNORECASE)
+WHITESPACE_RE = re.compile(r"\s+")
+
+# Inline styles of a <span> that carry meaning, e.g. in Qt's rich text (QTextDocument.toHtml):
+# the span becomes the matching tag instead of being unwrapped
+STYLE_TAGS = (
+    ("b", re.compile(r"font-weight\s*:\s*(?:bold|[6-9]00)", re.IGNORECASE)),
+    ("i", re.compile(r"font-style\s*:\s*italic", re.IGNORECASE)),
+    ("s", re.compile(r"text-decoration\s*:[^;]*line-through", re.IGNORECASE)),
+    ("code", re.compile(r"font-family\s*:[^;]*monospace", re.IGNORECASE)),
+)
+
+# Math rendered by KaTeX / MathJax / MathML becomes Anki's \( \) and \[ \]
+TEX_ANNOTATION = "application/x-tex"
+
+
+def sanitizer_settings():
+    return get_config_section("sanitizer")
+
+
+class _Sanitizer(HTMLParser):
+    """Single pass over the markup: every tag is kept, unwrapped or dropped as it is read."""
+
+    def __init__(self, allowed_tags, allowed_attributes, convert_math):
+        super().__init__(convert_charrefs=True)
+        self.allowed_tags = allowed_tags
+        self.allowed_attributes = allowed_attributes
+        self.convert_math = convert_math
+        self.out = []
+        # (tag, tags emitted for it) of every open non-void element
+        self.stack = []
+        self.drop_depth = 0
+        self.pre_depth = 0
+        # Per open <pre>: [open <code> depth, saw <code>, out indexes of text outside <code>]
+        self.pre_frames = []
+        # While inside rendered math: [depth, display, tex parts, in annotation, text parts]
+        self.math = None
+        self.after_block = True
+
+    def handle_starttag(self, tag, attrs):
+        self._start(tag, attrs, self_closing=False)
+
+    def handle_startendtag(self, tag, attrs):
+        self._start(tag, attrs, self_closing=True)
+
+    def _start(self, tag, attrs, self_closing):
+        void = tag in VOID_TAGS or self_closing
+        attributes = dict(attrs)
+        if self.drop_depth:
+            if not void:
+                self.drop_depth += 1
+            return
+        if self.math is not None:
+            if not void:
+                self.math[0] += 1
+                if tag == "annotation" and (attributes.get("encoding") or "").lower() == TEX_ANNOTATION:
+                    self.math[3] = True
+            return
+        if tag in DROPPED_TAGS:
+            script_type = attributes.get("type") or ""
+            if tag == "script" and self.convert_math and "math/tex" in script_type:
+                # MathJax 2 keeps the source in <script type="math/tex; mode=display">
+                self.math = [1, "mode=display" in script_type, [], True, []]
+                return
+            if not void:
+                self.drop_depth = 1
+            return
+        classes = (attributes.get("class") or "").split()
+        if self.convert_math and (tag in ("math", "mjx-container") or "katex" in classes or "katex-display" in classes):
+            if not void:
+                display = "katex-display" in classes or attributes.get("display") in ("block", "true")
+                self.math = [1, display, [], False, []]
+            return
+        if tag == "pre":
+            self.pre_depth += 1
+            self.pre_frames.append([0, False, []])
+        elif tag == "code" and self.pre_frames and not void:
+            frame = self.pre_frames[-1]
+            frame[0] += 1
+            if not frame[1]:
+                # The block has real code: text read so far outside it is toolbar chrome ("python", "Copy")
+                frame[1] = True
+                for index in frame[2]:
+                    self.out[index] = ""
+        if tag == "span" and not self.pre_depth and not void:
+            styled = tuple(name for name, style_re in STYLE_TAGS
+                           if name in self.allowed_tags and style_re.search(attributes.get("style") or ""))
+            if styled:
+                self.out.append("".join(f"<{name}>" for name in styled))
+                self.after_block = False
+                self.stack.append((tag, styled))
+                return
+        # Inside code blocks only the code text is kept, without highlighting spans or toolbars
+        emitted = (tag,) if tag in self.allowed_tags and (not self.pre_depth or tag in ("pre", "code", "br")) else ()
+        if emitted:
+            self.out.append(self._open_tag(tag, attrs))
+            self.after_block = tag in BLOCK_TAGS
+        if not void:
+            self.stack.append((tag, emitted))
+
+    def handle_endtag(self, tag):
+        if self.drop_depth:
+            self.drop_depth -= 1
+            return
+        if self.math is not None:
+            self.math[0] -= 1
+            if tag == "annotation":
+                self.math[3] = False
+            if self.math[0] <= 0:
+                self._close_math()
+            return
+        if not any(open_tag == tag for open_tag, _emitted in self.stack):
+            return
+        # Close elements the source left open, innermost first
+        while self.stack:
+            open_tag, emitted = self.stack.pop()
+            if open_tag == "pre":
+                self.pre_depth -= 1
+                self.pre_frames.pop()
+            elif open_tag == "code" and self.pre_frames:
+                self.pre_frames[-1][0] -= 1
+            if emitted:
+                self.out.append("".join(f"</{name}>" for name in reversed(emitted)))
+                self.after_block = open_tag in BLOCK_TAGS
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        if self.drop_depth:
+            return
+        if self.math is not None:
+            self.math[2 if self.math[3] else 4].append(data)
+            return
+        if not self.pre_depth:
+            data = WHITESPACE_RE.sub(" ", data)
+            if self.after_block:
+                data = data.lstrip()
+            if not data:
+                return
+        elif not self.pre_frames[-1][0]:
+            # Text of a <pre> outside its <code>: kept only while the block has no <code> at all
+            frame = self.pre_frames[-1]
+            if frame[1]:
+                return
+            frame[2].append(len(self.out))
+        self.out.append(html.escape(data, quote=False))
+        self.after_block = False
+
+    def close(self):
+        super().close()
+        if self.math is not None:
+            self._close_math()
+        while self.stack:
+            _open_tag, emitted = self.stack.pop()
+            self.out.append("".join(f"</{name}>" for name in reversed(emitted)))
+        return "".join(self.out).strip()
+
+    def _close_math(self):
+        _depth, display, tex_parts, _in_annotation, text_parts = self.math
+        self.math = None
+        tex = "".join(tex_parts).strip() or WHITESPACE_RE.sub(" ", "".join(text_parts)).strip()
+        if tex:
+            self.out.append(html.escape(f"\\[{tex}\\]" if display else f"\\({tex}\\)", quote=False))
+            self.after_block = False
+
+    def _open_tag(self, tag, attrs):
+        allowed = self.allowed_attributes.get(tag, ())
+        parts = [tag]
+        for name, value in attrs:
+            if name not in allowed or value is None:
+                continue
+            if name in ("href", "src") and not SAFE_URL_RE.match(value.strip()):
+                continue
+            parts.append(f'{name}="{html.escape(value, quote=True)}"')
+        return f"<{' '.join(parts)}>"
+
+
+def sanitize_html(markup, settings=None):
+    """
+    Reduces markup copied from an AI site to what a note field needs: allowlisted tags
+    and attributes only, collapsed whitespace, code blocks as plain <pre><code> and
+    rendered math (KaTeX, MathJax, MathML) as \\( \\) / \\[ \\] source.
+    """
+    settings = settings or config_manager.default_section("sanitizer")
+    allowed_tags = ALLOWED_TAGS | set(settings["extra_tags"])
+    allowed_attributes = {tag: set(names) for tag, names in ALLOWED_ATTRIBUTES.items()}
+    for tag, names in settings["extra_attributes"].items():
+        allowed_attributes.setdefault(tag, set()).update(names)
+    parser = _Sanitizer(allowed_tags, allowed_attributes, settings["convert_math"])
+    parser.feed(markup)
+    return parser.close()
+
+
+def _benchmark_fixture(blocks):
+    """Markup shaped like a long chat answer: class soup, highlighted code, KaTeX and tables."""
+    block = (
+        '<div class="markdown prose w-full break-words dark:prose-invert light" data-message-id="x">'
+        '<p data-start="0" data-end="80" style="margin: 0 0 1em">The <strong class="font-bold">derivative</strong> '
+        'of <span class="katex"><span class="katex-mathml"><math><semantics><mrow><msup><mi>x</mi><mn>2</mn></msup>'
+        '</mrow><annotation encoding="application/x-tex">x^2</annotation></semantics></math></span>'
+        '<span class="katex-html" aria-hidden="true"><span class="base"><span class="mord mathnormal">x</span>'
+        '<span class="msupsub"><span class="mord">2</span></span></span></span></span> is   <em>2x</em>.</p>\n'
+        '<pre class="overflow-visible"><div class="contain-inline-size"><div class="toolbar">python'
+        '<button class="copy">Copy code</button></div><code class="hljs language-python">'
+        '<span class="hljs-keyword">def</span> <span class="hljs-title">f</span>(x):\n    '
+        '<span class="hljs-keyword">return</span> x ** <span class="hljs-number">2</span>\n</code></div></pre>\n'
+        '<table class="min-w-full"><thead><tr><th style="x">x</th><th>f(x)</th></tr></thead>'
+        '<tbody><tr><td data-col="1">2</td><td>4</td></tr></tbody></table>'
+        '<svg viewBox="0 0 24 24"><path d="M0 0h24v24H0z"></path></svg></div>\n'
+    )
+    return block * blocks
+
+
+def benchmark_sanitizer(markup=None, repeat=20):
+    """
+    Times sanitize_html over markup (by default a ~1 MB synthetic chat answer) and
+    returns throughput and size reduction, e.g. from Anki's debug console:
+    print(__import__(...).sanitizer.benchmark_sanitizer()).
+    """
+    markup = markup if markup is not None else _benchmark_fixture(700)
+    result = sanitize_html(markup)
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        sanitize_html(markup)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    median_s = timings[len(timings) // 2]
+    return {
+        "input_bytes": len(markup.encode("utf-8")),
+        "output_bytes": len(result.encode("utf-8")),
+        "ratio": len(markup) / max(len(result), 1),
+        "median_ms": median_s * 1000,
+        "mb_per_s": len(markup.encode("utf-8")) / 1048576 / median_s if median_s else 0.0,
+    }
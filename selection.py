@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+from .bridge import add_editor_page_script, on_editor_event
+
+SELECTION_DEBOUNCE_MS = 80
+
+# Pushes the current selection of an editor/reviewer page to Python whenever it
+# settles, and marks the cache pending as soon as it starts changing. Editor fields
+# live in shadow roots, so their own selection is used when the document selection
+# is empty.
+SELECTION_WATCH_JS = """
+(function() {
+    const bridge = window.__aiDockBridge;
+    if (!bridge || bridge.watchingSelection) return;
+    bridge.watchingSelection = true;
+
+    function currentSelection() {
+        let selection = window.getSelection();
+        let active = document.activeElement;
+        while ((!selection || selection.isCollapsed) && active && active.shadowRoot && active.shadowRoot.getSelection) {
+            selection = active.shadowRoot.getSelection();
+            active = active.shadowRoot.activeElement;
+        }
+        if (!selection || selection.rangeCount === 0) return {text: '', html: ''};
+        const div = document.createElement('div');
+        div.appendChild(selection.getRangeAt(0).cloneContents());
+        return {text: selection.toString(), html: div.innerHTML};
+    }
+
+    let timer = null;
+    document.addEventListener('selectionchange', function() {
+        if (timer === null) bridge.push('selection-pending', {});
+        clearTimeout(timer);
+        timer = setTimeout(() => {
+            timer = null;
+            bridge.push('selection', currentSelection());
+        }, __DEBOUNCE__);
+    }, true);
+    bridge.push('selection', {text: '', html: ''});
+})();
+"""
+
+# Round trips avoided thanks to the cache, and the measured cost of one.
+selection_stats = {"cache_hits": 0, "round_trips": 0, "avg_round_trip_ms": 0.0}
+
+
+def _on_selection_pushed(context, payload):
+    payload = payload or {}
+    context._ai_dock_selection = {
+        "text": payload.get("text", ""),
+        "html": payload.get("html", ""),
+        "time": time.monotonic(),
+        "pending": False,
+    }
+
+
+def _on_selection_pending(context, _payload):
+    cached = getattr(context, "_ai_dock_selection", None) or {"text": "", "html": "", "time": time.monotonic()}
+    context._ai_dock_selection = dict(cached, pending=True)
+
+
+def register_selection_cache():
+    """Installs the selection watcher in editor/reviewer pages and starts caching its updates."""
+    add_editor_page_script(SELECTION_WATCH_JS.replace("__DEBOUNCE__", str(SELECTION_DEBOUNCE_MS)))
+    on_editor_event("selection", _on_selection_pushed)
+    on_editor_event("selection-pending", _on_selection_pending)
+
+
+def get_cached_selection(target_object):
+    """
+    Returns the last selection pushed by target_object's page ({"text", "html"}), or None
+    when the page must be asked: nothing cached, an empty selection (the push may not have
+    arrived yet) or a change still within the debounce window.
+    """
+    cached = getattr(target_object, "_ai_dock_selection", None)
+    if not cached or cached.get("pending") or not cached["text"].strip():
+        return None
+    return cached
+
+
+def record_cache_hit():
+    selection_stats["cache_hits"] += 1
+    saved = selection_stats["avg_round_trip_ms"]
+    if saved:
+        print(f"DEBUG: AI Dock selection served from cache, ~{saved:.1f} ms round trip saved "
+              f"({selection_stats['cache_hits']} hits so far)")
+
+
+def record_round_trip(started):
+    """Feeds the duration of a fallback runJavaScript selection query into the running average."""
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    selection_stats["round_trips"] += 1
+    count = selection_stats["round_trips"]
+    selection_stats["avg_round_trip_ms"] += (elapsed_ms - selection_stats["avg_round_trip_ms"]) / count
+    return elapsed_ms
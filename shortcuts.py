@@ -4,6 +4,7 @@ from aqt import mw
 from aqt.qt import QAction, QKeySequence, Qt
 
 from .config import get_config
+from .direct_api import redact_api_keys
 from .logic import (
     on_copy_with_prompt_from_editor,
     toggle_ai_dock_visibility,
@@ -18,7 +19,7 @@ def setup_shortcuts():
     """
     print("DEBUG: setup_shortcuts() called")
     config = get_config()
-    print(f"DEBUG: Config loaded: {config}")
+    print(f"DEBUG: Config loaded: {redact_api_keys(config)}")
     
     # Clear any previously registered shortcuts to prevent duplicates
     if hasattr(mw, '_ai_dock_shortcuts'):
@@ -59,6 +60,12 @@ def setup_shortcuts():
         if p_val.get("shortcut"):
             print(f"DEBUG: Registering prompt shortcut: {p_val.get('shortcut')} for {p_val.get('name')}")
             # Use a lambda that captures p_val['template'] by value
-            register(p_val["shortcut"], lambda checked=False, tmpl=p_val['template']: on_copy_with_prompt_from_editor(tmpl))
+            register(p_val["shortcut"], lambda checked=False, tmpl=p_val['template'], auto=p_val.get('auto_paste', False):
+                     on_copy_with_prompt_from_editor(tmpl, auto))
     
     print("DEBUG: setup_shortcuts() completed")
+
+
+def on_shortcuts_changed(change):
+    """Re-applies the shortcuts when a shortcut key or a prompt bound to one changed."""
+    setup_shortcuts()
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+"""
+The add-on runs inside Anki, so aqt, anki and PyQt6 are not importable here.
+Stand-ins for them are registered before the add-on modules are imported, and
+the add-on folder is loaded as the package "ai_dock" without running its
+__init__.py (which registers the Anki hooks).
+"""
+
+import http.server
+import json
+import os
+import re
+import sys
+import threading
+import time
+import types
+from unittest import mock
+
+import pytest
+
+ADDON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class _StubMeta(type):
+    def __getattr__(cls, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        value = mock.MagicMock(name=f"{cls.__name__}.{name}")
+        setattr(cls, name, value)
+        return value
+
+
+class _Stub(metaclass=_StubMeta):
+    """Any Qt / Anki class: accepts every argument and every attribute, usable as a base class."""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        value = mock.MagicMock(name=name)
+        object.__setattr__(self, name, value)
+        return value
+
+    def __call__(self, *args, **kwargs):
+        # Decorators such as pyqtSlot(str) hand back the decorated function
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return mock.MagicMock()
+
+
+class _StubModule(types.ModuleType):
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        value = mock.MagicMock(name=name) if name in ("mw", "gui_hooks") else type(name, (_Stub,), {})
+        setattr(self, name, value)
+        return value
+
+
+def _install_stub_modules():
+    for name in ("aqt", "aqt.qt", "aqt.utils", "aqt.editor", "aqt.reviewer", "aqt.operations", "aqt.addcards",
+                 "aqt.browser", "aqt.editcurrent", "anki", "anki.cards", "anki.errors", "PyQt6",
+                 "PyQt6.QtCore", "PyQt6.QtWebChannel", "PyQt6.QtWebEngineCore", "PyQt6.QtWebEngineWidgets"):
+        sys.modules.setdefault(name, _StubModule(name))
+    utils = types.ModuleType("anki.utils")
+    utils.strip_html = lambda text: re.sub(r"<[^>]*>", "", text)
+    utils.ids2str = lambda ids: "(" + ",".join(str(i) for i in ids) + ")"
+    sys.modules.setdefault("anki.utils", utils)
+    errors = sys.modules["anki.errors"]
+    errors.NotFoundError = type("NotFoundError", (Exception,), {})
+
+    package = types.ModuleType("ai_dock")
+    package.__path__ = [ADDON_DIR]
+    package.__file__ = os.path.join(ADDON_DIR, "__init__.py")
+    sys.modules.setdefault("ai_dock", package)
+    # pytest imports the add-on folder itself by its directory name while collecting it:
+    # hand it the same placeholder so __init__.py never runs
+    sys.modules.setdefault(os.path.basename(ADDON_DIR), package)
+
+
+_install_stub_modules()
+
+
+@pytest.fixture
+def config(monkeypatch):
+    """Empty live settings (so the defaults apply), as returned by get_config()."""
+    from ai_dock.config_manager import config_manager
+    live = {}
+    monkeypatch.setattr(config_manager, "_config", {"version": "test", "settings": live})
+    return live
+
+
+class ChatStubHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Minimal OpenAI-compatible /v1/chat/completions server. The reply echoes the prompt;
+    server.latency_s delays each answer and server.script lists (status, headers)
+    to answer with before the normal replies.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with server.lock:
+            server.requests.append(body)
+            scripted = server.script.pop(0) if server.script else None
+        time.sleep(server.latency_s)
+        if scripted is not None:
+            status, headers = scripted
+            payload = b'{"error": {"message": "scripted"}}'
+            self.send_response(status)
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+        answer = "echo: " + body["messages"][-1]["content"]
+        if body.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for word in re.findall(r"\S+\s*", answer) + [None]:
+                data = "[DONE]" if word is None else json.dumps({"choices": [{"delta": {"content": word}}]})
+                chunk = f"data: {data}\n\n".encode("utf-8")
+                self.wfile.write(f"{len(chunk):x}\r\n".encode("ascii") + chunk + b"\r\n")
+            self.wfile.write(b"0\r\n\r\n")
+            return
+        payload = json.dumps(server.reply(answer)).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def chat_server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), ChatStubHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.requests = []
+    server.script = []
+    server.latency_s = 0.0
+    server.reply = lambda answer: {"choices": [{"message": {"content": answer}}]}
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+from html.parser import HTMLParser
+from unittest import mock
+
+import pytest
+
+from ai_dock import adapters
+from ai_dock.bridge import DockBridge
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures", "sites")
+
+
+class FakePage:
+    def __init__(self):
+        self.loadStarted = mock.MagicMock()
+        self._ai_dock_busy = False
+        self.url = lambda: mock.MagicMock(toString=lambda: "https://chat.example/")
+
+
+@pytest.fixture
+def page(config, monkeypatch):
+    """A page with a real DockBridge; commands sent to the page are recorded."""
+    page = FakePage()
+    bridge = DockBridge(page)
+    bridge.ready = True
+    bridge.commands = []
+    bridge.call = lambda name, **args: bridge.commands.append((name, args))
+    page._ai_dock_bridge = bridge
+    monkeypatch.setattr(adapters, "get_runtime", lambda: ("v1", ""))
+    return page
+
+
+def listener_count(bridge):
+    return sum(len(handlers) for handlers in bridge._listeners.values())
+
+
+def test_response_complete_clears_busy_and_listeners(page):
+    bridge = page._ai_dock_bridge
+    results = []
+    adapters.watch_response(page, "Stub", results.append)
+    assert page._ai_dock_busy
+    token = bridge.commands[-1][1]["token"]
+    bridge.push("response-complete", f'{{"token": {token + 1}, "html": "other"}}')
+    assert results == []
+    bridge.push("response-complete", f'{{"token": {token}, "html": "<p>a</p>"}}')
+    assert results[0]["html"] == "<p>a</p>"
+    assert not page._ai_dock_busy
+    assert listener_count(bridge) == 0
+
+
+def test_reload_releases_a_pending_watch(page):
+    bridge = page._ai_dock_bridge
+    results = []
+    for _ in range(3):
+        adapters.watch_response(page, "Stub", results.append)
+    bridge._on_load_started()
+    assert [result["error"] for result in results] == ["the page was reloaded"] * 3
+    assert not page._ai_dock_busy
+    assert listener_count(bridge) == 0
+
+
+def test_reload_fails_a_pending_injection(page):
+    bridge = page._ai_dock_bridge
+    bridge.push("input-ready", '{"version": "v1"}')
+    outcomes = []
+    adapters.inject_prompt(page, "Stub", "hello", outcomes.append)
+    assert bridge.commands[-1][0] == "inject"
+    bridge._on_load_started()
+    assert outcomes == [False]
+    assert listener_count(bridge) == 0
+    # A late answer of the old document changes nothing
+    bridge.push("injected", f'{{"token": {bridge.commands[-1][1]["token"]}, "ok": true}}')
+    assert outcomes == [False]
+
+
+class Element:
+    def __init__(self, tag, attrs, parent):
+        self.tag = tag
+        self.attrs = {name: value or "" for name, value in attrs}
+        self.parent = parent
+        self.children = []
+        self.text = []
+
+    def inner_text(self):
+        return "".join(self.text) + "".join(child.inner_text() for child in self.children)
+
+    def descendants(self):
+        for child in self.children:
+            yield child
+            yield from child.descendants()
+
+
+class FixtureDocument(HTMLParser):
+    """A saved page as a tree of Elements, queried with the CSS subset the adapters use."""
+
+    VOID = {"br", "hr", "img", "input", "meta", "link"}
+    COMPOUND_RE = re.compile(r'([\w-]*)((?:#[\w-]+|\.[\w-]+|\[[^\]]*\])*)')
+    PART_RE = re.compile(r'#([\w-]+)|\.([\w-]+)|\[([\w-]+)(?:([*]?=)"([^"]*)")?\]')
+
+    def __init__(self, path):
+        super().__init__()
+        self.root = self.current = Element("#document", [], None)
+        with open(path, encoding="utf-8") as f:
+            self.feed(f.read())
+
+    def handle_starttag(self, tag, attrs):
+        element = Element(tag, attrs, self.current)
+        self.current.children.append(element)
+        if tag not in self.VOID:
+            self.current = element
+
+    def handle_endtag(self, tag):
+        node = self.current
+        while node is not self.root and node.tag != tag:
+            node = node.parent
+        if node is not self.root:
+            self.current = node.parent
+
+    def handle_data(self, data):
+        self.current.text.append(data)
+
+    def query_all(self, selector):
+        compounds = [m.groups() for m in self.COMPOUND_RE.finditer(selector) if m.group(0)]
+        return [e for e in self.root.descendants() if self._matches(e, compounds)]
+
+    def query(self, selector):
+        matches = self.query_all(selector)
+        return matches[0] if matches else None
+
+    def _matches(self, element, compounds):
+        if not self._matches_compound(element, compounds[-1]):
+            return False
+        if len(compounds) == 1:
+            return True
+        ancestor = element.parent
+        while ancestor is not None:
+            if self._matches(ancestor, compounds[:-1]):
+                return True
+            ancestor = ancestor.parent
+        return False
+
+    def _matches_compound(self, element, compound):
+        tag, parts = compound
+        if tag and element.tag != tag:
+            return False
+        for id_, class_, attr, op, value in self.PART_RE.findall(parts):
+            if id_ and element.attrs.get("id") != id_:
+                return False
+            if class_ and class_ not in element.attrs.get("class", "").split():
+                return False
+            if attr:
+                actual = element.attrs.get(attr)
+                if actual is None or (op == "=" and actual != value) or (op == "*=" and value not in actual):
+                    return False
+        return True
+
+
+def find_input(document, adapter):
+    """Same lookup as findInput() of the adapter runtime."""
+    return next((el for el in map(document.query, adapter["selectors"]) if el is not None), None)
+
+
+def last_response(document, adapter):
+    """Same lookup as lastResponse() of the adapter runtime."""
+    for selector in adapter["response"]:
+        matches = document.query_all(selector)
+        if matches:
+            return matches[-1]
+    return None
+
+
+@pytest.mark.parametrize("fixture, url, expected", [
+    ("gemini.html", "https://gemini.google.com/app/1", "Gemini"),
+    ("chatgpt.html", "https://chatgpt.com/c/1", "ChatGPT"),
+    ("claude.html", "https://claude.ai/chat/1", "Claude"),
+    ("perplexity.html", "https://www.perplexity.ai/search/1", "Perplexity"),
+])
+def test_builtin_adapters_match_their_site(config, fixture, url, expected):
+    document = FixtureDocument(os.path.join(FIXTURES_DIR, fixture))
+    # A dock named after something else still finds the adapter through the host
+    name = adapters.resolve_adapter_name("My AI", url)
+    assert name == expected
+    adapter = adapters.get_site_adapters()[name]
+
+    prompt_box = find_input(document, adapter)
+    assert prompt_box is not None
+    if adapter["input"] == "paragraph":
+        assert prompt_box.attrs.get("contenteditable") == "true"
+    elif adapter["input"] == "value":
+        assert prompt_box.tag in ("textarea", "input")
+
+    answer = last_response(document, adapter)
+    assert answer is not None and answer.inner_text().strip() == "Meiosis halves the chromosomes."
+    assert adapter["busy"] and document.query(adapter["busy"]) is None
+
+    submit = adapters.batch_submit_strategy(name, url)
+    assert submit.startswith("click:") and document.query(submit[len("click:"):]) is not None
+
+
+def test_config_adapters_are_merged_over_the_builtin_ones(config):
+    config["site_adapters"] = {
+        "ChatGPT": {"selectors": ["#composer"]},
+        "Mistral": {"match": ["chat.mistral.ai"], "selectors": ["textarea"], "input": "value", "submit": "enter"},
+    }
+    site_adapters = adapters.get_site_adapters()
+    chatgpt = site_adapters["ChatGPT"]
+    assert chatgpt["selectors"] == ["#composer"]
+    assert chatgpt["response"] == adapters.DEFAULT_SITE_ADAPTERS["ChatGPT"]["response"]
+    assert chatgpt["batch_submit"] == adapters.DEFAULT_SITE_ADAPTERS["ChatGPT"]["batch_submit"]
+    assert adapters.DEFAULT_SITE_ADAPTERS["ChatGPT"]["selectors"] == ["#prompt-textarea", "textarea"]
+    assert adapters.resolve_adapter_name("Le Chat", "https://chat.mistral.ai/chat") == "Mistral"
+    assert adapters.batch_submit_strategy("Mistral") == "enter"
+    assert adapters.resolve_adapter_name("Other", "https://example.org/") == "default"
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+import queue
+import threading
+import time
+
+import pytest
+
+from ai_dock.api_batch import ApiBatchEngine
+
+FAST_SETTINGS = {"concurrency": 8, "requests_per_minute": 60000, "burst": 1000, "max_retries": 3,
+                 "backoff_base_s": 0.01, "backoff_max_s": 0.05, "deliver_every_s": 0.02}
+
+
+@pytest.fixture
+def engine(config):
+    """An engine whose batched results are run by the test thread, standing in for the Qt main thread."""
+    config["api_batch"] = dict(FAST_SETTINGS)
+    deliveries = queue.Queue()
+    engine = ApiBatchEngine(deliver=deliveries.put)
+
+    def pump(done, timeout=20):
+        deadline = time.monotonic() + timeout
+        while not done():
+            assert time.monotonic() < deadline, "the engine did not deliver in time"
+            try:
+                deliveries.get(timeout=0.1)()
+            except queue.Empty:
+                pass
+            engine.describe_metrics()
+
+    engine.pump = pump
+    yield engine
+    engine.shutdown()
+
+
+def site_for(server):
+    return {"type": "api", "url": server.url, "model": "stub"}
+
+
+def submit_all(engine, server, prompts):
+    results = {}
+    for prompt in prompts:
+        engine.submit_job("Stub", site_for(server), prompt,
+                          lambda text, error, p=prompt: results.__setitem__(p, (text, error)))
+    engine.pump(lambda: len(results) == len(set(prompts)))
+    return results
+
+
+def test_results_are_delivered_for_every_job(engine, chat_server):
+    results = submit_all(engine, chat_server, [f"prompt {i}" for i in range(20)])
+    assert results["prompt 7"] == ("echo: prompt 7", None)
+    assert engine.stats["completed"] == 20
+
+
+def test_identical_requests_in_flight_are_sent_once(engine, chat_server):
+    chat_server.latency_s = 0.2
+    answers = []
+    for _ in range(5):
+        engine.submit_job("Stub", site_for(chat_server), "same", lambda text, error: answers.append(text))
+    engine.pump(lambda: len(answers) == 5)
+    assert answers == ["echo: same"] * 5
+    assert len(chat_server.requests) == 1
+    assert engine.stats["deduplicated"] == 4
+
+
+def test_rate_limited_and_server_errors_are_retried(engine, chat_server):
+    chat_server.script = [(429, {"Retry-After": "0"}), (503, {})]
+    results = submit_all(engine, chat_server, ["retry me"])
+    assert results["retry me"] == ("echo: retry me", None)
+    assert engine.stats["retried"] == 2
+    assert engine.stats["rate_limited"] == 1
+
+
+def test_client_errors_fail_without_retry(engine, chat_server):
+    chat_server.script = [(400, {})]
+    results = submit_all(engine, chat_server, ["bad"])
+    assert results["bad"][1].startswith("HTTP 400")
+    assert engine.stats["retried"] == 0
+
+
+def test_metrics_can_be_read_while_the_engine_records_completions(engine, chat_server):
+    errors = []
+    stop = threading.Event()
+
+    def read_metrics():
+        while not stop.is_set():
+            try:
+                engine.describe_metrics()
+            except RuntimeError as e:
+                errors.append(e)
+
+    reader = threading.Thread(target=read_metrics)
+    reader.start()
+    try:
+        submit_all(engine, chat_server, [f"prompt {i}" for i in range(200)])
+    finally:
+        stop.set()
+        reader.join()
+    assert errors == []
+
+
+def test_benchmark_against_stub_server_with_latency(engine, chat_server):
+    """32 requests answered after 200 ms each: about 0.8 s at 8 in flight, 6.4 s one by one."""
+    chat_server.latency_s = 0.2
+    started = time.monotonic()
+    results = submit_all(engine, chat_server, [f"prompt {i}" for i in range(32)])
+    elapsed = time.monotonic() - started
+    print(f"\n32 requests in {elapsed:.2f} s ({32 / elapsed:.1f} req/s): {engine.describe_metrics()}")
+    assert all(error is None for _text, error in results.values())
+    assert elapsed < 3.2
+
+
+def test_retry_after_is_capped_at_the_maximum_backoff(engine, chat_server):
+    chat_server.script = [(429, {"Retry-After": "30"})]
+    started = time.monotonic()
+    results = submit_all(engine, chat_server, ["wait"])
+    assert results["wait"] == ("echo: wait", None)
+    assert time.monotonic() - started < 5
+
+
+def test_shutdown_abandons_jobs_in_flight(engine, chat_server):
+    chat_server.latency_s = 0.5
+    answers = []
+    engine.outstanding = 3
+    engine.submit_job("Stub", site_for(chat_server), "slow", lambda text, error: answers.append(text))
+    time.sleep(0.1)
+    engine.shutdown()
+    assert engine.outstanding == 0
+    assert engine._inflight == {} and engine._results == []
+    # The next profile starts clean: only its own answers are delivered
+    chat_server.latency_s = 0.0
+    results = submit_all(engine, chat_server, ["fresh"])
+    settle = time.monotonic() + 0.8
+    engine.pump(lambda: time.monotonic() > settle)
+    assert results == {"fresh": ("echo: fresh", None)}
+    assert answers == []
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+
+from ai_dock import batch
+from ai_dock.batch import RENDERER_GONE, BatchJournal, BatchRunner, BatchWorker, batch_settings, resumed_runner
+
+
+class FakeRunner:
+    def __init__(self, **settings):
+        self.spec = {"site_name": "Stub"}
+        self.settings = dict(batch_settings(), **settings)
+
+
+@pytest.fixture
+def worker(config, monkeypatch):
+    """A BatchWorker on a fake page; injections and watchers are recorded instead of run."""
+    monkeypatch.setattr(batch, "page_pool", mock.MagicMock())
+    monkeypatch.setattr(batch, "get_persistent_ai_dock_profile", mock.MagicMock())
+    monkeypatch.setattr(batch, "batch_submit_strategy", lambda *args: None)
+    injections, watchers = [], []
+    monkeypatch.setattr(batch, "inject_prompt",
+                        lambda page, site, prompt, callback, submit=None: injections.append(callback))
+    monkeypatch.setattr(batch, "watch_response",
+                        lambda page, site, callback, timeout_ms=0: watchers.append(callback))
+    finished = []
+    worker = BatchWorker("https://stub.example/", lambda *args: finished.append(args))
+    worker.injections, worker.watchers, worker.finished = injections, watchers, finished
+    return worker
+
+
+def start_job(worker, nid=1, **settings):
+    runner = FakeRunner(**settings)
+    worker.run(runner, nid, "prompt")
+    worker._on_load_finished(True)
+    worker.injections[-1](True)
+    return runner
+
+
+def test_response_completes_the_job(worker):
+    runner = start_job(worker)
+    worker.watchers[-1]({"html": "<p>answer</p>"})
+    (_, finished_runner, nid, html, error, _elapsed), = worker.finished
+    assert (finished_runner, nid, html, error) == (runner, 1, "<p>answer</p>", None)
+    assert not worker.busy
+
+
+def test_python_watchdog_times_out_a_job_whose_page_never_answers(worker):
+    start_job(worker)
+    worker._watchdog.start.assert_called_with(batch_settings()["job_timeout_s"] * 1000)
+    worker._on_watchdog()
+    assert [args[4] for args in worker.finished] == ["timeout"]
+    assert not worker.busy
+    # A late answer of the abandoned job is ignored
+    worker.watchers[-1]({"html": "late"})
+    assert len(worker.finished) == 1
+    # The next job starts from a fresh load even without new_chat_per_job
+    worker.page.load.reset_mock()
+    worker.run(FakeRunner(new_chat_per_job=False), 2, "prompt")
+    worker.page.load.assert_called_once()
+
+
+def test_renderer_crash_fails_the_job_as_retryable(worker):
+    start_job(worker)
+    worker._on_render_process_terminated(None, 9)
+    assert [args[4] for args in worker.finished] == [RENDERER_GONE]
+    assert RENDERER_GONE in batch.RETRYABLE_ERRORS
+
+
+SPEC = {"prompt_name": "Explain", "template": "Explain {text}", "source_field": "Front",
+        "target_field": "Back", "site_name": "Stub", "site_url": "https://stub.example/"}
+
+
+class FakeNote(dict):
+    tags = []
+    id = 0
+
+
+class FakeCollection:
+    """Notes and an undo queue where every change is a step, as in Anki."""
+
+    def __init__(self, note_ids):
+        self.notes = {nid: FakeNote(Front=f"word {nid}", Back="") for nid in note_ids}
+        self.last_step = 0
+        self.undo_entries = []
+
+    def get_note(self, nid):
+        if nid not in self.notes:
+            raise batch.NotFoundError()
+        return self.notes[nid]
+
+    def _step(self):
+        self.last_step += 1
+        return self.last_step
+
+    def undo_status(self):
+        return SimpleNamespace(last_step=self.last_step)
+
+    def add_custom_undo_entry(self, name):
+        self.undo_entries.append(self._step())
+        return self.last_step
+
+    def update_notes(self, notes):
+        self._step()
+
+    def merge_undo_entries(self, target):
+        self.last_step = target
+
+    def user_edit(self):
+        self._step()
+
+
+class FakeOp:
+    """CollectionOp running the operation and its success callback right away."""
+
+    col = None
+
+    def __init__(self, parent, op):
+        self.op = op
+
+    def success(self, on_success):
+        self.on_success = on_success
+        return self
+
+    def run_in_background(self):
+        self.on_success(self.op(FakeOp.col))
+
+
+class FakeScheduler:
+    def __init__(self):
+        self.dispatched = 0
+
+    def dispatch(self):
+        self.dispatched += 1
+
+
+@pytest.fixture
+def collection(config, monkeypatch):
+    config["batch"] = {"apply_every": 2, "retries": 1}
+    col = FakeOp.col = FakeCollection(range(1, 6))
+    monkeypatch.setattr(batch, "mw", SimpleNamespace(col=col))
+    monkeypatch.setattr(batch, "CollectionOp", FakeOp)
+    monkeypatch.setattr(batch, "QTimer", SimpleNamespace(singleShot=lambda _ms, fn: fn()))
+    monkeypatch.setattr(batch, "tooltip", lambda *args, **kwargs: None)
+    return col
+
+
+def new_runner(tmp_path, note_ids):
+    journal = BatchJournal(str(tmp_path / "batch.jsonl"))
+    journal.start(SPEC, list(note_ids))
+    runner = BatchRunner(SPEC, list(note_ids), journal)
+    runner.scheduler = FakeScheduler()
+    return runner
+
+
+def drain(runner, answer=lambda nid, attempt: (f"<b>{nid}</b>", None)):
+    while (job := runner.next_job()) is not None:
+        nid, prompt = job
+        assert prompt == f"Explain word {nid}"
+        html, error = answer(nid, runner.attempts[nid])
+        if error:
+            runner.job_failed(nid, error, in_flight=True)
+        else:
+            runner.job_succeeded(nid, html)
+
+
+def test_runner_retries_retryable_failures_and_finishes(tmp_path, collection):
+    runner = new_runner(tmp_path, range(1, 6))
+    drain(runner, lambda nid, attempt: (None, "timeout") if nid == 2 and attempt == 1
+          else (None, "HTTP 400") if nid == 3 else (f"<b>{nid}</b>", None))
+    assert runner.finished and runner.done == 5 and runner.failed == 1
+    assert runner.attempts == {1: 1, 2: 2, 3: 1, 4: 1, 5: 1}
+    assert collection.notes[2]["Back"] == "<b>2</b>"
+    assert collection.notes[3]["Back"] == ""
+    assert runner.scheduler.dispatched == 1
+    # A finished batch is not offered for resuming
+    assert runner.journal.load() is None
+
+
+def test_retries_are_limited(tmp_path, collection):
+    runner = new_runner(tmp_path, [1])
+    drain(runner, lambda nid, attempt: (None, "timeout"))
+    assert runner.attempts == {1: 2}
+    assert runner.failed == 1 and runner.finished
+
+
+def test_write_backs_share_one_undo_entry(tmp_path, collection):
+    runner = new_runner(tmp_path, range(1, 6))
+    drain(runner)
+    assert len(collection.undo_entries) == 1
+
+
+def test_user_edits_during_the_batch_are_not_merged_into_its_undo_entry(tmp_path, collection):
+    runner = new_runner(tmp_path, range(1, 6))
+
+    def answer(nid, attempt):
+        if nid == 3:
+            collection.user_edit()
+        return f"<b>{nid}</b>", None
+
+    drain(runner, answer)
+    assert len(collection.undo_entries) == 2
+    assert all(note["Back"] for note in collection.notes.values())
+
+
+def test_journal_resumes_an_interrupted_batch(tmp_path, collection):
+    runner = new_runner(tmp_path, range(1, 6))
+    for _ in range(3):
+        nid, _prompt = runner.next_job()
+        runner.job_succeeded(nid, f"<b>{nid}</b>")
+    # 1 and 2 were written back, 3 was answered but not saved; then Anki closed mid-line
+    with open(runner.journal.path, "a", encoding="utf-8") as f:
+        f.write('{"type": "res')
+    state = BatchJournal(runner.journal.path).load()
+    assert state["results"] == {1: "<b>1</b>", 2: "<b>2</b>", 3: "<b>3</b>"}
+    assert state["applied"] == {1, 2}
+
+    collection.notes[3]["Back"] = ""
+    resumed = resumed_runner(runner.journal, state)
+    resumed.scheduler = FakeScheduler()
+    assert list(resumed.queue) == [4, 5]
+    assert resumed.pending == {3: "<b>3</b>"}
+    assert (resumed.done, resumed.total) == (3, 5)
+    drain(resumed)
+    assert resumed.finished
+    assert [note["Back"] for note in collection.notes.values()] == [f"<b>{nid}</b>" for nid in range(1, 6)]
+    assert runner.journal.load() is None
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+import http.server
+import threading
+import urllib.parse
+import urllib.request
+from html.parser import HTMLParser
+from unittest import mock
+
+import pytest
+
+from ai_dock.blocker import Blocklist, RequestBlocker, invalid_entries, parse_allow_rules
+
+
+def test_host_entries_block_the_host_and_its_subdomains():
+    blocklist = Blocklist(["doubleclick.net", ".sentry.io"])
+    assert blocklist.should_block("doubleclick.net", "https://doubleclick.net/x")
+    assert blocklist.should_block("Stats.G.DoubleClick.net", "https://stats.g.doubleclick.net/x")
+    assert blocklist.should_block("o1.ingest.sentry.io", "https://o1.ingest.sentry.io/api")
+    assert not blocklist.should_block("notdoubleclick.net", "https://notdoubleclick.net/")
+    assert not blocklist.should_block("gemini.google.com", "https://gemini.google.com/app")
+
+
+def test_globs_and_regexes_match_the_whole_url():
+    blocklist = Blocklist(["*://*/collect/*", r"/\/log_event\b/", "# comment", ""])
+    assert blocklist.should_block("example.com", "https://example.com/collect/v2")
+    assert blocklist.should_block("chat.example", "https://chat.example/api/log_event?x=1")
+    assert not blocklist.should_block("example.com", "https://example.com/collection")
+
+
+def test_allow_rules_apply_only_to_their_first_party_site():
+    blocklist = Blocklist(["googletagmanager.com", "*/gtag/*"],
+                          parse_allow_rules("gemini.google.com: googletagmanager.com\nbad line"))
+    url = "https://www.googletagmanager.com/gtm.js"
+    assert not blocklist.should_block("www.googletagmanager.com", url, "gemini.google.com")
+    assert blocklist.should_block("www.googletagmanager.com", url, "chat.openai.com")
+    assert blocklist.should_block("www.googletagmanager.com", url)
+    # Allowing a host does not allow the other entries on that site
+    assert blocklist.should_block("cdn.example", "https://cdn.example/gtag/js", "gemini.google.com")
+
+
+def test_invalid_regex_entries_are_skipped_and_reported():
+    blocklist = Blocklist(["/[/", "hotjar.com", "/ads\\//"])
+    assert [entry for entry, _error in blocklist.invalid] == ["/[/"]
+    assert blocklist.should_block("static.hotjar.com", "https://static.hotjar.com/c.js")
+    assert blocklist.should_block("example.com", "https://example.com/ads/banner.js")
+    assert [entry for entry, _error in invalid_entries(["/[/", "a.com", "*ok*", "/(/"])] == ["/[/", "/(/"]
+
+
+def test_patterns_that_only_fail_together_still_work():
+    blocklist = Blocklist(["/(?i)tracker/", "/beacon/"])
+    assert blocklist.should_block("a.example", "https://a.example/TRACKER.js")
+    assert blocklist.should_block("a.example", "https://a.example/beacon")
+
+
+def _request(url, first_party):
+    info = mock.MagicMock()
+    info.requestUrl.return_value.host.return_value = url.split("/")[2]
+    info.requestUrl.return_value.toString.return_value = url
+    info.firstPartyUrl.return_value.host.return_value = first_party
+    return info
+
+
+def test_interceptor_blocks_and_counts(config):
+    config["request_blocker"] = {"enabled": True, "blocklist": ["hotjar.com", "/[/"], "allow": {}}
+    blocker = RequestBlocker()
+    blocked = _request("https://static.hotjar.com/c.js", "chat.openai.com")
+    allowed = _request("https://chat.openai.com/app.js", "chat.openai.com")
+    blocker.interceptRequest(blocked)
+    blocker.interceptRequest(allowed)
+    blocked.block.assert_called_once_with(True)
+    allowed.block.assert_not_called()
+    assert blocker.stats == {"seen": 2, "blocked": 1}
+    assert "Ignored invalid entry /[/" in blocker.describe_stats()
+
+
+class FixturePageHandler(http.server.BaseHTTPRequestHandler):
+    """Serves a chat-like page whose scripts and images include tracker requests."""
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests.append((self.headers["Host"].split(":")[0], self.path))
+        port = self.server.server_address[1]
+        if self.path == "/chat":
+            body = (f'<html><head><script src="http://127.0.0.1:{port}/app.js"></script>'
+                    f'<script src="http://localhost:{port}/gtm.js"></script></head>'
+                    f'<body><img src="http://127.0.0.1:{port}/log_event?e=view">'
+                    f'<img src="http://127.0.0.1:{port}/logo.png"></body></html>').encode()
+        else:
+            body = b"x" * 100
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def page_server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), FixturePageHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class _Subresources(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.urls = []
+
+    def handle_starttag(self, tag, attrs):
+        src = dict(attrs).get("src")
+        if src:
+            self.urls.append(src)
+
+
+class _Url:
+    def __init__(self, url):
+        self.url = url
+
+    def host(self):
+        return urllib.parse.urlsplit(self.url).hostname or ""
+
+    def toString(self):
+        return self.url
+
+
+class _RequestInfo:
+    """The parts of QWebEngineUrlRequestInfo the interceptor reads."""
+
+    def __init__(self, url, first_party_url):
+        self._url = _Url(url)
+        self._first_party = _Url(first_party_url)
+        self.blocked = False
+
+    def requestUrl(self):
+        return self._url
+
+    def firstPartyUrl(self):
+        return self._first_party
+
+    def block(self, blocked):
+        self.blocked = blocked
+
+
+# Straight to the fixture server, whatever proxy the environment sets
+_opener = urllib.request.build_opener(urllib.request.ProxyHandler({}))
+
+
+def _load(blocker, page_url):
+    """Loads page_url and its subresources as the profile would, through the interceptor."""
+    with _opener.open(page_url, timeout=5) as response:
+        parser = _Subresources()
+        parser.feed(response.read().decode())
+    for url in parser.urls:
+        info = _RequestInfo(url, page_url)
+        blocker.interceptRequest(info)
+        if not info.blocked:
+            _opener.open(url, timeout=5).read()
+
+
+def test_blocked_requests_never_reach_the_fixture_server(config, page_server):
+    config["request_blocker"] = {"enabled": True, "blocklist": ["localhost", r"/\/log_event\b/"], "allow": {}}
+    blocker = RequestBlocker()
+    _load(blocker, f"http://127.0.0.1:{page_server.server_address[1]}/chat")
+    assert sorted(page_server.requests) == [("127.0.0.1", "/app.js"), ("127.0.0.1", "/chat"), ("127.0.0.1", "/logo.png")]
+    assert blocker.stats == {"seen": 4, "blocked": 2}
+    assert blocker.blocked_by_host == {"localhost": 1, "127.0.0.1": 1}
+
+
+def test_allow_rules_let_the_first_party_page_load_the_host(config, page_server):
+    config["request_blocker"] = {"enabled": True, "blocklist": ["localhost"], "allow": {"127.0.0.1": ["localhost"]}}
+    blocker = RequestBlocker()
+    _load(blocker, f"http://127.0.0.1:{page_server.server_address[1]}/chat")
+    assert ("localhost", "/gtm.js") in page_server.requests
+    assert blocker.stats == {"seen": 4, "blocked": 0}
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import json
+
+import pytest
+
+from ai_dock.config_manager import ConfigManager
+
+
+@pytest.fixture
+def new_manager(tmp_path):
+    def new_manager():
+        manager = ConfigManager()
+        manager._config_file = str(tmp_path / "ai_dock_settings.json")
+        manager._backup_file = str(tmp_path / "ai_dock_settings_backup.json")
+        return manager
+    return new_manager
+
+
+def read_backup(manager, generation):
+    with gzip.open(manager.backup_generation_file(generation), "rt", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_saves_rotate_the_previous_version_into_the_backups(new_manager):
+    manager = new_manager()
+    manager.load_config()
+    manager._config["settings"]["last_choice"] = "Claude"
+    assert manager.save_config()
+    assert read_backup(manager, 1)["settings"]["last_choice"] == "Gemini"
+
+
+def test_damaged_file_is_recovered_without_losing_the_backup(new_manager):
+    manager = new_manager()
+    manager.load_config()
+    manager._config["settings"]["last_choice"] = "Claude"
+    manager.save_config()
+    good_backup = read_backup(manager, 1)
+    with open(manager.config_file, "w", encoding="utf-8") as f:
+        f.write('{"version": "1.0", "settings": {"prom')
+
+    recovered = new_manager()
+    config = recovered.load_config()
+    assert config["settings"] == good_backup["settings"]
+    with open(recovered.config_file, encoding="utf-8") as f:
+        assert json.load(f)["settings"] == good_backup["settings"]
+    # The damaged file did not push the good backup out of generation 1
+    assert read_backup(recovered, 1)["settings"] == good_backup["settings"]
+
+
+def test_sections_fill_in_keys_missing_from_older_configs(new_manager, config):
+    config["batch"] = {"retries": 4}
+    manager = new_manager()
+    manager._config = {"version": "test", "settings": config}
+    batch = manager.section("batch")
+    assert batch["retries"] == 4
+    assert batch["job_timeout_s"] == manager.default_section("batch")["job_timeout_s"]
+    assert manager.section("request_blocker")["blocklist"]
+    # Every call hands out its own copy
+    batch["max_pages_per_site"]["Stub"] = 1
+    assert manager.section("batch")["max_pages_per_site"] == {}
+
+
+def test_upgraded_config_gets_new_top_level_keys(new_manager):
+    manager = new_manager()
+    with open(manager.config_file, "w", encoding="utf-8") as f:
+        json.dump({"version": "1.0", "settings": {"last_choice": "Claude"}}, f)
+    settings = manager.load_config()["settings"]
+    assert settings["last_choice"] == "Claude"
+    assert "page_lifecycle" in settings
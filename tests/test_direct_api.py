@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+import io
+import threading
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+
+from ai_dock import direct_api
+from ai_dock.direct_api import ApiError, ApiRequest, _read_stream, redact_api_keys, stream_chat
+
+
+def site_for(server):
+    return {"type": "api", "url": server.url, "model": "stub", "api_key": "secret"}
+
+
+@pytest.fixture(autouse=True)
+def fresh_connections():
+    yield
+    direct_api.connection_pool.clear()
+
+
+def test_stream_chat_reads_server_sent_events(chat_server):
+    deltas = []
+    answer = stream_chat(site_for(chat_server), "tell me more", deltas.append)
+    assert answer == "echo: tell me more"
+    assert deltas == ["echo: ", "tell ", "me ", "more"]
+    assert chat_server.requests[0]["stream"] is True
+
+
+def test_stream_chat_reuses_the_connection(chat_server):
+    for prompt in ("one", "two", "three"):
+        assert stream_chat(site_for(chat_server), prompt, lambda delta: None) == f"echo: {prompt}"
+    assert direct_api.connection_pool.stats["reused"] >= 2
+
+
+def test_stream_chat_accepts_a_plain_json_answer(chat_server):
+    deltas = []
+    assert stream_chat(site_for(chat_server), "hi", deltas.append, stream=False) == "echo: hi"
+    assert deltas == ["echo: hi"]
+
+
+def test_stream_chat_reports_http_errors(chat_server):
+    chat_server.script = [(429, {"Retry-After": "7"})]
+    with pytest.raises(ApiError) as error:
+        stream_chat(site_for(chat_server), "hi", lambda delta: None)
+    assert (error.value.status, error.value.retry_after) == (429, 7.0)
+
+
+def test_stream_chat_closes_the_connection_when_the_request_fails(monkeypatch):
+    connection = mock.MagicMock()
+    connection.request.side_effect = ConnectionRefusedError()
+    monkeypatch.setattr(direct_api.connection_pool, "acquire", lambda key, timeout: (connection, False))
+    with pytest.raises(ConnectionRefusedError):
+        stream_chat({"type": "api", "url": "http://127.0.0.1:9"}, "hi", lambda delta: None)
+    connection.close.assert_called_once()
+
+
+def sse(*lines):
+    return io.BytesIO("".join(f"{line}\n\n" for line in lines).encode("utf-8"))
+
+
+def test_read_stream_skips_noise_and_stops_at_done():
+    deltas = []
+    stream = sse(": keep-alive", 'data: {"choices": [{"delta": {"role": "assistant"}}]}', "data: not json",
+                 'data: {"choices": [{"delta": {"content": "a"}}]}', "data: [DONE]",
+                 'data: {"choices": [{"delta": {"content": "after"}}]}')
+    assert _read_stream(stream, deltas.append, None) == "a"
+    assert deltas == ["a"]
+
+
+def test_read_stream_raises_errors_and_cancellation():
+    with pytest.raises(ApiError, match="overloaded"):
+        _read_stream(sse('data: {"error": {"message": "overloaded"}}'), lambda delta: None, None)
+    cancelled = threading.Event()
+    cancelled.set()
+    with pytest.raises(ApiError, match="cancelled"):
+        _read_stream(sse('data: {"choices": [{"delta": {"content": "a"}}]}'), lambda delta: None, cancelled)
+
+
+def test_request_reports_malformed_answers(chat_server, monkeypatch):
+    monkeypatch.setattr(direct_api, "mw", SimpleNamespace(taskman=SimpleNamespace(run_on_main=lambda fn: fn())))
+    chat_server.reply = lambda answer: {"choices": []}
+    done = threading.Event()
+    results = []
+    site = dict(site_for(chat_server), extra_body={"stream": False})
+    ApiRequest(site, "hi", lambda chunk: None,
+               lambda text, error, elapsed: (results.append((text, error)), done.set())).start()
+    assert done.wait(10)
+    assert results == [("", "list index out of range")]
+
+
+def test_logged_config_hides_api_keys():
+    config = {"ai_sites": {"Web": "https://chat.example/", "API": {"type": "api", "api_key": "secret"}}}
+    redacted = redact_api_keys(config)
+    assert "secret" not in repr(redacted)
+    assert redacted["ai_sites"]["Web"] == "https://chat.example/"
+    assert config["ai_sites"]["API"]["api_key"] == "secret"
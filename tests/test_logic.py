@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+
+from ai_dock import logic
+from ai_dock.config_manager import config_manager
+
+
+class FakeSignal:
+    def __init__(self):
+        self.slots = []
+
+    def connect(self, slot):
+        self.slots.append(slot)
+
+    def disconnect(self, slot):
+        self.slots.remove(slot)
+
+    def emit(self, *args):
+        for slot in list(self.slots):
+            slot(*args)
+
+
+class HiddenDock(SimpleNamespace):
+    """A dock that started hidden and was never revealed: no web view yet."""
+
+    def __init__(self):
+        super().__init__(ai_dock_site_combobox=mock.MagicMock(currentText=lambda: "Stub"),
+                         ai_dock_panel=mock.MagicMock())
+        self.page = SimpleNamespace(_ai_dock_ready=False, loadFinished=FakeSignal())
+
+    def ai_dock_ensure_webview(self):
+        self.ai_dock_webview = mock.MagicMock(page=lambda: self.page)
+        return self.ai_dock_webview
+
+
+@pytest.fixture
+def injections(config, monkeypatch):
+    injections = []
+    monkeypatch.setattr(logic, "inject_prompt", lambda page, site, prompt, callback: injections.append((page, prompt)))
+    monkeypatch.setattr(logic, "tooltip", mock.MagicMock())
+    return injections
+
+
+def test_prompt_to_a_never_shown_dock_creates_the_page_and_waits_for_it(injections):
+    dock = HiddenDock()
+    logic.inject_prompt_into_ai_webview(dock, "hello")
+    dock.ai_dock_panel.setVisible.assert_called_with(True)
+    assert injections == []
+    dock.page.loadFinished.emit(True)
+    assert injections == [(dock.page, "hello")]
+    assert dock.page.loadFinished.slots == []
+    logic.tooltip.assert_not_called()
+
+
+def test_answer_of_a_hidden_api_only_dock_comes_from_its_panel():
+    api_panel = mock.MagicMock(isVisible=lambda: False, isVisibleTo=lambda parent: True,
+                               selected_html=lambda: "<p>answer</p>")
+    dock = SimpleNamespace(ai_dock_api_panel=api_panel, ai_dock_panel=mock.MagicMock())
+    answers = []
+    logic._get_dock_answer_html(dock, answers.append)
+    assert answers == ["<p>answer</p>"]
+
+
+def test_answer_of_a_dock_without_page_is_empty():
+    api_panel = mock.MagicMock(isVisibleTo=lambda parent: False)
+    answers = []
+    logic._get_dock_answer_html(SimpleNamespace(ai_dock_api_panel=api_panel, ai_dock_panel=None), answers.append)
+    assert answers == [""]
+
+
+def test_answers_are_cached_under_the_prompt_that_produced_them(config, monkeypatch):
+    config["ai_sites"] = {"API": {"type": "api", "url": "http://127.0.0.1:9"}}
+    monkeypatch.setattr(logic, "tooltip", mock.MagicMock())
+    monkeypatch.setattr(logic, "history_store", mock.MagicMock())
+    stored = []
+    monkeypatch.setattr(logic.response_cache, "store", lambda *entry: stored.append(entry))
+    asked = []
+    dock = SimpleNamespace(ai_dock_site_combobox=mock.MagicMock(currentText=lambda: "API"),
+                           ai_dock_api_panel=SimpleNamespace(ask=lambda site, prompt, cb: asked.append(cb)))
+    logic.inject_prompt_into_ai_webview(dock, "card 1", cache_entry=("API", "Explain {text}", "one"))
+    logic.inject_prompt_into_ai_webview(dock, "card 2", cache_entry=("API", "Explain {text}", "two"))
+    # The slow first answer arrives after the second prompt was sent
+    asked[1]("<p>2</p>", None)
+    asked[0]("<p>1</p>", None)
+    assert stored == [("API", "Explain {text}", "two", "<p>2</p>"), ("API", "Explain {text}", "one", "<p>1</p>")]
+
+
+@pytest.mark.parametrize("auto_paste, watched", [(False, False), (True, True)])
+def test_only_auto_paste_watches_for_the_answer(config, monkeypatch, auto_paste, watched):
+    watches = []
+    monkeypatch.setattr(logic, "inject_prompt", lambda page, site, prompt, callback: callback(True))
+    monkeypatch.setattr(logic, "watch_response", lambda page, site, callback, timeout_ms: watches.append(timeout_ms))
+    monkeypatch.setattr(logic, "tooltip", mock.MagicMock())
+    dock = HiddenDock()
+    dock.page._ai_dock_ready = True
+    logic.inject_prompt_into_ai_webview(dock, "hello", auto_paste=auto_paste)
+    assert watches == ([logic.DOCK_RESPONSE_TIMEOUT_MS] if watched else [])
+    assert logic.DOCK_RESPONSE_TIMEOUT_MS < config_manager.default_section("batch")["job_timeout_s"] * 1000
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+import base64
+
+import pytest
+
+from ai_dock import media
+from ai_dock.media import extract_inline_images, media_filename
+
+PNG = b"\x89PNG\r\n\x1a\n fake image"
+PAYLOAD = base64.b64encode(PNG).decode()
+
+
+class FakeMediaStore:
+    """The have / write_data part of col.media, in memory."""
+
+    def __init__(self, rename=None):
+        self.files = {}
+        self.rename = rename
+
+    def have(self, name):
+        return name in self.files
+
+    def write_data(self, name, data):
+        name = self.rename or name
+        self.files[name] = data
+        return name
+
+
+@pytest.fixture(autouse=True)
+def fresh_stats(monkeypatch):
+    monkeypatch.setattr(media, "media_stats", dict.fromkeys(media.media_stats, 0))
+
+
+def test_the_same_image_is_written_once_across_pastes():
+    store = FakeMediaStore()
+    name = media_filename(PNG, "image/png")
+    first, stats = extract_inline_images(f'<img src="data:image/png;base64,{PAYLOAD}">', store)
+    second, again = extract_inline_images(f'<p><img alt="x" src="data:image/png;base64,{PAYLOAD}"></p>', store)
+    assert first == f'<img src="{name}">'
+    assert second == f'<p><img alt="x" src="{name}"></p>'
+    assert (stats["written"], again["written"], again["images"]) == (1, 0, 1)
+    assert store.files == {name: PNG}
+    assert media.media_stats["pastes"] == 2
+
+
+@pytest.mark.parametrize("src, quote", [
+    (f'"data:image/png;base64,{PAYLOAD}"', '"'),
+    (f"'data:image/png;charset=utf-8;base64,{PAYLOAD}'", "'"),
+    (f"data:image/png;base64,{PAYLOAD}", '"'),
+])
+def test_single_double_and_unquoted_src(src, quote):
+    name = media_filename(PNG, "image/png")
+    html, stats = extract_inline_images(f"<img src={src} width=10>", FakeMediaStore())
+    assert html == f"<img src={quote}{name}{quote} width=10>"
+    assert stats["images"] == 1
+
+
+def test_unquoted_src_ends_at_the_tag():
+    name = media_filename(PNG, "image/png")
+    html, _stats = extract_inline_images(f"<img src=data:image/png;base64,{PAYLOAD}>tail", FakeMediaStore())
+    assert html == f'<img src="{name}">tail'
+
+
+def test_invalid_base64_is_left_untouched():
+    store = FakeMediaStore()
+    markup = '<img src="data:image/png;base64,not*base64!">'
+    assert extract_inline_images(markup, store) == (markup, {"images": 0, "written": 0, "bytes_saved": 0})
+    assert store.files == {}
+    assert media.media_stats["pastes"] == 0
+
+
+def test_the_name_returned_by_write_data_is_used():
+    store = FakeMediaStore(rename="ai-dock-clash-1.png")
+    html, _stats = extract_inline_images(f'<img src="data:image/png;base64,{PAYLOAD}">', store)
+    assert html == '<img src="ai-dock-clash-1.png">'
+    assert store.files == {"ai-dock-clash-1.png": PNG}
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+
+from ai_dock import prefetch
+from ai_dock.prefetch import PREFETCHED_LIMIT, ReviewPrefetcher
+
+API_SITE = {"type": "api", "url": "http://127.0.0.1:9"}
+
+
+@pytest.fixture
+def prefetcher(config, monkeypatch):
+    monkeypatch.setattr(prefetch, "mw", SimpleNamespace(reviewer=SimpleNamespace()))
+    # Rendering markdown needs a real QTextDocument
+    monkeypatch.setattr(prefetch, "markdown_to_html", lambda markdown: f"<p>{markdown}</p>")
+    monkeypatch.setattr(prefetch.api_batch_engine, "submit_job",
+                        lambda site_name, site, prompt, callback: callback(f"answer to {prompt}", None))
+    cache = {}
+    monkeypatch.setattr(prefetch.response_cache, "store",
+                        lambda site, template, text, html: cache.__setitem__((site, template, text), html))
+    monkeypatch.setattr(prefetch.response_cache, "lookup", lambda site, template, text: cache.get((site, template, text)))
+    return ReviewPrefetcher()
+
+
+def request(i):
+    return "API", API_SITE, "Explain {text}", f"word {i}", f"Explain word {i}"
+
+
+def test_showing_an_answer_leaves_the_dock_state_alone(prefetcher):
+    prefetcher._start("key", request(1))
+    prefetcher._show_answer(request(1))
+    assert prefetcher.stats["hits"] == 1
+    assert vars(prefetch.mw.reviewer) == {}
+
+
+def test_prefetched_answers_are_bounded_and_cleared_on_shutdown(prefetcher):
+    for i in range(PREFETCHED_LIMIT + 20):
+        prefetcher._start(f"key {i}", request(i))
+    assert len(prefetcher._prefetched) == PREFETCHED_LIMIT
+    assert "key 0" not in prefetcher._prefetched
+    prefetcher.shutdown()
+    assert prefetcher._prefetched == {}
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+
+from unittest import mock
+
+from ai_dock.resources import QWebEngineSettings, apply_profile_budget
+
+GESTURE = QWebEngineSettings.WebAttribute.PlaybackRequiresUserGesture
+
+
+def test_lite_mode_requires_a_gesture_for_playback(config):
+    config["resource_budget"] = {"lite_mode": True}
+    profile = mock.MagicMock()
+    apply_profile_budget(profile)
+    profile.settings().setAttribute.assert_any_call(GESTURE, True)
+
+
+def test_normal_mode_keeps_the_default_gesture_requirement(config):
+    profile = mock.MagicMock()
+    apply_profile_budget(profile)
+    settings = profile.settings()
+    assert all(call.args[0] is not GESTURE for call in settings.setAttribute.call_args_list)
+    settings.resetAttribute.assert_called_once_with(GESTURE)
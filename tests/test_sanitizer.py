@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+
+from ai_dock.sanitizer import _benchmark_fixture, sanitize_html
+
+
+def test_chat_answer_is_reduced_to_clean_markup():
+    assert sanitize_html(_benchmark_fixture(1)) == (
+        "<div><p>The <strong>derivative</strong> of \\(x^2\\) is <em>2x</em>.</p>"
+        "<pre><code>def f(x):\n    return x ** 2\n</code></pre>"
+        "<table><thead><tr><th>x</th><th>f(x)</th></tr></thead><tbody><tr><td>2</td><td>4</td></tr></tbody></table>"
+        "</div>"
+    )
+
+
+def test_code_block_toolbar_text_is_dropped():
+    markup = '<pre><div class="toolbar">bash<span>Copy</span></div><code>ls -l</code><div>Edit</div></pre>'
+    assert sanitize_html(markup) == "<pre><code>ls -l</code></pre>"
+
+
+def test_pre_without_code_keeps_its_text():
+    assert sanitize_html("<pre>a  b\n<b>c</b></pre>") == "<pre>a  b\nc</pre>"
+
+
+def test_qt_rich_text_spans_become_tags():
+    # The shape of QTextDocument.toHtml() after setMarkdown (ApiPanel answers)
+    markup = (
+        '<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 4.0//EN" "http://www.w3.org/TR/REC-html40/strict.dtd">'
+        '<html><head><meta name="qrichtext" content="1" /><style type="text/css">p, li { white-space: pre-wrap; }'
+        '</style></head><body style=" font-family:\'Sans\'; font-size:10pt;">'
+        '<p style=" margin-top:0px;">A <span style=" font-weight:700;">bold</span>, '
+        '<span style=" font-style:italic;">italic</span> and '
+        '<span style=" font-family:\'monospace\';">code</span> word.</p>'
+        '<pre style=" margin-top:12px;"><span style=" font-family:\'monospace\';">ls -l</span></pre>'
+        '</body></html>'
+    )
+    assert sanitize_html(markup) == (
+        "<p>A <b>bold</b>, <i>italic</i> and <code>code</code> word.</p><pre>ls -l</pre>"
+    )
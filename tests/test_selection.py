@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+
+from types import SimpleNamespace
+
+from ai_dock.selection import _on_selection_pending, _on_selection_pushed, get_cached_selection
+
+
+def test_nothing_or_an_empty_selection_asks_the_page():
+    editor = SimpleNamespace()
+    assert get_cached_selection(editor) is None
+    _on_selection_pushed(editor, {"text": "", "html": ""})
+    assert get_cached_selection(editor) is None
+
+
+def test_a_settled_selection_is_served_from_the_cache():
+    editor = SimpleNamespace()
+    _on_selection_pushed(editor, {"text": "word", "html": "<b>word</b>"})
+    assert get_cached_selection(editor)["text"] == "word"
+
+
+def test_a_selection_still_changing_asks_the_page():
+    editor = SimpleNamespace()
+    _on_selection_pushed(editor, {"text": "old", "html": "old"})
+    _on_selection_pending(editor, {})
+    assert get_cached_selection(editor) is None
+    _on_selection_pushed(editor, {"text": "new", "html": "new"})
+    assert get_cached_selection(editor)["text"] == "new"
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from ai_dock.templates import TemplateError, compile_template, render_template
+
+
+@pytest.mark.parametrize("back, expected", [
+    ("meaning", "Explain word. The answer is meaning."),
+    ("", "Explain word. No answer yet."),
+    ("  ", "Explain word. No answer yet."),
+])
+def test_sections_and_inverted_sections(back, expected):
+    source = "Explain {field:Front}.{#field:Back} The answer is {field:Back}.{/field:Back}{^field:Back} No answer yet.{/field:Back}"
+    assert render_template(source, {"field:Front": "word", "field:Back": back}) == expected
+
+
+def test_nested_sections():
+    source = "{#deck}[{deck}{^tags}, untagged{/tags}]{/deck}"
+    assert render_template(source, {"deck": "Verbs", "tags": ""}) == "[Verbs, untagged]"
+    assert render_template(source, {"deck": "", "tags": ""}) == ""
+
+
+def test_double_braces_are_literal():
+    assert render_template("{{text}} is {text} in }}json{{", {"text": "x"}) == "{text} is x in }json{"
+
+
+def test_selection_is_an_alias_of_text_and_missing_values_are_empty():
+    assert render_template("{selection}|{ text }|{deck}", {"text": "a"}) == "a|a|"
+
+
+@pytest.mark.parametrize("source, message", [
+    ("{#text} open", "never closed"),
+    ("{#text}{#deck}{/text}{/deck}", "does not close"),
+    ("stray {/tags}", "does not close"),
+])
+def test_unclosed_and_mis_nested_sections_are_errors(source, message):
+    compile_template.cache_clear()
+    with pytest.raises(TemplateError, match=message):
+        compile_template(source)
+
+
+def test_cache_input():
+    assert compile_template("Explain {text}").cache_input("word", "Explain word") == "word"
+    assert compile_template("{#selection}{text}{/selection}").cache_input("word", "word") == "word"
+    assert compile_template("Explain {text} of {field:Front}").cache_input("word", "Explain word of x") == \
+        "Explain word of x"
+    # Nothing from the selection or the note: the prompt itself identifies the request
+    assert compile_template("Say hi").cache_input("word", "Say hi") == "Say hi"
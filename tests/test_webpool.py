@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+from unittest import mock
+
+import pytest
+
+from ai_dock import webpool
+from ai_dock.webpool import WebPagePool
+
+
+class FakeSignal:
+    def __init__(self):
+        self.slots = []
+
+    def connect(self, slot):
+        self.slots.append(slot)
+
+    def emit(self, *args):
+        for slot in list(self.slots):
+            slot(*args)
+
+
+class FakePage:
+    def __init__(self, profile, parent):
+        self.loadStarted = FakeSignal()
+        self.loadFinished = FakeSignal()
+        self.load = mock.MagicMock()
+        self.deleteLater = mock.MagicMock()
+
+
+@pytest.fixture
+def pool(config, monkeypatch):
+    monkeypatch.setattr(webpool, "QWebEnginePage", FakePage)
+    monkeypatch.setattr(webpool, "QTimer", mock.MagicMock())
+    monkeypatch.setattr(webpool, "attach_dock_bridge", mock.MagicMock())
+    return WebPagePool()
+
+
+def test_dock_checkout_schedules_a_standby_page(pool):
+    pool.checkout(mock.MagicMock(), "https://chat.example/")
+    webpool.QTimer.singleShot.assert_called_once()
+
+
+def test_worker_checkout_does_not_prewarm(pool):
+    pool.checkout(mock.MagicMock(), "https://chat.example/", prewarm=False)
+    webpool.QTimer.singleShot.assert_not_called()
+    assert pool.stats["misses"] == 1
+
+
+def test_a_reused_page_is_ready_only_between_loads(pool):
+    url = "https://chat.example/"
+    page = pool.checkout(mock.MagicMock(), url)
+    assert page._ai_dock_ready is False
+    page.loadFinished.emit(True)
+    assert page._ai_dock_ready is True
+    pool.checkin(page)
+    assert pool.idle_pages() == [page]
+
+    assert pool.checkout(mock.MagicMock(), url) is page
+    assert pool.stats == dict(pool.stats, hits=1, misses=1, returned=1)
+    assert page._ai_dock_ready is True
+    # Switching site (or a reload) in the dock: not ready until the new page has loaded
+    page.loadStarted.emit()
+    assert page._ai_dock_ready is False
+    page.loadFinished.emit(True)
+    assert page._ai_dock_ready is True
@@ -1,46 +1,82 @@
 # -*- coding: utf-8 -*-
 
 import copy
+import html
+from datetime import datetime
 
 from aqt.qt import (
+    QCheckBox,
+    QComboBox,
     QDialog,
     QDialogButtonBox,
     QFormLayout,
     QHBoxLayout,
     QKeySequence,
     QKeySequenceEdit,
+    QLabel,
     QLineEdit,
     QListWidget,
     QListWidgetItem,
     QPushButton,
+    QSpinBox,
+    QSplitter,
     Qt,
     QTabWidget,
+    QTextBrowser,
     QTextEdit,
+    QTimer,
     QVBoxLayout,
     QWidget,
 )
 from aqt.utils import showWarning, tooltip
 
-from .config import get_config, write_config
-from .logic import update_open_docks_config
-from .shortcuts import setup_shortcuts
+from .blocker import format_allow_rules, get_request_blocker, invalid_entries, parse_allow_rules
+from .config import config_manager, get_config, get_config_section, write_config
+from .direct_api import API_SITE_DEFAULTS, API_SITE_TYPE, api_site_settings, is_api_site, site_url
+from .history import PROMPT, history_store
+from .resources import budget_settings, chromium_flags, describe_dock_resources, missing_chromium_flags
+from .templates import TemplateError, compile_template
 
 
 class AiSiteEditDialog(QDialog):
+    TYPES = ("Web page", "Direct API (OpenAI-compatible)")
+
     def __init__(self, parent=None, site_data=None):
         super().__init__(parent)
         self.setWindowTitle("Edit AI Site" if site_data else "Add AI Site")
         self.site_data = site_data or {"name": "", "url": ""}
+        api = api_site_settings(self.site_data) if is_api_site(self.site_data) else API_SITE_DEFAULTS
         layout = QFormLayout(self)
         self.name_edit = QLineEdit(self.site_data["name"])
         layout.addRow("Service Name:", self.name_edit)
+        self.type_combo = QComboBox()
+        self.type_combo.addItems(self.TYPES)
+        self.type_combo.setCurrentIndex(1 if is_api_site(self.site_data) else 0)
+        layout.addRow("Type:", self.type_combo)
         self.url_edit = QLineEdit(self.site_data["url"])
         layout.addRow("URL:", self.url_edit)
+        self.model_edit = QLineEdit(api["model"])
+        layout.addRow("Model:", self.model_edit)
+        self.api_key_edit = QLineEdit(api["api_key"])
+        self.api_key_edit.setEchoMode(QLineEdit.EchoMode.Password)
+        layout.addRow("API Key:", self.api_key_edit)
+        self.system_prompt_edit = QLineEdit(api["system_prompt"])
+        layout.addRow("System Prompt:", self.system_prompt_edit)
+        self.type_combo.currentIndexChanged.connect(self._update_api_fields)
+        self._update_api_fields()
         self.button_box = QDialogButtonBox(QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel)
         self.button_box.accepted.connect(self.on_accept)
         self.button_box.rejected.connect(self.reject)
         layout.addRow(self.button_box)
 
+    def _is_api(self):
+        return self.type_combo.currentIndex() == 1
+
+    def _update_api_fields(self):
+        for edit in (self.model_edit, self.api_key_edit, self.system_prompt_edit):
+            edit.setEnabled(self._is_api())
+        self.url_edit.setPlaceholderText("https://api.openai.com/v1" if self._is_api() else "https://")
+
     def on_accept(self):
         name = self.name_edit.text().strip()
         url = self.url_edit.text().strip()
@@ -50,27 +86,48 @@ class AiSiteEditDialog(QDialog):
         if not url.startswith(("http://", "https://")):
             showWarning("URL must start with http:// or https://", parent=self)
             return
-        self.site_data["name"] = name
-        self.site_data["url"] = url
+        if self._is_api() and not self.model_edit.text().strip():
+            showWarning("Direct API sites need a model name.", parent=self)
+            return
+        # Keep keys the dialog does not edit (temperature, extra_body, ...) of an API site
+        previous = self.site_data if is_api_site(self.site_data) else {}
+        self.site_data = {"name": name, "url": url}
+        if self._is_api():
+            self.site_data.update({k: v for k, v in previous.items() if k not in ("name", "url")})
+            self.site_data.update({"type": API_SITE_TYPE, "model": self.model_edit.text().strip(),
+                                   "api_key": self.api_key_edit.text().strip(),
+                                   "system_prompt": self.system_prompt_edit.text().strip()})
         self.accept()
 
     def get_site_data(self):
         return self.site_data
 
+    def get_site_value(self):
+        """The value stored in config["ai_sites"]: the URL for web pages, a dict for Direct API sites."""
+        if not is_api_site(self.site_data):
+            return self.site_data["url"]
+        return {k: v for k, v in self.site_data.items() if k != "name"}
+
 class PromptEditDialog(QDialog):
     def __init__(self, parent=None, prompt=None):
         super().__init__(parent)
         self.setWindowTitle("Edit Prompt" if prompt else "Add Prompt")
-        self.prompt_data = prompt or {"name": "", "template": "", "shortcut": ""}
+        self.prompt_data = prompt or {"name": "", "template": "", "shortcut": "", "auto_paste": False}
         layout = QVBoxLayout(self)
         form = QFormLayout()
         self.name_edit = QLineEdit(self.prompt_data["name"])
         form.addRow("Prompt Name:", self.name_edit)
         self.template_edit = QTextEdit(self.prompt_data["template"])
         self.template_edit.setAcceptRichText(False)
-        form.addRow("Template ({text}):", self.template_edit)
+        self.template_edit.setToolTip("Placeholders: {text} (selection), {field:Name}, {deck}, {tags}.\n"
+                                      "{#field:Name}...{/field:Name} is kept only if the field is not empty, "
+                                      "{^tags}...{/tags} only if there are no tags.")
+        form.addRow("Template:", self.template_edit)
         self.shortcut_edit = QKeySequenceEdit(QKeySequence(self.prompt_data.get("shortcut", "")))
         form.addRow("Shortcut:", self.shortcut_edit)
+        self.auto_paste_check = QCheckBox("Paste the finished answer into the target field automatically")
+        self.auto_paste_check.setChecked(bool(self.prompt_data.get("auto_paste", False)))
+        form.addRow(self.auto_paste_check)
         layout.addLayout(form)
         self.button_box = QDialogButtonBox(QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel)
         self.button_box.accepted.connect(self.on_accept)
@@ -83,13 +140,112 @@ class PromptEditDialog(QDialog):
         shortcut = self.shortcut_edit.keySequence().toString(QKeySequence.SequenceFormat.PortableText)
         if not name or not template:
             showWarning("Name and template cannot be empty.", parent=self); return
-        if "{text}" not in template:
-            showWarning("Template must contain {text}.", parent=self); return
-        self.prompt_data = {"name": name, "template": template, "shortcut": shortcut}
+        try:
+            compiled = compile_template(template)
+        except TemplateError as e:
+            showWarning(f"Invalid template: {e}", parent=self); return
+        if not compiled.keys:
+            showWarning("Template must contain a placeholder such as {text} or {field:Front}.", parent=self); return
+        self.prompt_data = {"name": name, "template": template, "shortcut": shortcut,
+                            "auto_paste": self.auto_paste_check.isChecked()}
         self.accept()
         
     def get_prompt_data(self): return self.prompt_data
 
+class CachedAnswerDialog(QDialog):
+    """Offers an answer from the response cache instead of asking the AI again."""
+    USE, REFRESH = 1, 2
+
+    def __init__(self, parent, html, site_name, field_name=None):
+        super().__init__(parent)
+        self.setWindowTitle(f"Cached Answer from {site_name}")
+        self.setMinimumSize(480, 320)
+        layout = QVBoxLayout(self)
+        browser = QTextBrowser()
+        browser.setHtml(html)
+        layout.addWidget(browser)
+        self.button_box = QDialogButtonBox(QDialogButtonBox.StandardButton.Cancel)
+        if field_name:
+            use_button = self.button_box.addButton(f"Paste into '{field_name}'", QDialogButtonBox.ButtonRole.AcceptRole)
+            use_button.clicked.connect(lambda: self.done(self.USE))
+        refresh_button = self.button_box.addButton("Ask Again", QDialogButtonBox.ButtonRole.ActionRole)
+        refresh_button.clicked.connect(lambda: self.done(self.REFRESH))
+        self.button_box.rejected.connect(self.reject)
+        layout.addWidget(self.button_box)
+
+class HistoryDialog(QDialog):
+    """Searches past prompts and answers (see history.py) and pastes one back into the current field."""
+
+    def __init__(self, parent, target_object, on_paste):
+        super().__init__(parent)
+        self.setWindowTitle("AI Dock History")
+        self.setMinimumSize(700, 480)
+        self.target_object = target_object
+        self.on_paste = on_paste
+        self.records = []
+        layout = QVBoxLayout(self)
+        self.search_edit = QLineEdit()
+        self.search_edit.setPlaceholderText("Search prompts and answers…")
+        layout.addWidget(self.search_edit)
+        splitter = QSplitter(Qt.Orientation.Vertical)
+        self.result_list = QListWidget()
+        splitter.addWidget(self.result_list)
+        self.preview = QTextBrowser()
+        splitter.addWidget(self.preview)
+        layout.addWidget(splitter, 1)
+        bottom = QHBoxLayout()
+        self.status_label = QLabel()
+        bottom.addWidget(self.status_label, 1)
+        self.paste_button = QPushButton("Paste into Field")
+        self.paste_button.setEnabled(False)
+        self.paste_button.setVisible(hasattr(target_object, "ai_dock_field_combobox"))
+        self.paste_button.clicked.connect(self.paste_selected)
+        bottom.addWidget(self.paste_button)
+        layout.addLayout(bottom)
+
+        # Search as you type, once typing pauses
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.timeout.connect(self.run_search)
+        self.search_edit.textChanged.connect(lambda _text: self.search_timer.start(150))
+        self.result_list.currentRowChanged.connect(self.show_record)
+        self.result_list.itemDoubleClicked.connect(lambda _item: self.paste_selected())
+        self.run_search()
+
+    def run_search(self):
+        self.records, elapsed_ms = history_store.search(self.search_edit.text())
+        self.result_list.clear()
+        for record in self.records:
+            when = datetime.fromtimestamp(record["ts"]).strftime("%Y-%m-%d %H:%M")
+            snippet = " ".join(record["content"].split())[:120]
+            self.result_list.addItem(f"{when}  [{record['kind']}]  {record['site']}: {snippet}")
+        self.status_label.setText(f"{len(self.records)} results in {elapsed_ms:.1f} ms")
+        self.preview.clear()
+        self.paste_button.setEnabled(False)
+
+    def show_record(self, row):
+        if not 0 <= row < len(self.records):
+            return
+        record = self.records[row]
+        if record["kind"] == PROMPT:
+            self.preview.setPlainText(record["content"])
+        else:
+            self.preview.setHtml(record["content"])
+        self.paste_button.setEnabled(True)
+
+    def record_html(self, record):
+        return html.escape(record["content"]).replace("\n", "<br>") if record["kind"] == PROMPT else record["content"]
+
+    def paste_selected(self):
+        row = self.result_list.currentRow()
+        if not 0 <= row < len(self.records) or not self.paste_button.isVisible():
+            return
+        field_name = self.target_object.ai_dock_field_combobox.currentText()
+        if not field_name:
+            showWarning("Please select a target field in the top bar.", parent=self)
+            return
+        self.on_paste(self.target_object, self.record_html(self.records[row]), field_name)
+
 class PromptManagerDialog(QDialog):
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -101,6 +257,9 @@ class PromptManagerDialog(QDialog):
         self.tabs.addTab(self._create_prompts_widget(), "Custom Prompts")
         self.tabs.addTab(self._create_ai_sites_widget(), "AI Services")
         self.tabs.addTab(self._create_shortcuts_widget(), "Global Shortcuts")
+        self.tabs.addTab(self._create_resources_widget(), "Resource Budget")
+        self.tabs.addTab(self._create_blocker_widget(), "Blocklist")
+        self.tabs.addTab(self._create_prefetch_widget(), "Review Prefetch")
         main_layout.addWidget(self.tabs)
         
         self.button_box = QDialogButtonBox(QDialogButtonBox.StandardButton.Save | QDialogButtonBox.StandardButton.Cancel)
@@ -119,6 +278,117 @@ class PromptManagerDialog(QDialog):
         layout.addRow("Show/Hide Dock:", self.toggle_dock_edit)
         return widget
 
+    def _create_blocker_widget(self):
+        widget = QWidget()
+        layout = QFormLayout(widget)
+        blocker_settings = get_config_section("request_blocker")
+
+        self.blocker_enabled_check = QCheckBox("Block analytics, ads and trackers in dock pages")
+        self.blocker_enabled_check.setChecked(bool(blocker_settings["enabled"]))
+        layout.addRow(self.blocker_enabled_check)
+        self.blocklist_edit = QTextEdit("\n".join(blocker_settings["blocklist"]))
+        self.blocklist_edit.setAcceptRichText(False)
+        self.blocklist_edit.setToolTip("One per line: a host (subdomains included), a glob with *, or /regex/.")
+        layout.addRow("Blocked:", self.blocklist_edit)
+        self.allow_edit = QTextEdit(format_allow_rules(blocker_settings["allow"]))
+        self.allow_edit.setAcceptRichText(False)
+        self.allow_edit.setToolTip("One site per line, e.g. 'gemini.google.com: googletagmanager.com'.")
+        layout.addRow("Allowed per site:", self.allow_edit)
+        stats_label = QLabel(get_request_blocker().describe_stats())
+        stats_label.setTextInteractionFlags(Qt.TextInteractionFlag.TextSelectableByMouse)
+        layout.addRow("Statistics:", stats_label)
+        return widget
+
+    def _create_prefetch_widget(self):
+        widget = QWidget()
+        layout = QFormLayout(widget)
+        config = get_config()
+        prefetch = get_config_section("prefetch")
+
+        self.prefetch_enabled_check = QCheckBox("Ask the AI about upcoming cards while reviewing")
+        self.prefetch_enabled_check.setChecked(bool(prefetch["enabled"]))
+        layout.addRow(self.prefetch_enabled_check)
+        self.prefetch_prompt_combo = QComboBox()
+        self.prefetch_prompt_combo.addItems([p["name"] for p in config.get("prompts", [])])
+        self.prefetch_prompt_combo.setCurrentText(prefetch["prompt"])
+        layout.addRow("Prompt:", self.prefetch_prompt_combo)
+        self.prefetch_field_edit = QLineEdit(prefetch["field"])
+        self.prefetch_field_edit.setToolTip("The prompt's {text} is this field of the card's note.")
+        layout.addRow("Field:", self.prefetch_field_edit)
+        self.prefetch_lookahead_spin = QSpinBox(); self.prefetch_lookahead_spin.setRange(1, 10)
+        self.prefetch_lookahead_spin.setValue(int(prefetch["lookahead"]))
+        layout.addRow("Cards ahead:", self.prefetch_lookahead_spin)
+        layout.addRow(QLabel("Answers are asked on the service selected in the reviewer dock "
+                             "and kept in the response cache."))
+        return widget
+
+    def _create_resources_widget(self):
+        widget = QWidget()
+        layout = QFormLayout(widget)
+        budget = budget_settings()
+
+        self.max_live_pages_spin = QSpinBox(); self.max_live_pages_spin.setRange(0, 20)
+        self.max_live_pages_spin.setSpecialValueText("Unlimited")
+        self.max_live_pages_spin.setValue(int(budget["max_live_pages"]))
+        layout.addRow("Max live dock pages:", self.max_live_pages_spin)
+        self.http_cache_spin = QSpinBox(); self.http_cache_spin.setRange(0, 4096)
+        self.http_cache_spin.setSuffix(" MB"); self.http_cache_spin.setSpecialValueText("Default")
+        self.http_cache_spin.setValue(int(budget["http_cache_mb"]))
+        layout.addRow("HTTP disk cache size:", self.http_cache_spin)
+        self.lite_mode_check = QCheckBox("Lite mode (no images, no autoplay)")
+        self.lite_mode_check.setChecked(bool(budget["lite_mode"]))
+        layout.addRow(self.lite_mode_check)
+        self.gpu_check = QCheckBox("GPU-accelerated canvas and WebGL")
+        self.gpu_check.setChecked(bool(budget["gpu_acceleration"]))
+        layout.addRow(self.gpu_check)
+
+        layout.addRow(QLabel("<b>Chromium process flags</b> (read only when Anki starts)"))
+        self.renderer_limit_spin = QSpinBox(); self.renderer_limit_spin.setRange(0, 32)
+        self.renderer_limit_spin.setSpecialValueText("Unlimited")
+        self.renderer_limit_spin.setValue(int(budget["renderer_process_limit"]))
+        layout.addRow("Renderer process limit:", self.renderer_limit_spin)
+        self.disable_jit_check = QCheckBox("Disable JavaScript JIT")
+        self.disable_jit_check.setChecked(bool(budget["disable_jit"]))
+        layout.addRow(self.disable_jit_check)
+        self.disable_gpu_raster_check = QCheckBox("Disable GPU rasterization")
+        self.disable_gpu_raster_check.setChecked(bool(budget["disable_gpu_rasterization"]))
+        layout.addRow(self.disable_gpu_raster_check)
+        self.chromium_flags_edit = QLineEdit(); self.chromium_flags_edit.setReadOnly(True)
+        self.chromium_flags_edit.setToolTip("Add these to QTWEBENGINE_CHROMIUM_FLAGS before starting Anki.")
+        layout.addRow("QTWEBENGINE_CHROMIUM_FLAGS:", self.chromium_flags_edit)
+        self.renderer_limit_spin.valueChanged.connect(self._update_chromium_flags)
+        for check in (self.disable_jit_check, self.disable_gpu_raster_check):
+            check.toggled.connect(self._update_chromium_flags)
+        self._update_chromium_flags()
+
+        self.diagnostics_label = QLabel()
+        self.diagnostics_label.setTextInteractionFlags(Qt.TextInteractionFlag.TextSelectableByMouse)
+        refresh_btn = QPushButton("Refresh"); refresh_btn.clicked.connect(self._refresh_diagnostics)
+        layout.addRow("Diagnostics:", refresh_btn)
+        layout.addRow(self.diagnostics_label)
+        self._refresh_diagnostics()
+        return widget
+
+    def _collect_budget(self):
+        return {
+            "max_live_pages": self.max_live_pages_spin.value(),
+            "http_cache_mb": self.http_cache_spin.value(),
+            "lite_mode": self.lite_mode_check.isChecked(),
+            "gpu_acceleration": self.gpu_check.isChecked(),
+            "renderer_process_limit": self.renderer_limit_spin.value(),
+            "disable_jit": self.disable_jit_check.isChecked(),
+            "disable_gpu_rasterization": self.disable_gpu_raster_check.isChecked(),
+        }
+
+    def _update_chromium_flags(self, *_args):
+        budget = self._collect_budget()
+        self.chromium_flags_edit.setText(chromium_flags(budget))
+        missing = missing_chromium_flags(budget)
+        self.chromium_flags_edit.setStyleSheet("color: #b36b00;" if missing else "")
+
+    def _refresh_diagnostics(self):
+        self.diagnostics_label.setText(describe_dock_resources())
+
     def _create_list_management_widget(self, double_click_handler, add_handler, edit_handler, remove_handler):
         widget = QWidget()
         layout = QHBoxLayout(widget)
@@ -148,7 +418,8 @@ class PromptManagerDialog(QDialog):
         self.prompt_list_widget.clear()
         for prompt in get_config().get("prompts", []):
             shortcut_str = f"  [{prompt.get('shortcut', '')}]" if prompt.get('shortcut') else ""
-            item = QListWidgetItem(f'{prompt["name"]}{shortcut_str}')
+            auto_str = "  (auto-paste)" if prompt.get("auto_paste") else ""
+            item = QListWidgetItem(f'{prompt["name"]}{shortcut_str}{auto_str}')
             item.setData(Qt.ItemDataRole.UserRole, prompt)
             self.prompt_list_widget.addItem(item)
 
@@ -183,16 +454,20 @@ class PromptManagerDialog(QDialog):
 
     def load_ai_sites(self):
         self.ai_site_list_widget.clear()
-        for name, url in get_config().get("ai_sites", {}).items():
-            item = QListWidgetItem(f"{name} ({url})")
-            item.setData(Qt.ItemDataRole.UserRole, {"name": name, "url": url})
+        for name, site in get_config().get("ai_sites", {}).items():
+            site_data = {"name": name, "url": site_url(site)}
+            if is_api_site(site):
+                site_data.update(site)
+            kind = f"  [API: {site.get('model', '')}]" if is_api_site(site) else ""
+            item = QListWidgetItem(f"{name} ({site_data['url']}){kind}")
+            item.setData(Qt.ItemDataRole.UserRole, site_data)
             self.ai_site_list_widget.addItem(item)
 
     def add_ai_site(self):
         dialog = AiSiteEditDialog(self)
         if dialog.exec():
             data = dialog.get_site_data()
-            get_config()["ai_sites"][data["name"]] = data["url"]
+            get_config()["ai_sites"][data["name"]] = dialog.get_site_value()
             self.load_ai_sites()
 
     def edit_ai_site(self):
@@ -205,7 +480,7 @@ class PromptManagerDialog(QDialog):
             live_sites = get_config()["ai_sites"]
             if original_site["name"] != updated["name"]:
                 del live_sites[original_site["name"]]
-            live_sites[updated["name"]] = updated["url"]
+            live_sites[updated["name"]] = dialog.get_site_value()
             self.load_ai_sites()
 
     def remove_ai_site(self):
@@ -220,19 +495,39 @@ class PromptManagerDialog(QDialog):
             self.load_ai_sites()
 
     def on_accept(self):
+        blocklist = [line.strip() for line in self.blocklist_edit.toPlainText().splitlines() if line.strip()]
+        allow = parse_allow_rules(self.allow_edit.toPlainText())
+        invalid = invalid_entries(blocklist + [entry for entries in allow.values() for entry in entries])
+        if invalid:
+            self.tabs.setCurrentIndex(self.tabs.indexOf(self.blocklist_edit.parentWidget()))
+            showWarning("Invalid blocklist entries:\n" + "\n".join(f"{entry}: {error}" for entry, error in invalid),
+                        parent=self)
+            return
+
         # Get the live config object
         config = get_config()
         
         # Update shortcut values from the dialog fields into the live config
         config['paste_direct_shortcut'] = self.paste_direct_edit.keySequence().toString(QKeySequence.SequenceFormat.PortableText)
         config['toggle_dock_shortcut'] = self.toggle_dock_edit.keySequence().toString(QKeySequence.SequenceFormat.PortableText)
+        config['resource_budget'] = self._collect_budget()
+        config['request_blocker'] = {
+            "enabled": self.blocker_enabled_check.isChecked(),
+            "blocklist": blocklist,
+            "allow": allow,
+        }
+        config['prefetch'] = {
+            "enabled": self.prefetch_enabled_check.isChecked(),
+            "prompt": self.prefetch_prompt_combo.currentText(),
+            "field": self.prefetch_field_edit.text().strip(),
+            "lookahead": self.prefetch_lookahead_spin.value(),
+        }
         
         # Now, write the single, authoritative config object to disk
         write_config(config)
         
-        # Re-apply shortcuts and update any open docks with the saved changes
-        setup_shortcuts()
-        update_open_docks_config()
+        # Notify only the subscribers (shortcuts, docks, menus) whose settings changed
+        config_manager.publish_changes()
         
         tooltip("Settings saved successfully.")
         super().accept()
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+from aqt import mw
+from aqt.qt import QTimer, QUrl
+from PyQt6.QtWebEngineCore import QWebEnginePage
+
+from .bridge import attach_dock_bridge
+from .config import get_config_section
+
+class WebPagePool:
+    """
+    Pool of pre-loaded QWebEnginePages in the shared AI Dock profile, keyed by site URL.
+    Docks check a page out when their window opens and return it on close, so the
+    AI site stays booted and logged in for the next AddCards/Browser/EditCurrent window.
+    """
+
+    def __init__(self):
+        self._idle = {}
+        self._evict_timer = None
+        self.stats = {"hits": 0, "misses": 0, "returned": 0, "prewarmed": 0, "evicted": 0}
+
+    def settings(self):
+        return get_config_section("page_pool")
+
+    def checkout(self, profile, url, prewarm=True):
+        """
+        Returns a page showing url, reusing a pooled one when available. prewarm=False
+        is for callers that are not docks (batch and prefetch workers): no standby page
+        is loaded for a window that will never open.
+        """
+        entries = self._idle.get(url)
+        if url and entries:
+            page, _returned_at = entries.pop()
+            self.stats["hits"] += 1
+        else:
+            page = self._new_page(profile, url)
+            self.stats["misses"] += 1
+        print(f"DEBUG: AI Dock page pool checkout {url}: {self.describe_stats()}")
+        if prewarm and self.settings()["prewarm"]:
+            QTimer.singleShot(2000, lambda: self.prewarm(profile, url))
+        return page
+
+    def checkin(self, page, url=None):
+        """Returns a page to the pool, or disposes of it if the pool is full or disabled."""
+        url = url or getattr(page, "_ai_dock_site_url", None)
+        if not url or self.settings()["size"] <= 0:
+            self._dispose(page)
+            return
+        self._add_idle(page, url)
+        self.stats["returned"] += 1
+
+    def retag(self, page, url):
+        """Records that page now shows url (e.g. after switching site in the dock)."""
+        page._ai_dock_site_url = url
+
+    def prewarm(self, profile, url):
+        """Keeps one hot-standby page loaded for url if none is pooled yet."""
+        if not url or self._idle.get(url) or self.settings()["size"] <= 0:
+            return
+        self._add_idle(self._new_page(profile, url), url)
+        self.stats["prewarmed"] += 1
+
+    def idle_pages(self):
+        return [page for entries in self._idle.values() for page, _returned_at in entries]
+
+    def clear(self):
+        """Disposes of every pooled page (used when the profile closes)."""
+        for page in self.idle_pages():
+            self._dispose(page)
+        self._idle = {}
+
+    def describe_stats(self):
+        stats = self.stats
+        lookups = stats["hits"] + stats["misses"]
+        hit_rate = (100.0 * stats["hits"] / lookups) if lookups else 0.0
+        return (f"{stats['hits']} hits, {stats['misses']} misses ({hit_rate:.0f}% hit rate), "
+                f"{stats['prewarmed']} prewarmed, {stats['evicted']} evicted, {len(self.idle_pages())} idle")
+
+    def _new_page(self, profile, url):
+        # Parented to the main window so the page outlives the dock that shows it.
+        page = QWebEnginePage(profile, mw)
+        # Ready (site adapter usable) between loadFinished and the next navigation
+        page._ai_dock_ready = False
+        page.loadStarted.connect(lambda p=page: setattr(p, "_ai_dock_ready", False))
+        page.loadFinished.connect(lambda _ok, p=page: setattr(p, "_ai_dock_ready", True))
+        attach_dock_bridge(page)
+        self.retag(page, url)
+        if url:
+            page.load(QUrl(url))
+        return page
+
+    def _add_idle(self, page, url):
+        size = self.settings()["size"]
+        self._idle.setdefault(url, []).append((page, time.monotonic()))
+        # Keep at most `size` pages, dropping the ones idle for longest
+        entries = sorted(((returned_at, key, p) for key, items in self._idle.items() for p, returned_at in items),
+                         key=lambda entry: entry[0])
+        for _returned_at, key, old_page in entries[:max(0, len(entries) - size)]:
+            self._remove_idle(key, old_page)
+            self._dispose(old_page)
+            self.stats["evicted"] += 1
+        self._ensure_evict_timer()
+
+    def _remove_idle(self, url, page):
+        self._idle[url] = [(p, t) for p, t in self._idle.get(url, []) if p is not page]
+        if not self._idle[url]:
+            del self._idle[url]
+
+    def _ensure_evict_timer(self):
+        if self._evict_timer is None:
+            self._evict_timer = QTimer(mw)
+            self._evict_timer.timeout.connect(self._evict_expired)
+        if not self._evict_timer.isActive():
+            self._evict_timer.start(60 * 1000)
+
+    def _evict_expired(self):
+        timeout = self.settings()["idle_timeout_s"]
+        now = time.monotonic()
+        for url, items in list(self._idle.items()):
+            for page, returned_at in items:
+                if now - returned_at >= timeout:
+                    self._remove_idle(url, page)
+                    self._dispose(page)
+                    self.stats["evicted"] += 1
+        if not self._idle:
+            self._evict_timer.stop()
+
+    @staticmethod
+    def _dispose(page):
+        page.deleteLater()
+
+
+# Istanza globale del pool
+page_pool = WebPagePool()